@@ -0,0 +1,122 @@
+'''
+Number of CoreML layers activation patterns are converted to, compared
+with the number of ONNX operators they are made of.
+
+    python benchmarks/activation_benchmark.py
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+
+from onnx import helper, numpy_helper, TensorProto
+
+from onnx_coreml import convert
+
+
+_SHAPE = (1, 8, 16, 16)
+
+_CONSTANTS = {
+    'zero': 0.0, 'three': 3.0, 'six': 6.0, 'sixth': 1 / 6.0,
+    'slope': 0.1, 'beta': 1.702,
+}
+
+
+def _relu6():
+    return [
+        helper.make_node('Relu', ['input'], ['relu']),
+        helper.make_node('Min', ['relu', 'six'], ['output']),
+    ]
+
+
+def _clip():
+    return [helper.make_node('Clip', ['input'], ['output'], min=0.0, max=6.0)]
+
+
+def _hard_sigmoid():
+    # relu6(x + 3) / 6, as exported by frameworks without HardSigmoid
+    return [
+        helper.make_node('Add', ['input', 'three'], ['shifted']),
+        helper.make_node('Max', ['shifted', 'zero'], ['positive']),
+        helper.make_node('Min', ['positive', 'six'], ['clipped']),
+        helper.make_node('Mul', ['clipped', 'sixth'], ['output']),
+    ]
+
+
+def _hard_swish():
+    return [
+        helper.make_node('Add', ['input', 'three'], ['shifted']),
+        helper.make_node('Relu', ['shifted'], ['positive']),
+        helper.make_node('Min', ['positive', 'six'], ['clipped']),
+        helper.make_node('Div', ['clipped', 'six'], ['gate']),
+        helper.make_node('Mul', ['input', 'gate'], ['output']),
+    ]
+
+
+def _swish():
+    return [
+        helper.make_node('Sigmoid', ['input'], ['gate']),
+        helper.make_node('Mul', ['input', 'gate'], ['output']),
+    ]
+
+
+def _scaled_swish():
+    # x * sigmoid(1.702 * x), GELU approximation
+    return [
+        helper.make_node('Mul', ['input', 'beta'], ['scaled']),
+        helper.make_node('Sigmoid', ['scaled'], ['gate']),
+        helper.make_node('Mul', ['input', 'gate'], ['output']),
+    ]
+
+
+def _leaky_relu():
+    return [
+        helper.make_node('Mul', ['input', 'slope'], ['scaled']),
+        helper.make_node('Max', ['input', 'scaled'], ['output']),
+    ]
+
+
+_PATTERNS = [
+    ('relu6', _relu6),
+    ('clip', _clip),
+    ('hard_sigmoid', _hard_sigmoid),
+    ('hard_swish', _hard_swish),
+    ('swish', _swish),
+    ('scaled_swish', _scaled_swish),
+    ('leaky_relu', _leaky_relu),
+]
+
+
+def _build_model(nodes):
+    used = set(i for n in nodes for i in n.input)
+    initializer = [
+        numpy_helper.from_array(np.array([value], dtype=np.float32), name)
+        for name, value in sorted(_CONSTANTS.items()) if name in used
+    ]
+    graph = helper.make_graph(
+        nodes, 'activation',
+        [helper.make_tensor_value_info(t.name, TensorProto.FLOAT, t.dims)
+         for t in initializer] +
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, _SHAPE)],
+        [helper.make_tensor_value_info('output', TensorProto.FLOAT, _SHAPE)],
+        initializer
+    )
+    return helper.make_model(graph)
+
+
+def main():
+    print('{:<14} {:>6} {:>7}  {}'.format(
+        'pattern', 'onnx', 'coreml', 'layers'))
+    for name, build in _PATTERNS:
+        nodes = build()
+        coreml_model = convert(_build_model(nodes))
+        layers = [l.WhichOneof('layer')
+                  for l in coreml_model.get_spec().neuralNetwork.layers]
+        print('{:<14} {:>6} {:>7}  {}'.format(
+            name, len(nodes), len(layers), ', '.join(layers)))
+
+
+if __name__ == '__main__':
+    main()
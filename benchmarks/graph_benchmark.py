@@ -0,0 +1,120 @@
+'''
+Memory/time benchmark of the Graph IR on a synthetic chain of nodes.
+
+    python benchmarks/graph_benchmark.py [--num-nodes 100000]
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import gc
+import time
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+from onnx_coreml._graph import Node, Graph
+
+
+def _build_chain(num_nodes):
+    nodes = []
+    prev = None
+    for i in range(num_nodes):
+        node = Node(
+            'relu_{}'.format(i), 'Relu', {},
+            ['edge_{}'.format(i)], ['edge_{}'.format(i + 1)]
+        )
+        if prev is not None:
+            node.add_parent(prev)
+        nodes.append(node)
+        prev = node
+    return Graph(
+        nodes, [('edge_0', 1, (1,))],
+        [('edge_{}'.format(num_nodes), 1, (1,))]
+    )
+
+
+def _build_fan_out(num_children):
+    '''
+    One node consumed by many others, the worst case for adjacency
+    membership checks.
+    '''
+    source = Node('source', 'Relu', {}, ['input'], ['source'])
+    for i in range(num_children):
+        child = Node('child_{}'.format(i), 'Relu', {},
+                     ['source'], ['child_{}'.format(i)])
+        source.add_child(child)
+    return source
+
+
+def _remove_every_other_node(graph):
+    '''
+    Mimics what fusers do: detach a node from its neighbours and connect
+    them directly.
+    '''
+    for node in graph.nodes[1::2]:
+        parent = node.get_only_parent()
+        children = list(node.children)
+        parent.children.remove(node)
+        node.parents.remove(parent)
+        for child in children:
+            child.parents.remove(node)
+            if parent not in child.parents:
+                child.add_parent(parent)
+        node.children.clear()
+
+
+def _detach_children(source):
+    '''
+    Detaches children of a fan-out one by one, latest first, as removing
+    consumers of a shared edge does
+    '''
+    for child in reversed(list(source.children)):
+        source.children.remove(child)
+        child.parents.remove(source)
+
+
+def _timed(fn, *args):
+    start = time.time()
+    result = fn(*args)
+    return result, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-nodes', type=int, default=100000)
+    args = parser.parse_args()
+
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    graph, build_time = _timed(_build_chain, args.num_nodes)
+    if tracemalloc is not None:
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('memory:           {:.1f} MB ({:.0f} bytes/node)'.format(
+            memory / 2 ** 20, memory / args.num_nodes))
+    print('build:            {:.3f} s'.format(build_time))
+
+    nodes = graph.nodes
+    _, lookup_time = _timed(
+        lambda: sum(1 for n in nodes[1:] if nodes[0] in n.parents)
+    )
+    print('membership tests: {:.3f} s'.format(lookup_time))
+
+    _, remove_time = _timed(_remove_every_other_node, graph)
+    print('rewire:           {:.3f} s'.format(remove_time))
+
+    num_children = args.num_nodes // 10
+    source, fan_out_time = _timed(_build_fan_out, num_children)
+    print('fan-out {} children: {:.3f} s'.format(num_children, fan_out_time))
+    _, detach_time = _timed(_detach_children, source)
+    print('fan-out detach:   {:.3f} s'.format(detach_time))
+
+
+if __name__ == '__main__':
+    main()
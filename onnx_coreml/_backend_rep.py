@@ -3,10 +3,14 @@ from __future__ import division
 from __future__ import print_function
 # from __future__ import unicode_literals
 
+import sys
+
 import numpy as np
 
 from onnx.backend.base import BackendRep, namedtupledict
 
+from ._spec_executor import SpecExecutor, _feature_shape
+
 
 class CoreMLRep(BackendRep):
     def __init__(self, coreml_model, useCPUOnly=False):
@@ -15,11 +19,26 @@ class CoreMLRep(BackendRep):
         self.useCPUOnly = useCPUOnly
 
         spec = coreml_model.get_spec()
+        self.spec = spec
         self.input_names = [str(i.name) for i in spec.description.input]
         self.output_names = [str(o.name) for o in spec.description.output]
 
+    def _run_numpy(self, inputs):
+        # MLModel.predict is only available on macOS
+        executor = SpecExecutor(self.spec)
+        input_dict = {}
+        for name, input_ in zip(self.input_names, inputs):
+            shape = _feature_shape(executor.inputs[name])
+            input_dict[name] = np.asarray(input_).reshape(shape)
+        prediction = executor.run(input_dict)
+        return [prediction[name] for name in self.output_names]
+
     def run(self, inputs, **kwargs):
         super(CoreMLRep, self).run(inputs, **kwargs)
+        if sys.platform != 'darwin':
+            output_values = self._run_numpy(inputs)
+            return namedtupledict('Outputs',
+                                  self.output_names)(*output_values)
         inputs_ = inputs
         for i, input_ in enumerate(inputs_):
             shape = input_.shape
@@ -3,7 +3,143 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from onnx import numpy_helper
+import sys
+
+from collections import OrderedDict
+
+import numpy as np
+
+from onnx import numpy_helper, TensorProto
+
+if sys.version_info >= (3, 7):
+    # plain dicts preserve insertion order and are more compact
+    _OrderedDict = dict
+else:
+    _OrderedDict = OrderedDict
+
+
+_TENSOR_TYPE_TO_NP_TYPE = {
+    TensorProto.FLOAT: np.dtype('float32'),
+    TensorProto.UINT8: np.dtype('uint8'),
+    TensorProto.INT8: np.dtype('int8'),
+    TensorProto.UINT16: np.dtype('uint16'),
+    TensorProto.INT16: np.dtype('int16'),
+    TensorProto.INT32: np.dtype('int32'),
+    TensorProto.INT64: np.dtype('int64'),
+    TensorProto.BOOL: np.dtype('bool'),
+    TensorProto.FLOAT16: np.dtype('float16'),
+    TensorProto.DOUBLE: np.dtype('float64'),
+    TensorProto.UINT32: np.dtype('uint32'),
+    TensorProto.UINT64: np.dtype('uint64'),
+}
+
+
+class LazyTensor(object):
+    '''
+    Graph initializer that is decoded from its TensorProto only when its
+    values are needed. Shape and dtype are read from the proto without
+    decoding. Tensors stored in raw_data are materialized as read-only
+    np.frombuffer views over it instead of being copied. data, if given, is
+    a buffer (e.g. a memory mapped region) with the raw little-endian tensor
+    data to use instead of the proto contents.
+    '''
+    __slots__ = ('name', 'shape', 'dtype', '_proto', '_data', '_value')
+
+    def __init__(self, proto, data=None):
+        self.name = proto.name
+        self.shape = tuple(proto.dims)
+        self.dtype = _TENSOR_TYPE_TO_NP_TYPE.get(
+            proto.data_type, np.dtype(object)
+        )
+        self._proto = proto
+        self._data = data
+        self._value = None
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    @property
+    def is_materialized(self):
+        return self._value is not None
+
+    def numpy(self):
+        if self._value is None:
+            self._value = self._decode()
+            # values are cached, the proto is not needed anymore
+            self._proto = None
+            self._data = None
+        return self._value
+
+    def _decode(self):
+        proto = self._proto
+        data = self._data
+        if data is None and proto.HasField('raw_data'):
+            data = proto.raw_data
+        if data is None or self.dtype == np.dtype(object):
+            return numpy_helper.to_array(proto)
+        value = np.frombuffer(data, dtype=self.dtype.newbyteorder('<'))
+        if sys.byteorder != 'little':
+            value = value.astype(self.dtype)
+        return value.reshape(self.shape)
+
+    def __array__(self, dtype=None):
+        value = self.numpy()
+        if dtype is not None:
+            return value.astype(dtype)
+        return value
+
+    def __repr__(self):
+        return 'LazyTensor({}, shape={}, dtype={})'.format(
+            self.name, self.shape, self.dtype
+        )
+
+
+class TensorDict(dict):
+    '''
+    Node input tensors by edge name. Values may be stored as LazyTensor and
+    are materialized on access, so lookups always return numpy arrays.
+    Use peek to get shape/dtype without materializing the values.
+    '''
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, LazyTensor):
+            value = value.numpy()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def peek(self, key):
+        '''
+        Returns stored value (array or LazyTensor) without materializing it
+        '''
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return dict.pop(self, key, *default)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def copy(self):
+        return TensorDict(
+            (key, dict.__getitem__(self, key)) for key in self
+        )
 
 
 def _input_from_onnx_input(input):
@@ -46,35 +182,156 @@ class Attributes(dict):
         return d
 
 
+# NodeSet keeps up to this many nodes in a tuple. Scanning a tuple that short
+# is as fast as hashing and takes much less memory than a dict.
+_NODE_SET_TUPLE_SIZE = 8
+
+
+class NodeSet(object):
+    '''
+    Insertion ordered set of nodes used for parents/children adjacency.
+    Membership checks, appends and removals are O(1). Unlike a list it
+    can't be indexed, first() returns the earliest added node.
+    '''
+    __slots__ = ('_nodes',)
+
+    # _nodes is None when empty and the node itself when it holds one (most
+    # nodes have a single parent and child), otherwise a tuple of up to
+    # _NODE_SET_TUPLE_SIZE nodes or a dict of them
+
+    def __init__(self, nodes=()):
+        self._nodes = None
+        self.extend(nodes)
+
+    def append(self, node):
+        nodes = self._nodes
+        if nodes is None:
+            self._nodes = node
+            return
+        type_ = type(nodes)
+        if type_ is tuple:
+            if node in nodes:
+                return
+            if len(nodes) < _NODE_SET_TUPLE_SIZE:
+                self._nodes = nodes + (node,)
+                return
+            nodes = self._nodes = _OrderedDict.fromkeys(nodes)
+        elif type_ is not _OrderedDict:
+            if node is not nodes:
+                self._nodes = (nodes, node)
+            return
+        nodes[node] = None
+
+    add = append
+
+    def extend(self, nodes):
+        for node in nodes:
+            self.append(node)
+
+    def remove(self, node):
+        nodes = self._nodes
+        type_ = type(nodes)
+        if type_ is tuple:
+            if node in nodes:
+                i = nodes.index(node)
+                nodes = nodes[:i] + nodes[i + 1:]
+                self._nodes = nodes if len(nodes) > 1 else nodes[0]
+                return
+        elif type_ is _OrderedDict:
+            if node in nodes:
+                del nodes[node]
+                return
+        elif nodes is node and node is not None:
+            self._nodes = None
+            return
+        raise ValueError('Node ({}) is not in set'.format(node))
+
+    def discard(self, node):
+        if node in self:
+            self.remove(node)
+
+    def clear(self):
+        self._nodes = None
+
+    def first(self):
+        for node in self:
+            return node
+        raise IndexError('NodeSet is empty')
+
+    def __contains__(self, node):
+        nodes = self._nodes
+        type_ = type(nodes)
+        if type_ is tuple or type_ is _OrderedDict:
+            return node in nodes
+        return nodes is node and node is not None
+
+    def __iter__(self):
+        nodes = self._nodes
+        type_ = type(nodes)
+        if type_ is tuple or type_ is _OrderedDict:
+            return iter(nodes)
+        return iter(() if nodes is None else (nodes,))
+
+    def __len__(self):
+        nodes = self._nodes
+        type_ = type(nodes)
+        if type_ is tuple or type_ is _OrderedDict:
+            return len(nodes)
+        return 0 if nodes is None else 1
+
+    def __repr__(self):
+        return 'NodeSet({})'.format(list(self))
+
+
 class Node(object):
+    __slots__ = (
+        'name', 'op_type', 'attrs', 'inputs', 'outputs', 'input_tensors',
+        'parents', 'children', 'metadata', '__weakref__'
+    )
+
     def __init__(self, name, op_type, attrs, inputs, outputs):
         self.name = name
         self.op_type = op_type
         self.attrs = attrs
         self.inputs = inputs
         self.outputs = outputs
-        self.input_tensors = {}
-        self.parents = []
-        self.children = []
+        self.input_tensors = TensorDict()
+        self.parents = NodeSet()
+        self.children = NodeSet()
         self.metadata = {}
 
     def add_parent(self, parent_node):
         assert parent_node not in self.parents
         self.parents.append(parent_node)
-        if self not in parent_node.children:
-            parent_node.children.append(self)
+        parent_node.children.append(self)
 
     def add_child(self, child_node):
         assert child_node not in self.children
         self.children.append(child_node)
-        if self not in child_node.parents:
-            child_node.parents.append(self)
+        child_node.parents.append(self)
+
+    def get_parent(self, input_name):
+        '''
+        Returns parent node producing input_name or None if input_name is
+        graph input or initializer
+        '''
+        for parent in self.parents:
+            if input_name in parent.outputs:
+                return parent
+        return None
+
+    def get_children(self, output_name):
+        '''
+        Returns children nodes consuming output_name
+        '''
+        return [child for child in self.children
+                if output_name in child.inputs]
 
     def get_only_parent(self):
         if len(self.parents) != 1:
             raise ValueError('Node ({}) expected to have 1 parent. Found {}.'
                              .format(self, len(self.parents)))
-        return self.parents[0]
+        return self.parents.first()
 
     @staticmethod
     def from_onnx(node):
@@ -89,9 +346,94 @@ class Node(object):
 
 class Graph(object):
     def __init__(self, nodes, inputs, outputs):
-        self.nodes = nodes
         self.inputs = inputs
         self.outputs = outputs
+        # Number of references to every edge name used by graph
+        # inputs/outputs and nodes inputs/outputs. Edge names created with
+        # get_unique_edge_name are reserved here as well, so the index is
+        # always a superset of the names in use.
+        self._edge_names = {}
+        # Next suffix to try for every name passed to get_unique_edge_name
+        self._edge_name_counters = {}
+        self._index_edge_names([i[0] for i in inputs])
+        self._index_edge_names([o[0] for o in outputs])
+        self._set_nodes(nodes)
+
+    def _set_nodes(self, nodes):
+        self._nodes = nodes
+        # Nodes currently in the graph, for O(1) membership checks
+        self._members = _OrderedDict.fromkeys(nodes)
+        # op_type -> nodes of this type
+        self._nodes_by_op_type = {}
+        # Nodes added with add_node(before=...)/add_node(after=...) and
+        # removed nodes are spliced into the nodes list on next access
+        self._inserted_before = {}
+        self._inserted_after = {}
+        self._dirty = False
+        for node in nodes:
+            self._index_op_type(node)
+            self._index_edge_names(node.inputs)
+            self._index_edge_names(node.outputs)
+
+    @property
+    def nodes(self):
+        '''
+        Nodes in topological order
+        '''
+        if self._dirty:
+            self._compact()
+        return self._nodes
+
+    @nodes.setter
+    def nodes(self, nodes):
+        self._edge_names = {}
+        self._index_edge_names([i[0] for i in self.inputs])
+        self._index_edge_names([o[0] for o in self.outputs])
+        self._set_nodes(nodes)
+
+    def _compact(self):
+        nodes = []
+        seen = set()
+
+        def append(node):
+            if node in self._members and node not in seen:
+                seen.add(node)
+                nodes.append(node)
+
+        for node in self._nodes:
+            for n in self._inserted_before.get(node, []):
+                append(n)
+            append(node)
+            for n in self._inserted_after.get(node, []):
+                append(n)
+        self._nodes = nodes
+        self._inserted_before = {}
+        self._inserted_after = {}
+        self._dirty = False
+
+    def _index_op_type(self, node):
+        if node.op_type not in self._nodes_by_op_type:
+            self._nodes_by_op_type[node.op_type] = _OrderedDict()
+        self._nodes_by_op_type[node.op_type][node] = None
+
+    def _index_edge_names(self, names):
+        for name in names:
+            self._edge_names[name] = self._edge_names.get(name, 0) + 1
+
+    def _unindex_edge_names(self, names):
+        for name in names:
+            count = self._edge_names.get(name, 0) - 1
+            if count > 0:
+                self._edge_names[name] = count
+            else:
+                self._edge_names.pop(name, None)
+
+    def __contains__(self, node):
+        return node in self._members
+
+    @property
+    def num_nodes(self):
+        return len(self._members)
 
     def transformed(self, transformers):
         graph = self
@@ -99,33 +441,205 @@ class Graph(object):
             graph = transformer(graph)
         return graph
 
+    def get_nodes_by_op_type(self, op_types):
+        '''
+        Returns nodes with one of op_types (str or sequence of str) without
+        scanning the whole graph
+        '''
+        if not isinstance(op_types, (list, tuple, set, frozenset)):
+            op_types = [op_types]
+        nodes = []
+        for op_type in op_types:
+            for node in self._nodes_by_op_type.get(op_type, ()):
+                # op_type of nodes may be changed in place
+                if node.op_type == op_type and node in self._members:
+                    nodes.append(node)
+        return nodes
+
+    def is_output(self, name):
+        return any(o[0] == name for o in self.outputs)
+
+    def add_node(self, node, before=None, after=None):
+        '''
+        Add node to the graph and register its edge names. Node is appended
+        to the end of the graph unless it should go right before or after
+        some node of the graph. Nodes links are not modified.
+        '''
+        if before is not None:
+            self._inserted_before.setdefault(before, []).append(node)
+            self._dirty = True
+        elif after is not None:
+            self._inserted_after.setdefault(after, []).append(node)
+            self._dirty = True
+        else:
+            self._nodes.append(node)
+        self._members[node] = None
+        self._index_op_type(node)
+        self._index_edge_names(node.inputs)
+        self._index_edge_names(node.outputs)
+
+    def remove_node(self, node):
+        '''
+        Remove node from the graph, detach it from its parents and children
+        and unregister its edge names. It takes O(1), the nodes list is
+        updated on next access.
+        '''
+        del self._members[node]
+        self._dirty = True
+        for parent in node.parents:
+            parent.children.remove(node)
+        for child in node.children:
+            child.parents.remove(node)
+        node.parents.clear()
+        node.children.clear()
+        self._unindex_edge_names(node.inputs)
+        self._unindex_edge_names(node.outputs)
+
+    def fuse_nodes(self, parent, child):
+        '''
+        Fuse child node into its parent: parent takes over outputs and
+        children of child and child is removed from the graph. parent
+        outputs must be used only by child.
+        '''
+        children = list(child.children)
+        self.remove_node(child)
+        self._unindex_edge_names(parent.outputs)
+        parent.outputs = list(child.outputs)
+        self._index_edge_names(parent.outputs)
+        for c in children:
+            if c not in parent.children:
+                parent.add_child(c)
+
+    def bypass_node(self, node):
+        '''
+        Remove node with a single output connecting its first input directly
+        to its consumers. If node output is a graph output, the edge node
+        reads is renamed to it, so its producer writes graph output
+        directly. Returns False if node can't be bypassed: when it connects
+        a graph input or another graph output to graph output.
+        '''
+        input_ = node.inputs[0]
+        output = node.outputs[0]
+        parent = node.get_parent(input_)
+        if self.is_output(output):
+            if parent is None or self.is_output(input_):
+                return False
+            children = list(node.children)
+            self.remove_node(node)
+            self.rename_edge(input_, output)
+            for child in children:
+                if child not in parent.children:
+                    parent.add_child(child)
+            return True
+
+        children = list(node.children)
+        self.remove_node(node)
+        for child in children:
+            for i, name in enumerate(child.inputs):
+                if name != output:
+                    continue
+                child.inputs[i] = input_
+                self._unindex_edge_names([output])
+                self._index_edge_names([input_])
+            if input_ in node.input_tensors:
+                child.input_tensors[input_] = \
+                    node.input_tensors.peek(input_)
+            if parent is not None and child not in parent.children:
+                parent.add_child(child)
+        return True
+
+    def insert_node_after(self, node, new_node):
+        '''
+        Insert new_node with a single input and output right after node:
+        new_node takes over node output name and consumers and node output
+        is renamed to new_node input.
+        '''
+        children = list(node.children)
+        for child in children:
+            child.parents.remove(node)
+        node.children.clear()
+        self._unindex_edge_names(node.outputs)
+        node.outputs = [new_node.inputs[0]]
+        self._index_edge_names(node.outputs)
+        self.add_node(new_node, after=node)
+        node.add_child(new_node)
+        for child in children:
+            new_node.add_child(child)
+
+    def set_inputs(self, node, inputs):
+        '''
+        Replace input names of node keeping edge names index up to date.
+        Nodes links are not modified.
+        '''
+        self._unindex_edge_names(node.inputs)
+        node.inputs = list(inputs)
+        self._index_edge_names(node.inputs)
+
+    def reindex_node(self, node):
+        '''
+        Update op_type index after op_type of node was changed in place
+        '''
+        self._index_op_type(node)
+
+    def rename_edge(self, name, new_name):
+        '''
+        Rename edge everywhere it is used: graph inputs/outputs and nodes
+        inputs/outputs
+        '''
+        def rename(names):
+            for i, n in enumerate(names):
+                if n == name:
+                    names[i] = new_name
+                    self._unindex_edge_names([name])
+                    self._index_edge_names([new_name])
+
+        for i, input_ in enumerate(self.inputs):
+            if input_[0] == name:
+                self.inputs[i] = (new_name,) + tuple(input_[1:])
+                self._unindex_edge_names([name])
+                self._index_edge_names([new_name])
+        for i, output in enumerate(self.outputs):
+            if output[0] == name:
+                self.outputs[i] = (new_name,) + tuple(output[1:])
+                self._unindex_edge_names([name])
+                self._index_edge_names([new_name])
+        for node in self.nodes:
+            rename(node.inputs)
+            rename(node.outputs)
+
     def has_edge_name(self, name):
         '''
         Check if name is already used for graph inputs/outputs or for nodes
         inputs/outputs
         '''
-        names = set()
-        for input in self.inputs:
-            names.add(input[0])
-        for output in self.outputs:
-            names.add(output[0])
-        for node in self.nodes:
-            names.update(node.inputs)
-            names.update(node.outputs)
-        return name in names
+        return name in self._edge_names
 
     def get_unique_edge_name(self, name):
+        '''
+        Returns name (or name with numeric suffix) which is not used in
+        the graph yet and reserves it
+        '''
         n_ = name
-        i = 0
+        i = self._edge_name_counters.get(name, 0)
         while self.has_edge_name(n_):
             n_ = "{}_{}".format(name, i)
             i += 1
+        self._edge_name_counters[name] = i
+        self._index_edge_names([n_])
         return n_
 
     @staticmethod
-    def from_onnx(graph):
+    def from_onnx(graph, tensor_data=None):
+        '''
+        Build graph from ONNX GraphProto. tensor_data optionally maps
+        initializer names to buffers with their raw data (see
+        onnx_coreml._loader.load_model).
+        '''
+        if tensor_data is None:
+            tensor_data = {}
         input_tensors = {
-            t.name: numpy_helper.to_array(t) for t in graph.initializer
+            t.name: LazyTensor(t, tensor_data.get(t.name))
+            for t in graph.initializer
         }
         nodes_ = []
         nodes_by_input = {}
@@ -0,0 +1,164 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+
+from ._numpy_ops import _run_node
+
+
+class _NotBatchable(Exception):
+    pass
+
+
+def _axis(axis, ndim):
+    return axis + ndim if axis < 0 else axis
+
+
+def _preserves_batch(node, inputs):
+    '''
+    Whether node computes every sample along axis 0 of its inputs
+    independently, so a batch can be stacked along that axis
+    '''
+    op_type = node.op_type
+    ndim = np.ndim(inputs[0])
+    if op_type == 'Transpose':
+        perm = node.attrs.get('perm')
+        if perm is None:
+            return ndim < 2
+        return perm[0] == 0
+    if op_type in ('Concat', 'Softmax'):
+        return _axis(node.attrs.get('axis', 1), ndim) != 0
+    if op_type == 'Split':
+        return _axis(node.attrs.get('axis', 0), ndim) != 0
+    if op_type == 'Slice':
+        starts = node.attrs['starts']
+        axes = node.attrs.get('axes', list(range(len(starts))))
+        return 0 not in [_axis(a, ndim) for a in axes]
+    if op_type == 'Gemm':
+        return not node.attrs.get('transA', 0)
+    if op_type == 'FC':
+        return node.attrs.get('axis', 1) != 0
+    if op_type == 'Pad':
+        paddings = node.attrs['paddings']
+        num_axes = len(paddings) // 2
+        return num_axes < ndim or \
+            (paddings[0] == 0 and paddings[num_axes] == 0)
+    return True
+
+
+def _run_reshape(node, x, batch):
+    '''
+    Reshape every one of batch samples stacked along axis 0 of x
+    '''
+    samples = x.reshape((batch, x.shape[0] // batch) + x.shape[1:])
+    shape = list(node.attrs['shape'])
+    for i, d in enumerate(shape):
+        if d == 0:
+            shape[i] = samples.shape[i + 1]
+    y = samples.reshape([batch] + shape)
+    if y.ndim == 1:
+        raise _NotBatchable()
+    return y.reshape((-1,) + y.shape[2:])
+
+
+class GraphExecutor(object):
+    '''
+    Runs Graph with NumPy implementations of its nodes (see
+    onnx_coreml._numpy_ops), before or after any transformers.
+    Inputs may stack several samples along axis 0, e.g. (8, 3, H, W) for
+    an input declared as (1, 3, H, W): all samples are computed at once
+    while nodes keep them independent, Reshapes are applied per sample.
+    Graphs mixing samples, e.g. with Transpose of axis 0, are run sample
+    by sample.
+    '''
+    def __init__(self, graph):
+        self.graph = graph
+
+    def _batched_inputs(self, inputs):
+        '''
+        Returns number of samples stacked in inputs and names of inputs
+        holding more than one sample
+        '''
+        batch = 1
+        names = []
+        for name, _, shape in self.graph.inputs:
+            value = inputs[name]
+            if len(shape) == 0 or shape[0] <= 0 or \
+                    value.ndim != len(shape) or value.shape[0] == shape[0]:
+                continue
+            if value.shape[0] % shape[0] != 0:
+                raise ValueError(
+                    "Input {} of shape {} is not a batch of {}".format(
+                        name, value.shape, shape
+                    )
+                )
+            if names and value.shape[0] // shape[0] != batch:
+                raise ValueError("Inputs have different batch sizes")
+            batch = value.shape[0] // shape[0]
+            names.append(name)
+        return batch, names
+
+    def _run(self, inputs, batch, batched):
+        values = dict(inputs)
+        batched = set(batched)
+        for node in self.graph.nodes:
+            node_inputs = [
+                values[i] if i in values else node.input_tensors[i]
+                for i in node.inputs
+            ]
+            is_batched = any(i in batched for i in node.inputs)
+            if not is_batched or batch == 1:
+                outputs = _run_node(node, node_inputs)
+            elif node.op_type == 'Reshape':
+                outputs = [_run_reshape(node, node_inputs[0], batch)]
+            elif _preserves_batch(node, node_inputs):
+                outputs = _run_node(node, node_inputs)
+            else:
+                raise _NotBatchable()
+            values.update(zip(node.outputs, outputs))
+            if is_batched:
+                batched.update(node.outputs)
+        return values, batched
+
+    def run_values(self, inputs):
+        '''
+        Returns dict of values of all edges of the graph, including inputs,
+        for dict of graph inputs
+        '''
+        inputs = dict((name, np.asarray(value))
+                      for name, value in inputs.items())
+        for name, _, _ in self.graph.inputs:
+            if name not in inputs:
+                raise ValueError("Input {} is missing".format(name,))
+        batch, names = self._batched_inputs(inputs)
+        try:
+            values, _ = self._run(inputs, batch, names)
+            return values
+        except _NotBatchable:
+            pass
+
+        samples = [dict(inputs) for _ in range(batch)]
+        for name in names:
+            for sample, value in zip(samples, np.split(inputs[name], batch)):
+                sample[name] = value
+        runs = [self._run(sample, 1, names) for sample in samples]
+        values, batched = runs[0]
+        for name in batched:
+            values[name] = np.concatenate([v[name] for v, _ in runs])
+        return values
+
+    def run(self, inputs):
+        '''
+        Returns dict of graph outputs for dict of graph inputs
+        '''
+        values = self.run_values(inputs)
+        return dict((o[0], values[o[0]]) for o in self.graph.outputs)
+
+
+def run_graph(graph, inputs):
+    '''
+    Runs graph with NumPy, see GraphExecutor
+    '''
+    return GraphExecutor(graph).run(inputs)
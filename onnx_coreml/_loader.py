@@ -0,0 +1,190 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import mmap
+import os
+
+import onnx
+
+from onnx import TensorProto
+
+# Protobuf wire types
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+# Field numbers of the messages we need to look into
+_MODEL_GRAPH = 7
+_GRAPH_INITIALIZER = 5
+_TENSOR_RAW_DATA = 9
+
+
+def _byte(buf, pos):
+    b = buf[pos]
+    if not isinstance(b, int):  # python 2
+        b = ord(b)
+    return b
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = _byte(buf, pos)
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _encode_varint(value):
+    out = bytearray()
+    while True:
+        b = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _iter_fields(buf, start, end):
+    '''
+    Yields (field_number, wire_type, field_start, value_start, value_end) for
+    every field of the message serialized in buf[start:end]
+    '''
+    pos = start
+    while pos < end:
+        field_start = pos
+        tag, pos = _read_varint(buf, pos)
+        field_number, wire_type = tag >> 3, tag & 0x7
+        if wire_type == _VARINT:
+            _, value_end = _read_varint(buf, pos)
+        elif wire_type == _FIXED64:
+            value_end = pos + 8
+        elif wire_type == _FIXED32:
+            value_end = pos + 4
+        elif wire_type == _LENGTH_DELIMITED:
+            length, pos = _read_varint(buf, pos)
+            value_end = pos + length
+        else:
+            raise ValueError(
+                "Unsupported protobuf wire type {}".format(wire_type,)
+            )
+        yield field_number, wire_type, field_start, pos, value_end
+        pos = value_end
+
+
+def _submessage(field_number, payload):
+    tag = (field_number << 3) | _LENGTH_DELIMITED
+    return _encode_varint(tag) + _encode_varint(len(payload)) + payload
+
+
+def _strip_tensor(buf, start, end, spans):
+    parts = []
+    span = None
+    for number, _, field_start, value_start, value_end in \
+            _iter_fields(buf, start, end):
+        if number == _TENSOR_RAW_DATA:
+            span = (value_start, value_end)
+        else:
+            parts.append(buf[field_start:value_end].tobytes())
+    spans.append(span)
+    return b''.join(parts)
+
+
+def _strip_graph(buf, start, end, spans):
+    parts = []
+    for number, wire_type, field_start, value_start, value_end in \
+            _iter_fields(buf, start, end):
+        if number == _GRAPH_INITIALIZER and wire_type == _LENGTH_DELIMITED:
+            tensor = _strip_tensor(buf, value_start, value_end, spans)
+            parts.append(_submessage(_GRAPH_INITIALIZER, tensor))
+        else:
+            parts.append(buf[field_start:value_end].tobytes())
+    return b''.join(parts)
+
+
+def _strip_model(buf, spans):
+    '''
+    Returns serialized ModelProto without initializers raw_data. The
+    (start, end) offset of every initializer raw_data in buf is appended to
+    spans, in the order initializers appear in the graph (None for
+    initializers without raw_data).
+    '''
+    parts = []
+    for number, wire_type, field_start, value_start, value_end in \
+            _iter_fields(buf, 0, len(buf)):
+        if number == _MODEL_GRAPH and wire_type == _LENGTH_DELIMITED:
+            graph = _strip_graph(buf, value_start, value_end, spans)
+            parts.append(_submessage(_MODEL_GRAPH, graph))
+        else:
+            parts.append(buf[field_start:value_end].tobytes())
+    return b''.join(parts)
+
+
+def _mmap_file(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _external_data(tensor, base_dir, mapped_files):
+    info = {entry.key: entry.value for entry in tensor.external_data}
+    if 'location' not in info:
+        raise ValueError(
+            "External data location is missing for tensor {}"
+            .format(tensor.name,)
+        )
+    path = os.path.join(base_dir, info['location'])
+    if path not in mapped_files:
+        mapped_files[path] = _mmap_file(path)
+    buf = mapped_files[path]
+    offset = int(info.get('offset', 0))
+    if 'length' in info:
+        end = offset + int(info['length'])
+    else:
+        end = len(buf)
+    if end > len(buf):
+        raise ValueError(
+            "External data of tensor {} is out of {} bounds"
+            .format(tensor.name, path)
+        )
+    return buf[offset:end]
+
+
+def load_model(path):
+    '''
+    Load ONNX model without reading weights into memory.
+
+    Only the graph structure is parsed. Initializer payloads, both raw_data
+    regions of the model file and ONNX external data files, are memory
+    mapped, so weights are paged in on demand when converters use them.
+    This also allows loading models bigger than the 2GB protobuf limit.
+
+    Returns a (model, tensor_data) tuple: ModelProto whose initializers
+    have no raw_data and a dict mapping initializer names to buffers with
+    their raw little-endian data, suitable for Graph.from_onnx.
+    '''
+    buf = _mmap_file(path)
+    spans = []
+    model = onnx.ModelProto()
+    model.ParseFromString(_strip_model(buf, spans))
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    mapped_files = {}
+    tensor_data = {}
+    for tensor, span in zip(model.graph.initializer, spans):
+        if span is not None:
+            tensor_data[tensor.name] = buf[span[0]:span[1]]
+        elif tensor.data_location == TensorProto.EXTERNAL:
+            tensor_data[tensor.name] = _external_data(
+                tensor, base_dir, mapped_files
+            )
+    return model, tensor_data
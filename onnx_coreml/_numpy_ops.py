@@ -0,0 +1,352 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+
+from numpy.lib.stride_tricks import as_strided
+
+
+def _broadcast_operand(node, a, b):
+    '''
+    Align b with a according to legacy ONNX broadcasting: with 'axis' set b
+    dimensions start at that axis of a, otherwise they are aligned to the
+    trailing dimensions (plain numpy broadcasting)
+    '''
+    if node.attrs.get('broadcast', 0) != 1 or 'axis' not in node.attrs:
+        return b
+    b = np.asarray(b)
+    axis = node.attrs['axis']
+    if axis < 0:
+        axis += a.ndim
+    trailing = a.ndim - axis - b.ndim
+    if trailing > 0:
+        b = b.reshape(b.shape + (1,) * trailing)
+    return b
+
+
+def _run_elementwise(fn, node, inputs):
+    result = inputs[0]
+    for input_ in inputs[1:]:
+        result = fn(result, _broadcast_operand(node, result, input_))
+    return [result]
+
+
+def _spatial_pads(node):
+    # ONNX pads: [top, left, bottom, right]
+    pads = node.attrs.get('pads', [0, 0, 0, 0])
+    return pads[0], pads[2], pads[1], pads[3]
+
+
+def _windows(x, kernel_shape, strides, dilations=(1, 1)):
+    '''
+    Returns read-only (N, C, out_h, out_w, kernel_h, kernel_w) view of
+    sliding windows of already padded NCHW x
+    '''
+    n, c, h, w = x.shape
+    kh, kw = kernel_shape
+    sh, sw = strides
+    dh, dw = dilations
+    out_h = (h - dh * (kh - 1) - 1) // sh + 1
+    out_w = (w - dw * (kw - 1) - 1) // sw + 1
+    s = x.strides
+    return as_strided(
+        x,
+        shape=(n, c, out_h, out_w, kh, kw),
+        strides=(s[0], s[1], s[2] * sh, s[3] * sw, s[2] * dh, s[3] * dw),
+        writeable=False
+    )
+
+
+def _pad_spatial(x, node, value=0.0):
+    pad_t, pad_b, pad_l, pad_r = _spatial_pads(node)
+    if pad_t == pad_b == pad_l == pad_r == 0:
+        return x
+    return np.pad(
+        x, ((0, 0), (0, 0), (pad_t, pad_b), (pad_l, pad_r)),
+        mode='constant', constant_values=value
+    )
+
+
+def _run_conv(node, inputs):
+    x, W = inputs[0], inputs[1]
+    if x.ndim != 4:
+        raise NotImplementedError("Only 2d convolution is supported")
+    group = node.attrs.get('group', 1)
+    kernel_shape = node.attrs.get('kernel_shape', W.shape[2:])
+    strides = node.attrs.get('strides', [1, 1])
+    dilations = node.attrs.get('dilations', [1, 1])
+
+    cols = _windows(_pad_spatial(x, node), kernel_shape, strides, dilations)
+    n, c, out_h, out_w, kh, kw = cols.shape
+    cols = cols.reshape(n, group, c // group, out_h, out_w, kh, kw)
+    W_ = W.reshape((group, W.shape[0] // group) + W.shape[1:])
+    y = np.einsum('ngcyxij,gocij->ngoyx', cols, W_, optimize=True)
+    y = y.reshape(n, W.shape[0], out_h, out_w)
+    if len(inputs) > 2:
+        y = y + inputs[2].reshape(-1, 1, 1)
+    return [y.astype(x.dtype)]
+
+
+def _run_pool(node, inputs):
+    x = inputs[0]
+    if node.op_type.startswith('Global'):
+        if node.op_type == 'GlobalMaxPool':
+            return [x.max(axis=(2, 3), keepdims=True)]
+        return [x.mean(axis=(2, 3), keepdims=True)]
+
+    kernel_shape = node.attrs['kernel_shape']
+    strides = node.attrs.get('strides', [1, 1])
+    if node.op_type == 'MaxPool':
+        cols = _windows(_pad_spatial(x, node, -np.inf), kernel_shape, strides)
+        return [cols.max(axis=(4, 5))]
+
+    cols = _windows(_pad_spatial(x, node), kernel_shape, strides)
+    y = cols.sum(axis=(4, 5))
+    if node.attrs.get('count_include_pad', 0):
+        count = kernel_shape[0] * kernel_shape[1]
+    else:
+        ones = np.ones((1, 1) + x.shape[2:], dtype=x.dtype)
+        count = _windows(_pad_spatial(ones, node), kernel_shape, strides) \
+            .sum(axis=(4, 5))
+    return [(y / count).astype(x.dtype)]
+
+
+def _run_relu(node, inputs):
+    return [np.maximum(inputs[0], 0)]
+
+
+def _run_leaky_relu(node, inputs):
+    x = inputs[0]
+    alpha = node.attrs.get('alpha', 0.01)
+    return [np.where(x >= 0, x, x * alpha).astype(x.dtype)]
+
+
+def _run_sigmoid(node, inputs):
+    x = inputs[0]
+    return [(1.0 / (1.0 + np.exp(-x))).astype(x.dtype)]
+
+
+def _run_hard_sigmoid(node, inputs):
+    x = inputs[0]
+    alpha = node.attrs.get('alpha', 0.2)
+    beta = node.attrs.get('beta', 0.5)
+    return [np.clip(alpha * x + beta, 0, 1).astype(x.dtype)]
+
+
+def _run_clip(node, inputs):
+    x = inputs[0]
+    low = node.attrs.get('min', -np.inf)
+    high = node.attrs.get('max', np.inf)
+    return [np.clip(x, low, high).astype(x.dtype)]
+
+
+def _run_abs(node, inputs):
+    return [np.abs(inputs[0])]
+
+
+def _run_reshape(node, inputs):
+    x = inputs[0]
+    shape = list(node.attrs['shape'])
+    for i, d in enumerate(shape):
+        if d == 0:
+            shape[i] = x.shape[i]
+    return [x.reshape(shape)]
+
+
+def _run_transpose(node, inputs):
+    x = inputs[0]
+    perm = node.attrs.get('perm')
+    return [np.transpose(x, perm)]
+
+
+def _run_fc(node, inputs):
+    x, W = inputs[0], inputs[1]
+    axis = node.attrs.get('axis', 1)
+    x = x.reshape(int(np.prod(x.shape[:axis])), -1)
+    y = np.dot(x, W.T)
+    if len(inputs) > 2:
+        y = y + inputs[2]
+    return [y.astype(inputs[0].dtype)]
+
+
+def _run_gemm(node, inputs):
+    A, B = inputs[0], inputs[1]
+    if A.ndim > 2:
+        A = A.reshape(A.shape[0], -1)
+    if node.attrs.get('transA', 0):
+        A = A.T
+    if node.attrs.get('transB', 0):
+        B = B.T
+    y = node.attrs.get('alpha', 1.0) * np.dot(A, B)
+    if len(inputs) > 2:
+        y = y + node.attrs.get('beta', 1.0) * inputs[2]
+    return [y.astype(inputs[0].dtype)]
+
+
+def _run_bn(node, inputs):
+    x, scale, bias, mean, var = inputs[:5]
+    epsilon = node.attrs.get('epsilon', 1e-5)
+    shape = (-1,) + (1,) * (x.ndim - 2)
+    a = scale / np.sqrt(var + epsilon)
+    b = bias - mean * a
+    return [(x * a.reshape(shape) + b.reshape(shape)).astype(x.dtype)]
+
+
+def _run_add(node, inputs):
+    return _run_elementwise(np.add, node, inputs)
+
+
+def _run_mul(node, inputs):
+    return _run_elementwise(np.multiply, node, inputs)
+
+
+def _run_sub(node, inputs):
+    return _run_elementwise(np.subtract, node, inputs)
+
+
+def _run_div(node, inputs):
+    return _run_elementwise(np.divide, node, inputs)
+
+
+def _run_min(node, inputs):
+    return _run_elementwise(np.minimum, node, inputs)
+
+
+def _run_max(node, inputs):
+    return _run_elementwise(np.maximum, node, inputs)
+
+
+def _run_concat(node, inputs):
+    return [np.concatenate(inputs, axis=node.attrs.get('axis', 1))]
+
+
+def _run_softmax(node, inputs):
+    x = inputs[0]
+    axis = node.attrs.get('axis', 1)
+    x_ = x.reshape(int(np.prod(x.shape[:axis])), -1)
+    e = np.exp(x_ - x_.max(axis=1, keepdims=True))
+    y = e / e.sum(axis=1, keepdims=True)
+    return [y.reshape(x.shape).astype(x.dtype)]
+
+
+def _run_lrn(node, inputs):
+    x = inputs[0]
+    alpha = node.attrs['alpha']
+    beta = node.attrs['beta']
+    bias = node.attrs.get('bias', 1.0)
+    size = node.attrs['size']
+    pad_before = (size - 1) // 2
+    pad_after = size - 1 - pad_before
+    squared = np.pad(
+        np.square(x), ((0, 0), (pad_before, pad_after), (0, 0), (0, 0)),
+        mode='constant'
+    )
+    cumsum = np.cumsum(squared, axis=1)
+    cumsum = np.concatenate(
+        [np.zeros_like(cumsum[:, :1]), cumsum], axis=1
+    )
+    square_sum = cumsum[:, size:] - cumsum[:, :-size]
+    return [(x / (bias + alpha / size * square_sum) ** beta).astype(x.dtype)]
+
+
+def _run_pad(node, inputs):
+    x = inputs[0]
+    # paddings are [x1_begin, x2_begin, ..., x1_end, x2_end, ...], shorter
+    # paddings than twice the rank pad trailing dimensions
+    paddings = node.attrs['paddings']
+    num_axes = len(paddings) // 2
+    pad_width = [(0, 0)] * (x.ndim - num_axes) + list(
+        zip(paddings[:num_axes], paddings[num_axes:])
+    )
+    mode = node.attrs.get('mode', 'constant')
+    if isinstance(mode, bytes):
+        mode = mode.decode('utf-8')
+    if mode == 'constant':
+        return [np.pad(x, pad_width, mode='constant',
+                       constant_values=node.attrs.get('value', 0.0))]
+    if mode == 'edge':
+        return [np.pad(x, pad_width, mode='edge')]
+    return [np.pad(x, pad_width, mode='reflect')]
+
+
+def _run_slice(node, inputs):
+    x = inputs[0]
+    starts = node.attrs['starts']
+    ends = node.attrs['ends']
+    axes = node.attrs.get('axes', list(range(len(starts))))
+    index = [slice(None)] * x.ndim
+    for axis, start, end in zip(axes, starts, ends):
+        index[axis] = slice(start, end)
+    return [x[tuple(index)]]
+
+
+def _run_split(node, inputs):
+    x = inputs[0]
+    axis = node.attrs.get('axis', 0)
+    split = node.attrs.get('split')
+    if split is None:
+        return np.split(x, len(node.outputs), axis=axis)
+    return np.split(x, np.cumsum(split)[:-1], axis=axis)
+
+
+def _run_constant(node, inputs):
+    return [np.asarray(node.attrs['value'])]
+
+
+_NUMPY_OP_REGISTRY = {
+    "Conv": _run_conv,
+    "Relu": _run_relu,
+    "Reshape": _run_reshape,
+    "Transpose": _run_transpose,
+    "MaxPool": _run_pool,
+    "AveragePool": _run_pool,
+    "FC": _run_fc,
+    "BatchNormalization": _run_bn,
+    "SpatialBN": _run_bn,
+    "Add": _run_add,
+    "Sum": _run_add,
+    "Mul": _run_mul,
+    "Sub": _run_sub,
+    "Div": _run_div,
+    "Min": _run_min,
+    "Max": _run_max,
+    "LeakyRelu": _run_leaky_relu,
+    "Concat": _run_concat,
+    "GlobalAveragePool": _run_pool,
+    "GlobalMaxPool": _run_pool,
+    "Softmax": _run_softmax,
+    "Gemm": _run_gemm,
+    "LRN": _run_lrn,
+    "Sigmoid": _run_sigmoid,
+    "HardSigmoid": _run_hard_sigmoid,
+    "Clip": _run_clip,
+    "Abs": _run_abs,
+    "Pad": _run_pad,
+    "Slice": _run_slice,
+    "Split": _run_split,
+    "Constant": _run_constant,
+}
+
+
+def _get_numpy_op_fn(node):
+    """
+    Get NumPy implementation for ONNX node op_type
+    """
+    op_type = node.op_type
+    if op_type in _NUMPY_OP_REGISTRY:
+        return _NUMPY_OP_REGISTRY[op_type]
+    else:
+        raise TypeError(
+            "ONNX node of type {} is not supported.".format(op_type,)
+        )
+
+
+def _run_node(node, inputs):
+    '''
+    Compute node outputs for list of inputs (numpy arrays in node.inputs
+    order). Returns list of outputs in node.outputs order.
+    '''
+    run_fn = _get_numpy_op_fn(node)
+    return run_fn(node, inputs)
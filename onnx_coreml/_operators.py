@@ -3,6 +3,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import numpy as np
+
 
 def _convert_conv(builder, node):
     W = node.input_tensors[node.inputs[1]]
@@ -167,7 +169,7 @@ def _convert_pool(builder, node):
         stride_width=stride_width,
         layer_type=layer_type,
         padding_type='VALID',
-        exclude_pad_area=True,
+        exclude_pad_area=not node.attrs.get('count_include_pad', 0),
         is_global=is_global,
         input_name=node.inputs[0],
         output_name=node.outputs[0],
@@ -201,25 +203,63 @@ def _convert_bn(builder, node):
         )
 
     epsilon = node.attrs.get("epsilon", 1e-5)
-    scale = node.input_tensors[node.inputs[1]]
-    bias = node.input_tensors[node.inputs[2]]
-    mean = node.input_tensors[node.inputs[3]]
-    var = node.input_tensors[node.inputs[4]]
+    scale = node.input_tensors[node.inputs[1]].astype(np.float32)
+    bias = node.input_tensors[node.inputs[2]].astype(np.float32)
+    mean = node.input_tensors[node.inputs[3]].astype(np.float32)
+    var = node.input_tensors[node.inputs[4]].astype(np.float32)
+
+    # inference mode batchnorm is an affine transform, precompute it
+    W = scale / np.sqrt(var + np.float32(epsilon))
+    b = bias - mean * W
 
-    builder.add_batchnorm(
+    builder.add_scale(
         name=node.name,
-        channels=scale.shape[0],
-        gamma=scale,
-        beta=bias,
-        mean=mean,
-        variance=var,
+        W=W,
+        b=b,
+        has_bias=True,
+        shape_scale=W.shape,
+        shape_bias=b.shape,
         input_name=node.inputs[0],
+        output_name=node.outputs[0]
+    )
+
+
+def _scalar_operand(node):
+    '''
+    Returns (other input name, scalar value, index of the scalar input) if
+    node has exactly two inputs and one of them is a scalar constant,
+    otherwise None
+    '''
+    if len(node.inputs) != 2:
+        return None
+    for i, input_ in enumerate(node.inputs):
+        if input_ in node.input_tensors and \
+                np.size(node.input_tensors[input_]) == 1:
+            other = node.inputs[1 - i]
+            if other in node.input_tensors:
+                return None
+            value = float(np.asarray(node.input_tensors[input_]).flat[0])
+            return other, value, i
+    return None
+
+
+def _convert_scalar_elementwise(builder, node, mode, alpha, input_name):
+    builder.add_elementwise(
+        name=node.name,
+        input_names=[input_name],
         output_name=node.outputs[0],
-        epsilon=epsilon
+        mode=mode,
+        alpha=alpha
     )
 
 
 def _convert_add(builder, node):
+    scalar = _scalar_operand(node)
+    if scalar is not None:
+        input_name, value, _ = scalar
+        return _convert_scalar_elementwise(
+            builder, node, "ADD", value, input_name
+        )
     if 'broadcast' in node.attrs:
         if node.attrs['broadcast'] == 1:
             raise ValueError('Broadcast Add is not supported now')
@@ -232,6 +272,12 @@ def _convert_add(builder, node):
 
 
 def _convert_mul(builder, node):
+    scalar = _scalar_operand(node)
+    if scalar is not None:
+        input_name, value, _ = scalar
+        return _convert_scalar_elementwise(
+            builder, node, "MULTIPLY", value, input_name
+        )
     if 'broadcast' in node.attrs:
         if node.attrs['broadcast'] == 1:
             raise ValueError('Broadcast Add is not supported now')
@@ -244,6 +290,28 @@ def _convert_mul(builder, node):
     )
 
 
+def _convert_sub(builder, node):
+    scalar = _scalar_operand(node)
+    if scalar is None or scalar[2] != 1:
+        raise ValueError(
+            'Only Sub of a scalar constant is supported now'
+        )
+    input_name, value, _ = scalar
+    _convert_scalar_elementwise(builder, node, "ADD", -value, input_name)
+
+
+def _convert_div(builder, node):
+    scalar = _scalar_operand(node)
+    if scalar is None or scalar[2] != 1 or scalar[1] == 0:
+        raise ValueError(
+            'Only Div by a non zero scalar constant is supported now'
+        )
+    input_name, value, _ = scalar
+    _convert_scalar_elementwise(
+        builder, node, "MULTIPLY", 1.0 / value, input_name
+    )
+
+
 def _convert_leaky_relu(builder, node):
     alpha = node.attrs['alpha']
     builder.add_activation(
@@ -350,6 +418,113 @@ def _convert_sigmoid(builder, node):
     )
 
 
+def _convert_hard_sigmoid(builder, node):
+    builder.add_activation(
+        name=node.name,
+        non_linearity='SIGMOID_HARD',
+        params=[node.attrs.get('alpha', 0.2), node.attrs.get('beta', 0.5)],
+        input_name=node.inputs[0],
+        output_name=node.outputs[0]
+    )
+
+
+def _clip_bounds(node):
+    '''
+    Returns (min, max) of Clip node, legacy default bounds are the lowest
+    and the highest float values, they are returned as infinities
+    '''
+    limit = np.finfo(np.float32).max
+    low = node.attrs.get('min', -np.inf)
+    high = node.attrs.get('max', np.inf)
+    if low <= -limit:
+        low = -np.inf
+    if high >= limit:
+        high = np.inf
+    return low, high
+
+
+def _convert_clip(builder, node):
+    '''
+    CoreML has no clip layer, Clip is lowered to the shortest equivalent
+    sequence of activation and unary layers:
+        [0, inf)      -> RELU
+        [min, inf)    -> threshold
+        (-inf, max]   -> threshold of -x, negated by LINEAR
+        [min, max]    -> SIGMOID_HARD to [0, 1], rescaled by LINEAR
+    '''
+    if len(node.inputs) != 1:
+        raise ValueError('Clip bounds must be attributes')
+    low, high = _clip_bounds(node)
+    input_name = node.inputs[0]
+    output_name = node.outputs[0]
+    if low == 0 and high == np.inf:
+        return _convert_relu(builder, node)
+    if high == np.inf:
+        builder.add_unary(
+            name=node.name,
+            input_name=input_name,
+            output_name=output_name,
+            mode='threshold',
+            alpha=float(low)
+        )
+        return
+    if low == -np.inf:
+        negated_name = output_name + '_negated'
+        builder.add_unary(
+            name=negated_name,
+            input_name=input_name,
+            output_name=negated_name,
+            mode='threshold',
+            alpha=-float(high),
+            scale=-1.0
+        )
+        builder.add_activation(
+            name=node.name,
+            non_linearity='LINEAR',
+            params=[-1.0, 0.0],
+            input_name=negated_name,
+            output_name=output_name
+        )
+        return
+    if low > high:
+        raise ValueError('Clip min is greater than max')
+    scale = float(high - low)
+    if scale == 0:
+        # constant output
+        builder.add_activation(
+            name=node.name,
+            non_linearity='LINEAR',
+            params=[0.0, float(low)],
+            input_name=input_name,
+            output_name=output_name
+        )
+        return
+    if low == 0 and high == 1:
+        builder.add_activation(
+            name=node.name,
+            non_linearity='SIGMOID_HARD',
+            params=[1.0, 0.0],
+            input_name=input_name,
+            output_name=output_name
+        )
+        return
+    unit_name = output_name + '_unit'
+    builder.add_activation(
+        name=unit_name,
+        non_linearity='SIGMOID_HARD',
+        params=[1.0 / scale, -float(low) / scale],
+        input_name=input_name,
+        output_name=unit_name
+    )
+    builder.add_activation(
+        name=node.name,
+        non_linearity='LINEAR',
+        params=[scale, float(low)],
+        input_name=unit_name,
+        output_name=output_name
+    )
+
+
 def _convert_abs(builder, node):
     builder.add_unary(
         name=node.name,
@@ -360,27 +535,25 @@ def _convert_abs(builder, node):
 
 
 def _convert_pad(builder, node):
-    mode = node.attrs['mode']
+    mode = node.attrs.get('mode', 'constant')
+    if isinstance(mode, bytes):
+        mode = mode.decode('utf-8')
     if mode == 'reflect':
         mode = 'reflection'
     elif mode == 'edge':
         mode = 'replication'
+    # paddings are [x1_begin, x2_begin, ..., x1_end, x2_end, ...] of
+    # trailing axes, CoreML pads only the last two (height and width)
     paddings = node.attrs['paddings']
-    if len(paddings) > 4:
-        diff = len(paddings) - 4
-        if paddings[:diff].count(0) != diff:
-            raise NotImplementedError(
-                "Paddings value {} not supported".format(paddings,)
-            )
-        paddings = paddings[diff:]
-    pad_t = paddings[0]
-    pad_b = paddings[1]
-    pad_l = 0
-    pad_r = 0
-    if len(paddings) > 2:
-        pad_l = paddings[2]
-    if len(paddings) > 3:
-        pad_r = paddings[3]
+    num_axes = len(paddings) // 2
+    begins = [0, 0] + list(paddings[:num_axes])
+    ends = [0, 0] + list(paddings[num_axes:])
+    if any(begins[:-2]) or any(ends[:-2]):
+        raise NotImplementedError(
+            "Paddings value {} not supported".format(paddings,)
+        )
+    pad_t, pad_l = begins[-2:]
+    pad_b, pad_r = ends[-2:]
     value = node.attrs.get('value', 0.0)
     builder.add_padding(
         name=node.name,
@@ -421,6 +594,26 @@ def _convert_slice(builder, node):
     )
 
 
+def _convert_split(builder, node):
+    if node.attrs.get('axis', 0) != 1:
+        raise NotImplementedError("Split is supported only along channels")
+    if 'split' not in node.attrs:
+        raise ValueError("Split requires 'split' attribute")
+    start = 0
+    for i, (output, size) in enumerate(zip(node.outputs,
+                                           node.attrs['split'])):
+        builder.add_slice(
+            name="{}_{}".format(node.name, i),
+            input_name=node.inputs[0],
+            output_name=output,
+            axis='channel',
+            start_index=start,
+            end_index=start + size,
+            stride=1
+        )
+        start += size
+
+
 _ONNX_NODE_REGISTRY = {
     "Conv": _convert_conv,
     "Relu": _convert_relu,
@@ -434,6 +627,8 @@ _ONNX_NODE_REGISTRY = {
     "Add": _convert_add,
     "Sum": _convert_add,
     "Mul": _convert_mul,
+    "Sub": _convert_sub,
+    "Div": _convert_div,
     "LeakyRelu": _convert_leaky_relu,
     "Concat": _convert_concat,
     "GlobalAveragePool": _convert_pool,
@@ -442,9 +637,12 @@ _ONNX_NODE_REGISTRY = {
     "Gemm": _convert_gemm,
     "LRN": _convert_lrn,
     "Sigmoid": _convert_sigmoid,
+    "HardSigmoid": _convert_hard_sigmoid,
+    "Clip": _convert_clip,
     "Abs": _convert_abs,
     "Pad": _convert_pad,
     "Slice": _convert_slice,
+    "Split": _convert_split,
 }
 
 
@@ -0,0 +1,127 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import time
+
+
+class PassStats(object):
+    '''
+    Statistics of a single run of a pass. metrics holds pass specific
+    counters, e.g. bytes of removed weights.
+    '''
+    def __init__(self, name, iteration, wall_time, num_nodes_before,
+                 num_nodes_after, num_rewrites, metrics=None):
+        self.name = name
+        self.iteration = iteration
+        self.wall_time = wall_time
+        self.num_nodes_before = num_nodes_before
+        self.num_nodes_after = num_nodes_after
+        self.num_rewrites = num_rewrites
+        self.metrics = metrics or {}
+
+    @property
+    def num_nodes_delta(self):
+        return self.num_nodes_after - self.num_nodes_before
+
+    def __repr__(self):
+        return 'PassStats({}, iteration={}, wall_time={:.6f}, ' \
+            'num_nodes_delta={}, num_rewrites={})'.format(
+                self.name, self.iteration, self.wall_time,
+                self.num_nodes_delta,
+                self.num_rewrites
+            )
+
+
+def _pass_name(pass_):
+    return getattr(pass_, 'name', type(pass_).__name__)
+
+
+class PassManager(object):
+    '''
+    Runs graph transformers until none of them changes the graph (or
+    max_iterations is reached), so rewrites exposed by later passes are
+    picked up by earlier ones. A pass reports its changes by setting
+    num_rewrites attribute, for passes without it the node count delta is
+    used. Statistics of every pass run are collected in stats, passes may
+    expose additional counters of the last run in metrics dict attribute.
+    '''
+    def __init__(self, passes, max_iterations=10):
+        self.passes = passes
+        self.max_iterations = max_iterations
+        self.stats = []
+        self.num_iterations = 0
+
+    def __call__(self, graph):
+        self.stats = []
+        self.num_iterations = 0
+        for iteration in range(self.max_iterations):
+            self.num_iterations += 1
+            changed = False
+            for pass_ in self.passes:
+                num_nodes_before = graph.num_nodes
+                start = time.time()
+                graph = pass_(graph)
+                elapsed = time.time() - start
+                num_nodes_after = graph.num_nodes
+                num_rewrites = getattr(pass_, 'num_rewrites', None)
+                if num_rewrites is None:
+                    num_rewrites = abs(num_nodes_after - num_nodes_before)
+                self.stats.append(PassStats(
+                    _pass_name(pass_), iteration, elapsed,
+                    num_nodes_before, num_nodes_after, num_rewrites,
+                    dict(getattr(pass_, 'metrics', None) or {})
+                ))
+                changed = changed or num_rewrites > 0
+            if not changed:
+                break
+        return graph
+
+    def summary(self):
+        return format_pass_stats(self.stats)
+
+
+def sum_pass_metrics(stats):
+    '''
+    Returns pass name -> {metric: total over all runs} for passes which
+    reported metrics
+    '''
+    totals = {}
+    for s in stats:
+        if not s.metrics:
+            continue
+        pass_totals = totals.setdefault(s.name, {})
+        for key, value in s.metrics.items():
+            pass_totals[key] = pass_totals.get(key, 0) + value
+    return totals
+
+
+def format_pass_stats(stats):
+    '''
+    Returns per pass totals of stats (list of PassStats) as text table
+    '''
+    totals = {}
+    names = []
+    for s in stats:
+        if s.name not in totals:
+            names.append(s.name)
+            totals[s.name] = [0.0, 0, 0]
+        totals[s.name][0] += s.wall_time
+        totals[s.name][1] += s.num_nodes_delta
+        totals[s.name][2] += s.num_rewrites
+    lines = ['{:<32} {:>10} {:>8} {:>8}'.format(
+        'pass', 'time (ms)', 'nodes', 'rewrites'
+    )]
+    for name in names:
+        wall_time, delta, rewrites = totals[name]
+        lines.append('{:<32} {:>10.2f} {:>8} {:>8}'.format(
+            name, wall_time * 1000, delta, rewrites
+        ))
+    num_iterations = max([s.iteration for s in stats] + [-1]) + 1
+    lines.append('{} iteration(s)'.format(num_iterations))
+    metrics = sum_pass_metrics(stats)
+    for name in names:
+        for key, value in sorted(metrics.get(name, {}).items()):
+            lines.append('{}: {} = {}'.format(name, key, value))
+    return '\n'.join(lines)
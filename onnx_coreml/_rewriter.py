@@ -0,0 +1,216 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+
+class Var(object):
+    '''
+    Pattern matching any edge. Edge name is bound to name in the match,
+    repeated names must bind the same edge, which allows expressing DAG
+    patterns like x * Sigmoid(x).
+    '''
+    def __init__(self, name=None):
+        self.name = name
+
+    def match(self, graph, node, index, match):
+        return match.bind(self.name, node.inputs[index])
+
+
+class Constant(Var):
+    '''
+    Pattern matching an edge whose value is a graph initializer. predicate
+    is called with the value.
+    '''
+    def __init__(self, name=None, predicate=None):
+        super(Constant, self).__init__(name)
+        self.predicate = predicate
+
+    def match(self, graph, node, index, match):
+        input_ = node.inputs[index]
+        if input_ not in node.input_tensors:
+            return False
+        if self.predicate is not None and \
+                not self.predicate(node.input_tensors[input_]):
+            return False
+        return match.bind(self.name, input_)
+
+
+class Op(Var):
+    '''
+    Pattern matching a node.
+        op_type: str, sequence of str or None for any operator
+        inputs: patterns for node inputs. Node may have more inputs than
+            patterns, extra inputs are not checked.
+        attrs: attribute name -> expected value or callable called with the
+            attribute value (None if attribute is not set)
+        predicate: callable called with the node
+        commutative: also try to match the two inputs swapped
+        single_consumer: for nodes other than the pattern root, require the
+            node output to be used only by the matched consumer. Set it to
+            False for nodes whose output may have other consumers (these
+            nodes must be kept by the rewrite).
+    '''
+    def __init__(self, op_type=None, inputs=None, attrs=None, predicate=None,
+                 name=None, commutative=False, single_consumer=True):
+        super(Op, self).__init__(name)
+        if op_type is None or isinstance(op_type, (list, tuple, set)):
+            self.op_types = op_type
+        else:
+            self.op_types = (op_type,)
+        self.inputs = inputs or []
+        self.attrs = attrs or {}
+        self.predicate = predicate
+        self.commutative = commutative
+        self.single_consumer = single_consumer
+
+    def match(self, graph, node, index, match):
+        input_ = node.inputs[index]
+        parent = node.get_parent(input_)
+        if parent is None:
+            return False
+        if self.single_consumer:
+            if len(parent.children) != 1:
+                return False
+            if any(graph.is_output(o) for o in parent.outputs):
+                return False
+        return self.match_node(graph, parent, match)
+
+    def match_node(self, graph, node, match):
+        if self.op_types is not None and node.op_type not in self.op_types:
+            return False
+        for attr, expected in self.attrs.items():
+            value = node.attrs.get(attr)
+            if callable(expected):
+                if not expected(value):
+                    return False
+            elif value != expected:
+                return False
+        if self.predicate is not None and not self.predicate(node):
+            return False
+        if len(node.inputs) < len(self.inputs):
+            return False
+        if not match.bind(self.name, node):
+            return False
+
+        orders = [list(range(len(self.inputs)))]
+        if self.commutative and len(self.inputs) == 2:
+            orders.append([1, 0])
+        for order in orders:
+            attempt = match.copy()
+            if all(p.match(graph, node, i, attempt)
+                   for p, i in zip(self.inputs, order)):
+                match.update(attempt)
+                match.nodes.append(node)
+                return True
+        return False
+
+
+class Match(object):
+    '''
+    Result of pattern matching.
+        root: node the pattern root matched
+        nodes: all matched nodes, producers first
+        match[name]: node bound by Op pattern or edge name bound by
+            Var/Constant pattern
+    '''
+    def __init__(self, root):
+        self.root = root
+        self.nodes = []
+        self.bindings = {}
+
+    def bind(self, name, value):
+        if name is None:
+            return True
+        if name in self.bindings:
+            return self.bindings[name] == value
+        self.bindings[name] = value
+        return True
+
+    def copy(self):
+        match = Match(self.root)
+        match.bindings = dict(self.bindings)
+        return match
+
+    def update(self, other):
+        self.bindings = other.bindings
+        self.nodes = other.nodes + self.nodes
+
+    def __getitem__(self, name):
+        return self.bindings[name]
+
+    def __contains__(self, name):
+        return name in self.bindings
+
+
+def match_pattern(graph, pattern, node):
+    '''
+    Match pattern rooted at node. Returns Match or None
+    '''
+    match = Match(node)
+    if not pattern.match_node(graph, node, match):
+        return None
+    nodes = []
+    for n in match.nodes:
+        if n not in nodes:
+            nodes.append(n)
+    match.nodes = nodes
+    return match
+
+
+class RewriteRule(object):
+    '''
+    An abstract rewrite: subclasses define pattern (Op) and rewrite. Rule
+    instances are also transformers running just this rule.
+    '''
+    pattern = None
+
+    def __init__(self):
+        self.num_rewrites = 0
+
+    def is_eligible(self, graph, match):
+        '''Returns true if the match should be rewritten.'''
+        return True
+
+    def rewrite(self, graph, match):
+        '''Rewrite matched nodes in place.'''
+        raise NotImplementedError('Must be implemented by subclass.')
+
+    def __call__(self, graph):
+        return PatternRewriter([self])(graph)
+
+
+class PatternRewriter(object):
+    '''
+    Applies rewrite rules to a graph. Only nodes whose op_type matches a
+    pattern root are visited, the graph keeps an op_type -> nodes index, so
+    rewriting costs time proportional to the number of candidates.
+    '''
+    def __init__(self, rules):
+        self.rules = rules
+        self.num_rewrites = 0
+
+    def __call__(self, graph):
+        self.num_rewrites = 0
+        for rule in self.rules:
+            rule.num_rewrites = 0
+            op_types = rule.pattern.op_types
+            if op_types is None:
+                candidates = list(graph.nodes)
+            else:
+                candidates = graph.get_nodes_by_op_type(op_types)
+            for node in candidates:
+                # node could be removed by previous rewrite
+                if node not in graph:
+                    continue
+                match = match_pattern(graph, rule.pattern, node)
+                if match is None:
+                    continue
+                if any(n not in graph for n in match.nodes):
+                    continue
+                if not rule.is_eligible(graph, match):
+                    continue
+                rule.rewrite(graph, match)
+                rule.num_rewrites += 1
+            self.num_rewrites += rule.num_rewrites
+        return graph
@@ -0,0 +1,386 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+
+from ._graph import _TENSOR_TYPE_TO_NP_TYPE
+
+
+class ShapeInferenceError(ValueError):
+    '''
+    Raised when shapes of node inputs are inconsistent with the operator
+    '''
+    pass
+
+
+def _as_text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _prod(dims):
+    return int(np.prod(dims, dtype=np.int64))
+
+
+def _reshape_output_shape(input_shape, shape):
+    '''
+    Returns output shape of Reshape of input_shape to shape, which may
+    contain 0 (copy input dimension) and -1 (infer dimension), or None if
+    it can't be determined
+    '''
+    if any(d == 0 and i >= len(input_shape) for i, d in enumerate(shape)):
+        return None
+    shape = [input_shape[i] if d == 0 else d for i, d in enumerate(shape)]
+    if -1 in shape:
+        known = _prod([d for d in shape if d != -1])
+        if known == 0:
+            return None
+        shape[shape.index(-1)] = _prod(input_shape) // known
+    return tuple(int(d) for d in shape)
+
+
+def _broadcast_shapes(node, shapes):
+    rank = max(len(s) for s in shapes)
+    aligned = [(1,) * (rank - len(s)) + tuple(s) for s in shapes]
+    result = []
+    for dims in zip(*aligned):
+        known = set(d for d in dims if d != 1)
+        if len(known) > 1:
+            raise ShapeInferenceError(
+                "{} {}: inputs of shapes {} can't be broadcasted".format(
+                    node.op_type, node.name, shapes
+                )
+            )
+        result.append(known.pop() if known else 1)
+    return tuple(result)
+
+
+def _infer_same(node, shapes):
+    return [shapes[0]] * len(node.outputs)
+
+
+def _infer_elementwise(node, shapes):
+    if node.attrs.get('broadcast', 0) == 1:
+        # legacy broadcasting of the second operand to the first one
+        return [shapes[0]]
+    return [_broadcast_shapes(node, shapes)]
+
+
+def _spatial_output_size(node, size, kernel, index, dilation=1):
+    strides = node.attrs.get('strides', [1, 1])
+    auto_pad = _as_text(node.attrs.get('auto_pad', 'NOTSET'))
+    if auto_pad in ('SAME_UPPER', 'SAME_LOWER'):
+        return -(-size // strides[index])
+    pads = node.attrs.get('pads', [0, 0, 0, 0])
+    if auto_pad == 'VALID':
+        pads = [0, 0, 0, 0]
+    # ONNX pads: [top, left, bottom, right]
+    padded = size + pads[index] + pads[index + 2]
+    return (padded - dilation * (kernel - 1) - 1) // strides[index] + 1
+
+
+def _spatial_output_shape(node, shape, kernel_shape, dilations=(1, 1)):
+    if len(shape) < 3:
+        raise ShapeInferenceError(
+            "{} {}: expected spatial input, got shape {}".format(
+                node.op_type, node.name, shape
+            )
+        )
+    return tuple(
+        _spatial_output_size(node, shape[-2 + i], kernel_shape[i], i,
+                             dilations[i])
+        for i in range(2)
+    )
+
+
+def _infer_conv(node, shapes):
+    shape, W = shapes[0], shapes[1]
+    if len(W) != 4:
+        raise ShapeInferenceError(
+            "Conv {}: only 2d convolution is supported".format(node.name,)
+        )
+    group = node.attrs.get('group', 1)
+    if shape[-3] != W[1] * group:
+        raise ShapeInferenceError(
+            "Conv {}: input has {} channels, weights expect {}".format(
+                node.name, shape[-3], W[1] * group
+            )
+        )
+    kernel_shape = node.attrs.get('kernel_shape', W[2:])
+    dilations = node.attrs.get('dilations', [1, 1])
+    spatial = _spatial_output_shape(node, shape, kernel_shape, dilations)
+    return [tuple(shape[:-3]) + (W[0],) + spatial]
+
+
+def _infer_pool(node, shapes):
+    shape = shapes[0]
+    if node.op_type.startswith('Global'):
+        return [tuple(shape[:-2]) + (1, 1)]
+    spatial = _spatial_output_shape(node, shape, node.attrs['kernel_shape'])
+    return [tuple(shape[:-2]) + spatial]
+
+
+def _infer_fc(node, shapes):
+    shape, W = shapes[0], shapes[1]
+    axis = node.attrs.get('axis', 1)
+    if _prod(shape[axis:]) != W[1]:
+        raise ShapeInferenceError(
+            "FC {}: input of shape {} doesn't match weights {}".format(
+                node.name, shape, W
+            )
+        )
+    return [(_prod(shape[:axis]), W[0])]
+
+
+def _infer_gemm(node, shapes):
+    A, B = shapes[0], shapes[1]
+    if len(A) > 2:
+        A = (A[0], _prod(A[1:]))
+    if node.attrs.get('transA', 0):
+        A = A[::-1]
+    if node.attrs.get('transB', 0):
+        B = B[::-1]
+    if A[1] != B[0]:
+        raise ShapeInferenceError(
+            "Gemm {}: can't multiply matrices of shapes {} and {}".format(
+                node.name, A, B
+            )
+        )
+    return [(A[0], B[1])]
+
+
+def _infer_reshape(node, shapes, constants):
+    shape = node.attrs.get('shape')
+    if shape is None and len(node.inputs) > 1:
+        shape = constants.get(node.inputs[1])
+    if shape is None:
+        return [None]
+    output_shape = _reshape_output_shape(shapes[0], list(shape))
+    if output_shape is not None and \
+            _prod(output_shape) != _prod(shapes[0]):
+        raise ShapeInferenceError(
+            "Reshape {}: can't reshape {} to {}".format(
+                node.name, shapes[0], list(shape)
+            )
+        )
+    return [output_shape]
+
+
+def _infer_transpose(node, shapes):
+    shape = shapes[0]
+    perm = node.attrs.get('perm', list(reversed(range(len(shape)))))
+    return [tuple(shape[p] for p in perm)]
+
+
+def _infer_concat(node, shapes):
+    rank = len(shapes[0])
+    axis = node.attrs.get('axis', 1)
+    if axis < 0:
+        axis += rank
+    for shape in shapes[1:]:
+        if len(shape) != rank or any(
+                a != b for i, (a, b) in enumerate(zip(shape, shapes[0]))
+                if i != axis):
+            raise ShapeInferenceError(
+                "Concat {}: inputs of shapes {} can't be concatenated "
+                "along axis {}".format(node.name, shapes, axis)
+            )
+    output_shape = list(shapes[0])
+    output_shape[axis] = sum(s[axis] for s in shapes)
+    return [tuple(output_shape)]
+
+
+def _infer_pad(node, shapes):
+    shape = list(shapes[0])
+    paddings = node.attrs['paddings']
+    # [x1_begin, x2_begin, ..., x1_end, x2_end, ...] of trailing axes
+    num_axes = len(paddings) // 2
+    for i in range(num_axes):
+        shape[len(shape) - num_axes + i] += \
+            paddings[i] + paddings[num_axes + i]
+    return [tuple(shape)]
+
+
+def _infer_slice(node, shapes):
+    shape = list(shapes[0])
+    starts = node.attrs['starts']
+    ends = node.attrs['ends']
+    axes = node.attrs.get('axes', list(range(len(starts))))
+    for axis, start, end in zip(axes, starts, ends):
+        size = shape[axis]
+        start, end, _ = slice(start, end).indices(size)
+        shape[axis] = max(0, end - start)
+    return [tuple(shape)]
+
+
+def _infer_split(node, shapes):
+    shape = shapes[0]
+    axis = node.attrs.get('axis', 0)
+    split = node.attrs.get('split')
+    if split is None:
+        if shape[axis] % len(node.outputs) != 0:
+            raise ShapeInferenceError(
+                "Split {}: dimension {} can't be split into {} parts".format(
+                    node.name, shape[axis], len(node.outputs)
+                )
+            )
+        split = [shape[axis] // len(node.outputs)] * len(node.outputs)
+    if sum(split) != shape[axis]:
+        raise ShapeInferenceError(
+            "Split {}: split {} doesn't match dimension {}".format(
+                node.name, split, shape[axis]
+            )
+        )
+    outputs = []
+    for size in split:
+        output_shape = list(shape)
+        output_shape[axis] = size
+        outputs.append(tuple(output_shape))
+    return outputs
+
+
+_SHAPE_INFERENCE_REGISTRY = {
+    "Conv": _infer_conv,
+    "Relu": _infer_same,
+    "Transpose": _infer_transpose,
+    "MaxPool": _infer_pool,
+    "AveragePool": _infer_pool,
+    "FC": _infer_fc,
+    "BatchNormalization": _infer_same,
+    "SpatialBN": _infer_same,
+    "Add": _infer_elementwise,
+    "Sum": _infer_elementwise,
+    "Mul": _infer_elementwise,
+    "Sub": _infer_elementwise,
+    "Div": _infer_elementwise,
+    "Min": _infer_elementwise,
+    "Max": _infer_elementwise,
+    "LeakyRelu": _infer_same,
+    "Concat": _infer_concat,
+    "GlobalAveragePool": _infer_pool,
+    "GlobalMaxPool": _infer_pool,
+    "Softmax": _infer_same,
+    "Gemm": _infer_gemm,
+    "LRN": _infer_same,
+    "Sigmoid": _infer_same,
+    "HardSigmoid": _infer_same,
+    "Clip": _infer_same,
+    "Abs": _infer_same,
+    "Dropout": _infer_same,
+    "Pad": _infer_pad,
+    "Slice": _infer_slice,
+    "Split": _infer_split,
+}
+
+
+def _freeze(value):
+    '''
+    Returns hashable value comparing equal to frozen values of equal
+    attributes
+    '''
+    if isinstance(value, np.ndarray):
+        return ('ndarray', value.shape, value.dtype.str, value.tobytes())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _constant_info(node, name):
+    '''
+    Returns (shape, dtype, value) of constant node input without decoding
+    it. value is given only for small integer constants (e.g. Reshape
+    shape), which may affect output shapes.
+    '''
+    tensor = node.input_tensors.peek(name)
+    shape = tuple(int(d) for d in tensor.shape)
+    dtype = np.dtype(tensor.dtype)
+    value = None
+    if dtype.kind in 'iu' and len(shape) <= 1 and _prod(shape) <= 8:
+        value = tuple(
+            int(v) for v in np.asarray(node.input_tensors[name]).reshape(-1)
+        )
+    return shape, dtype, value
+
+
+def _infer_node(node, infos, constants):
+    if node.op_type == 'Constant':
+        value = np.asarray(node.attrs['value'])
+        return [(value.shape, value.dtype)]
+    shapes = [infos.get(i, (None, None))[0] for i in node.inputs]
+    dtype = infos.get(node.inputs[0], (None, None))[1] \
+        if node.inputs else None
+    if any(s is None for s in shapes):
+        return [(None, dtype)] * len(node.outputs)
+    if node.op_type == 'Reshape':
+        output_shapes = _infer_reshape(node, shapes, constants)
+    elif node.op_type in _SHAPE_INFERENCE_REGISTRY:
+        output_shapes = _SHAPE_INFERENCE_REGISTRY[node.op_type](node, shapes)
+    else:
+        raise ShapeInferenceError(
+            "ONNX node of type {} is not supported.".format(node.op_type,)
+        )
+    return [(s, dtype) for s in output_shapes]
+
+
+def _input_info(shape, elem_type):
+    dtype = _TENSOR_TYPE_TO_NP_TYPE.get(elem_type)
+    shape = tuple(shape)
+    if len(shape) == 0 or any(d <= 0 for d in shape):
+        # unknown (symbolic) dimensions
+        return None, dtype
+    return shape, dtype
+
+
+def infer_shapes(graph, strict=False):
+    '''
+    Infers shapes and dtypes of all graph edges from shapes of graph
+    inputs and initializers. Returns dict edge name -> (shape, dtype),
+    shape is a tuple or None if it's unknown.
+
+    Results are cached in metadata['shapes'] of nodes together with the
+    op type, attributes and input shapes they were computed from. This is
+    memoization, not incremental propagation: every call walks all nodes
+    and rebuilds their keys, which is O(number of nodes), but inference
+    only runs again for nodes whose keys changed, i.e. nodes a transformer
+    rewrote and consumers whose input shapes changed as a result.
+
+    Inconsistent input shapes (e.g. convolution input with wrong number of
+    channels) and unsupported operators raise ShapeInferenceError if
+    strict, otherwise shapes of their outputs are unknown.
+    '''
+    infos = {}
+    for name, elem_type, shape in graph.inputs:
+        infos[name] = _input_info(shape, elem_type)
+    for node in graph.nodes:
+        constants = {}
+        for input_ in node.inputs:
+            if input_ in node.input_tensors:
+                shape, dtype, value = _constant_info(node, input_)
+                infos[input_] = (shape, dtype)
+                if value is not None:
+                    constants[input_] = value
+        key = (
+            node.op_type,
+            _freeze(sorted(node.attrs.items())),
+            tuple(infos.get(i) for i in node.inputs),
+            tuple(sorted(constants.items())),
+            len(node.outputs),
+        )
+        cached = node.metadata.get('shapes')
+        if cached is None or cached[0] != key:
+            error = None
+            try:
+                outputs = _infer_node(node, infos, constants)
+            except ShapeInferenceError as e:
+                error = e
+                outputs = [(None, None)] * len(node.outputs)
+            cached = (key, outputs, error)
+            node.metadata['shapes'] = cached
+        _, outputs, error = cached
+        if error is not None and strict:
+            raise error
+        infos.update(zip(node.outputs, outputs))
+    return infos
@@ -0,0 +1,607 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import numpy as np
+
+from ._numpy_ops import _windows
+
+
+'''
+Reference NumPy implementation of CoreML NeuralNetwork layers emitted by
+the converter, so converted models can be checked without
+MLModel.predict (which requires macOS).
+
+Blobs are kept as (batch, sequence, C, H, W) arrays, rank 1 and rank 3
+CoreML inputs are (C,) and (C, H, W). Layers working on single images get
+them as (N, C, H, W) arrays with batch and sequence merged into N.
+'''
+
+
+def _weights(params, shape=None):
+    '''
+    Returns values of WeightParams as float32 array
+    '''
+    if len(params.floatValue) > 0:
+        values = np.array(params.floatValue, dtype=np.float32)
+    elif len(params.float16Value) > 0:
+        values = np.frombuffer(params.float16Value, dtype=np.float16) \
+            .astype(np.float32)
+    elif len(params.rawValue) > 0:
+        values = np.frombuffer(params.rawValue, dtype=np.float32)
+    else:
+        raise NotImplementedError(
+            "Quantized weights are not supported"
+        )
+    if shape is not None:
+        values = values.reshape(shape)
+    return values
+
+
+def _pair(values, default):
+    values = list(values)
+    return values if len(values) == 2 else default
+
+
+def _border_amounts(padding):
+    '''
+    Returns (top, bottom, left, right) of ValidPadding/BorderAmounts
+    '''
+    amounts = padding.paddingAmounts.borderAmounts
+    if len(amounts) == 0:
+        return 0, 0, 0, 0
+    return (amounts[0].startEdgeSize, amounts[0].endEdgeSize,
+            amounts[1].startEdgeSize, amounts[1].endEdgeSize)
+
+
+def _same_paddings(size, kernel, stride, dilation, top_left_heavy):
+    output = -(-size // stride)
+    total = max((output - 1) * stride + (kernel - 1) * dilation + 1 - size,
+                0)
+    small, large = total // 2, total - total // 2
+    if top_left_heavy:
+        return large, small
+    return small, large
+
+
+def _pad(x, pad_t, pad_b, pad_l, pad_r, value=0.0):
+    if pad_t == pad_b == pad_l == pad_r == 0:
+        return x
+    return np.pad(
+        x, ((0, 0), (0, 0), (pad_t, pad_b), (pad_l, pad_r)),
+        mode='constant', constant_values=value
+    )
+
+
+def _run_convolution(layer, inputs):
+    params = layer.convolution
+    if params.isDeconvolution:
+        raise NotImplementedError("Deconvolution is not supported")
+    x = inputs[0]
+    kh, kw = _pair(params.kernelSize, [3, 3])
+    sh, sw = _pair(params.stride, [1, 1])
+    dh, dw = _pair(params.dilationFactor, [1, 1])
+    group = params.nGroups or 1
+    W = _weights(
+        params.weights,
+        (params.outputChannels, params.kernelChannels, kh, kw)
+    )
+    if params.WhichOneof('ConvolutionPaddingType') == 'same':
+        top_left = params.same.asymmetryMode == 1
+        pad_t, pad_b = _same_paddings(x.shape[2], kh, sh, dh, top_left)
+        pad_l, pad_r = _same_paddings(x.shape[3], kw, sw, dw, top_left)
+    else:
+        pad_t, pad_b, pad_l, pad_r = _border_amounts(params.valid)
+    cols = _windows(_pad(x, pad_t, pad_b, pad_l, pad_r), (kh, kw),
+                    (sh, sw), (dh, dw))
+    n, c, out_h, out_w = cols.shape[:4]
+    cols = cols.reshape(n, group, c // group, out_h, out_w, kh, kw)
+    W = W.reshape((group, W.shape[0] // group) + W.shape[1:])
+    y = np.einsum('ngcyxij,gocij->ngoyx', cols, W, optimize=True)
+    y = y.reshape(n, params.outputChannels, out_h, out_w)
+    if params.hasBias:
+        y = y + _weights(params.bias).reshape(-1, 1, 1)
+    return y.astype(np.float32)
+
+
+def _run_pooling(layer, inputs):
+    params = layer.pooling
+    x = inputs[0]
+    pool_type = params.type
+    if params.globalPooling:
+        kh, kw = x.shape[2:]
+        sh, sw = 1, 1
+    else:
+        kh, kw = _pair(params.kernelSize, [3, 3])
+        sh, sw = _pair(params.stride, [1, 1])
+    padding_type = params.WhichOneof('PoolingPaddingType')
+    h, w = x.shape[2:]
+    if params.globalPooling:
+        pad_t = pad_b = pad_l = pad_r = 0
+        out_h, out_w = 1, 1
+    elif padding_type == 'same':
+        top_left = params.same.asymmetryMode == 1
+        pad_t, pad_b = _same_paddings(h, kh, sh, 1, top_left)
+        pad_l, pad_r = _same_paddings(w, kw, sw, 1, top_left)
+        out_h = -(-h // sh)
+        out_w = -(-w // sw)
+    elif padding_type == 'includeLastPixel':
+        pad_h, pad_w = _pair(params.includeLastPixel.paddingAmounts, [0, 0])
+        pad_t = pad_b = pad_h
+        pad_l = pad_r = pad_w
+        out_h = -(-(h + 2 * pad_h - kh) // sh) + 1
+        out_w = -(-(w + 2 * pad_w - kw) // sw) + 1
+        # the last window has to start inside the image or top padding
+        if (out_h - 1) * sh >= h + pad_h:
+            out_h -= 1
+        if (out_w - 1) * sw >= w + pad_w:
+            out_w -= 1
+    else:
+        pad_t, pad_b, pad_l, pad_r = _border_amounts(params.valid)
+        out_h = (h + pad_t + pad_b - kh) // sh + 1
+        out_w = (w + pad_l + pad_r - kw) // sw + 1
+    # windows may run over the bottom/right padding
+    extra_b = max((out_h - 1) * sh + kh - (h + pad_t + pad_b), 0)
+    extra_r = max((out_w - 1) * sw + kw - (w + pad_l + pad_r), 0)
+
+    if pool_type == 0:  # MAX
+        padded = _pad(x, pad_t, pad_b + extra_b, pad_l, pad_r + extra_r,
+                      -np.inf)
+        cols = _windows(padded, (kh, kw), (sh, sw))
+        return cols.max(axis=(4, 5))[:, :, :out_h, :out_w]
+    if pool_type == 2:  # L2
+        x = np.square(x)
+    padded = _pad(x, pad_t, pad_b + extra_b, pad_l, pad_r + extra_r)
+    cols = _windows(padded, (kh, kw), (sh, sw))
+    y = cols.sum(axis=(4, 5))[:, :, :out_h, :out_w]
+    if pool_type == 2:
+        return np.sqrt(y)
+    if params.avgPoolExcludePadding:
+        ones = _pad(np.ones((1, 1, h, w), dtype=x.dtype),
+                    pad_t, pad_b + extra_b, pad_l, pad_r + extra_r)
+        count = _windows(ones, (kh, kw), (sh, sw)).sum(axis=(4, 5))
+        count = count[:, :, :out_h, :out_w]
+    else:
+        count = kh * kw
+    return (y / count).astype(np.float32)
+
+
+def _run_inner_product(layer, inputs):
+    params = layer.innerProduct
+    x = inputs[0]
+    x = x.reshape(x.shape[0], -1)
+    if x.shape[1] != params.inputChannels:
+        raise ValueError(
+            "Inner product {} expects {} input channels, got {}".format(
+                layer.name, params.inputChannels, x.shape[1]
+            )
+        )
+    W = _weights(params.weights, (params.outputChannels, -1))
+    y = np.dot(x, W.T)
+    if params.hasBias:
+        y = y + _weights(params.bias)
+    return y.reshape(y.shape + (1, 1)).astype(np.float32)
+
+
+def _run_batchnorm(layer, inputs):
+    params = layer.batchnorm
+    if params.computeMeanVar or params.instanceNormalization:
+        raise NotImplementedError(
+            "Batchnorm computing mean and variance is not supported"
+        )
+    gamma = _weights(params.gamma)
+    a = gamma / np.sqrt(_weights(params.variance) + params.epsilon)
+    b = _weights(params.beta) - _weights(params.mean) * a
+    x = inputs[0]
+    return (x * a.reshape(-1, 1, 1) + b.reshape(-1, 1, 1)).astype(x.dtype)
+
+
+def _run_activation(layer, inputs):
+    params = layer.activation
+    kind = params.WhichOneof('NonlinearityType')
+    x = inputs[0]
+    if kind == 'ReLU':
+        y = np.maximum(x, 0)
+    elif kind == 'leakyReLU':
+        y = np.where(x >= 0, x, x * params.leakyReLU.alpha)
+    elif kind == 'thresholdedReLU':
+        y = np.where(x > params.thresholdedReLU.alpha, x, 0)
+    elif kind == 'PReLU':
+        alpha = _weights(params.PReLU.alpha).reshape(-1, 1, 1)
+        y = np.where(x >= 0, x, x * alpha)
+    elif kind == 'tanh':
+        y = np.tanh(x)
+    elif kind == 'scaledTanh':
+        y = params.scaledTanh.alpha * np.tanh(params.scaledTanh.beta * x)
+    elif kind == 'sigmoid':
+        y = 1.0 / (1.0 + np.exp(-x))
+    elif kind == 'sigmoidHard':
+        p = params.sigmoidHard
+        y = np.clip(p.alpha * x + p.beta, 0, 1)
+    elif kind == 'linear':
+        y = params.linear.alpha * x + params.linear.beta
+    elif kind == 'ELU':
+        y = np.where(x >= 0, x, params.ELU.alpha * (np.exp(x) - 1))
+    elif kind == 'softsign':
+        y = x / (1 + np.abs(x))
+    elif kind == 'softplus':
+        y = np.logaddexp(0, x)
+    elif kind == 'parametricSoftplus':
+        p = params.parametricSoftplus
+        alpha = _weights(p.alpha).reshape(-1, 1, 1)
+        beta = _weights(p.beta).reshape(-1, 1, 1)
+        y = alpha * np.logaddexp(0, beta * x)
+    else:
+        raise NotImplementedError(
+            "Activation {} is not supported".format(kind,)
+        )
+    return y.astype(np.float32)
+
+
+def _run_add(layer, inputs):
+    if len(inputs) == 1:
+        return inputs[0] + np.float32(layer.add.alpha)
+    y = inputs[0]
+    for x in inputs[1:]:
+        y = y + x
+    return y
+
+
+def _run_multiply(layer, inputs):
+    if len(inputs) == 1:
+        return inputs[0] * np.float32(layer.multiply.alpha)
+    y = inputs[0]
+    for x in inputs[1:]:
+        y = y * x
+    return y
+
+
+def _run_unary(layer, inputs):
+    params = layer.unary
+    x = params.scale * inputs[0] + params.shift
+    op = params.type
+    if op == 0:  # SQRT
+        y = np.sqrt(x)
+    elif op == 1:  # RSQRT
+        y = 1.0 / np.sqrt(x + params.epsilon)
+    elif op == 2:  # INVERSE
+        y = 1.0 / (x + params.epsilon)
+    elif op == 3:  # POWER
+        y = np.power(x, params.alpha)
+    elif op == 4:  # EXP
+        y = np.exp(x)
+    elif op == 5:  # LOG
+        y = np.log(x + params.epsilon)
+    elif op == 6:  # ABS
+        y = np.abs(x)
+    else:  # THRESHOLD
+        y = np.maximum(x, params.alpha)
+    return y.astype(np.float32)
+
+
+def _run_permute(layer, inputs):
+    # axis permutes (sequence, C, H, W)
+    return np.transpose(inputs[0], [0] + [a + 1 for a in layer.permute.axis])
+
+
+def _run_reshape(layer, inputs):
+    params = layer.reshape
+    x = inputs[0]
+    shape = tuple(params.targetShape)
+    # target shape is (sequence, C, H, W) or (C, H, W) keeping sequence
+    prefix = x.shape[:5 - len(shape)]
+    if params.mode == 1:  # CHANNEL_LAST
+        x = np.moveaxis(x, 2, -1)
+        y = x.reshape(prefix + shape[:-3] + shape[-2:] + shape[-3:-2])
+        return np.moveaxis(y, -1, 2)
+    return x.reshape(prefix + shape)
+
+
+def _run_flatten(layer, inputs):
+    x = inputs[0]
+    if layer.flatten.mode == 1:  # CHANNEL_LAST
+        x = np.transpose(x, (0, 2, 3, 1))
+    return x.reshape(x.shape[0], -1, 1, 1)
+
+
+def _run_padding(layer, inputs):
+    params = layer.padding
+    x = inputs[0]
+    amounts = params.paddingAmounts.borderAmounts
+    pad_width = [(0, 0), (0, 0), (0, 0), (0, 0)]
+    if len(amounts) > 0:
+        pad_width[2] = (amounts[0].startEdgeSize, amounts[0].endEdgeSize)
+        pad_width[3] = (amounts[1].startEdgeSize, amounts[1].endEdgeSize)
+    kind = params.WhichOneof('PaddingType')
+    if kind == 'reflection':
+        return np.pad(x, pad_width, mode='reflect')
+    if kind == 'replication':
+        return np.pad(x, pad_width, mode='edge')
+    return np.pad(x, pad_width, mode='constant',
+                  constant_values=params.constant.value)
+
+
+def _run_slice(layer, inputs):
+    params = layer.slice
+    index = [slice(None)] * 5
+    index[params.axis + 2] = slice(
+        params.startIndex, params.endIndex, params.stride or 1
+    )
+    return inputs[0][tuple(index)]
+
+
+def _run_softmax(layer, inputs):
+    x = inputs[0]
+    e = np.exp(x - x.max(axis=2, keepdims=True))
+    return (e / e.sum(axis=2, keepdims=True)).astype(np.float32)
+
+
+def _run_lrn(layer, inputs):
+    params = layer.lrn
+    x = inputs[0]
+    size = params.localSize
+    pad_before = (size - 1) // 2
+    pad_after = size - 1 - pad_before
+    squared = np.pad(
+        np.square(x), ((0, 0), (pad_before, pad_after), (0, 0), (0, 0)),
+        mode='constant'
+    )
+    cumsum = np.cumsum(squared, axis=1)
+    cumsum = np.concatenate([np.zeros_like(cumsum[:, :1]), cumsum], axis=1)
+    square_sum = cumsum[:, size:] - cumsum[:, :-size]
+    y = x / (params.k + params.alpha / size * square_sum) ** params.beta
+    return y.astype(np.float32)
+
+
+def _broadcastable(values, shape):
+    '''
+    Reshapes scale or bias of given CoreML shape ((1,), (C,) or (C, H, W))
+    to broadcast against blobs
+    '''
+    shape = tuple(shape) or (1,)
+    if len(shape) == 1:
+        return values.reshape(-1, 1, 1)
+    return values.reshape(shape)
+
+
+def _run_scale(layer, inputs):
+    params = layer.scale
+    y = inputs[0] * _broadcastable(_weights(params.scale), params.shapeScale)
+    if params.hasBias:
+        y = y + _broadcastable(_weights(params.bias), params.shapeBias)
+    return y.astype(np.float32)
+
+
+def _run_bias(layer, inputs):
+    params = layer.bias
+    return (inputs[0] + _broadcastable(_weights(params.bias), params.shape)) \
+        .astype(np.float32)
+
+
+def _run_concat(layer, inputs):
+    axis = 1 if layer.concat.sequenceConcat else 2
+    return np.concatenate(inputs, axis=axis)
+
+
+_LAYER_REGISTRY = {
+    'convolution': _run_convolution,
+    'pooling': _run_pooling,
+    'innerProduct': _run_inner_product,
+    'batchnorm': _run_batchnorm,
+    'activation': _run_activation,
+    'add': _run_add,
+    'multiply': _run_multiply,
+    'unary': _run_unary,
+    'permute': _run_permute,
+    'reshape': _run_reshape,
+    'flatten': _run_flatten,
+    'padding': _run_padding,
+    'slice': _run_slice,
+    'softmax': _run_softmax,
+    'lrn': _run_lrn,
+    'scale': _run_scale,
+    'bias': _run_bias,
+    'concat': _run_concat,
+}
+
+
+# layers run on (N, C, H, W) arrays
+_IMAGE_LAYERS = frozenset([
+    'convolution', 'pooling', 'innerProduct', 'batchnorm', 'flatten',
+    'padding', 'lrn',
+])
+
+
+def _run_layer(layer, inputs):
+    kind = layer.WhichOneof('layer')
+    if kind not in _LAYER_REGISTRY:
+        raise TypeError(
+            "CoreML layer of type {} is not supported.".format(kind,)
+        )
+    run_fn = _LAYER_REGISTRY[kind]
+    if kind not in _IMAGE_LAYERS:
+        return run_fn(layer, inputs)
+    x = inputs[0]
+    y = run_fn(layer, [x.reshape((-1,) + x.shape[2:])])
+    return y.reshape(x.shape[:2] + y.shape[1:])
+
+
+def _feature_shape(feature):
+    feature_type = feature.type
+    kind = feature_type.WhichOneof('Type')
+    if kind == 'imageType':
+        image = feature_type.imageType
+        # GRAYSCALE = 10
+        channels = 1 if image.colorSpace == 10 else 3
+        return (channels, image.height, image.width)
+    if kind == 'multiArrayType':
+        return tuple(feature_type.multiArrayType.shape)
+    return None
+
+
+def _image_array(value, feature):
+    '''
+    Converts PIL image to (C, H, W) array in the channel order of the image
+    feature
+    '''
+    if not hasattr(value, 'getbands'):
+        return np.asarray(value, dtype=np.float32)
+    array = np.asarray(value, dtype=np.float32)
+    if array.ndim == 2:
+        return array[np.newaxis]
+    array = np.transpose(array[:, :, :3], (2, 0, 1))
+    # BGR = 30
+    if feature.type.imageType.colorSpace == 30:
+        array = array[::-1]
+    return array
+
+
+def _to_blob(value, shape):
+    '''
+    Returns (blob, batch size or None if value isn't batched)
+    '''
+    value = np.asarray(value, dtype=np.float32)
+    batch = None
+    if value.ndim == len(shape) + 1:
+        batch = value.shape[0]
+    prefix = (batch or 1, -1)
+    if len(shape) >= 3:
+        # leading dimensions are the sequence
+        blob = value.reshape(prefix + tuple(shape[-3:]))
+    elif len(shape) == 2:
+        blob = value.reshape(prefix + (shape[1], 1, 1))
+    else:
+        blob = value.reshape(prefix[:1] + (1, -1, 1, 1))
+    return blob, batch
+
+
+class SpecExecutor(object):
+    '''
+    Runs CoreML NeuralNetwork, NeuralNetworkClassifier or
+    NeuralNetworkRegressor spec (e.g. MLModel.get_spec()) with NumPy.
+    Image inputs are given as PIL images or (C, H, W) arrays in the channel
+    order of the model, multiarray inputs as arrays of the declared shape.
+    Inputs with an extra leading dimension are treated as batches and
+    outputs get the same leading dimension.
+    '''
+    def __init__(self, spec):
+        self.spec = spec
+        kind = spec.WhichOneof('Type')
+        if kind not in ('neuralNetwork', 'neuralNetworkClassifier',
+                        'neuralNetworkRegressor'):
+            raise TypeError(
+                "Model of type {} is not a neural network".format(kind,)
+            )
+        self.network = getattr(spec, kind)
+        self.is_classifier = kind == 'neuralNetworkClassifier'
+        self.inputs = dict((f.name, f) for f in spec.description.input)
+        self.scalers = {}
+        for preprocessing in self.network.preprocessing:
+            if preprocessing.WhichOneof('preprocessor') != 'scaler':
+                raise NotImplementedError(
+                    "Only image scaler preprocessing is supported"
+                )
+            name = preprocessing.featureName or \
+                spec.description.input[0].name
+            self.scalers[name] = preprocessing.scaler
+
+    def _preprocess(self, name, blob):
+        '''
+        Applies preprocessing of input name to blob (or any array with
+        (C, H, W) trailing dimensions)
+        '''
+        scaler = self.scalers.get(name)
+        if scaler is None:
+            return blob
+        feature = self.inputs[name]
+        if blob.shape[-3] == 1:
+            bias = np.array([scaler.grayBias], dtype=np.float32)
+        else:
+            bias = np.array(
+                [scaler.redBias, scaler.greenBias, scaler.blueBias],
+                dtype=np.float32
+            )
+            # BGR = 30
+            if feature.type.imageType.colorSpace == 30:
+                bias = bias[::-1]
+        return blob * np.float32(scaler.channelScale) + bias.reshape(-1, 1, 1)
+
+    def _output(self, blob, feature, batch):
+        shape = _feature_shape(feature)
+        if shape is None or len(shape) == 0:
+            return blob
+        size = int(np.prod(shape))
+        if blob.size != size * (batch or 1):
+            return blob
+        if batch is None:
+            return blob.reshape(shape)
+        return blob.reshape((batch,) + shape)
+
+    def _classify(self, blobs, outputs, batch):
+        description = self.spec.description
+        probabilities_name = description.predictedProbabilitiesName
+        layer_name = self.network.labelProbabilityLayerName
+        blob = blobs[layer_name or probabilities_name]
+        probabilities = blob.reshape(batch or 1, -1)
+        kind = self.network.WhichOneof('ClassLabels')
+        if kind == 'stringClassLabels':
+            labels = list(self.network.stringClassLabels.vector)
+        else:
+            labels = list(self.network.int64ClassLabels.vector)
+        dicts = [dict(zip(labels, p.tolist())) for p in probabilities]
+        predicted = [labels[i] for i in probabilities.argmax(axis=1)]
+        if batch is None:
+            dicts = dicts[0]
+            predicted = predicted[0]
+        if probabilities_name:
+            outputs[probabilities_name] = dicts
+        outputs[description.predictedFeatureName] = predicted
+
+    def run_blobs(self, inputs):
+        '''
+        Returns (dict of all blobs as (batch, sequence, C, H, W) arrays,
+        batch size or None if inputs are not batched) for dict of inputs
+        '''
+        blobs = {}
+        batch = None
+        for name, feature in self.inputs.items():
+            if name not in inputs:
+                raise ValueError("Input {} is missing".format(name,))
+            value = inputs[name]
+            if feature.type.WhichOneof('Type') == 'imageType':
+                if isinstance(value, (list, tuple)):
+                    value = np.stack([_image_array(v, feature)
+                                      for v in value])
+                else:
+                    value = _image_array(value, feature)
+            blob, batch_ = _to_blob(value, _feature_shape(feature))
+            batch = batch_ if batch_ is not None else batch
+            blobs[name] = self._preprocess(name, blob)
+
+        for layer in self.network.layers:
+            layer_inputs = [blobs[i] for i in layer.input]
+            blobs[layer.output[0]] = _run_layer(layer, layer_inputs)
+        return blobs, batch
+
+    def run(self, inputs):
+        '''
+        Returns dict of outputs for dict of inputs
+        '''
+        blobs, batch = self.run_blobs(inputs)
+        outputs = {}
+        for feature in self.spec.description.output:
+            if feature.name in blobs:
+                outputs[feature.name] = self._output(
+                    blobs[feature.name], feature, batch
+                )
+        if self.is_classifier:
+            self._classify(blobs, outputs, batch)
+        return outputs
+
+
+def run_spec(spec, inputs):
+    '''
+    Runs CoreML neural network spec with NumPy, see SpecExecutor
+    '''
+    return SpecExecutor(spec).run(inputs)
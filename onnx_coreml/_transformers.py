@@ -5,263 +5,421 @@ from __future__ import unicode_literals
 
 import numpy as np
 
-from ._graph import Graph, Node
+from ._graph import Node
+from ._numpy_ops import _NUMPY_OP_REGISTRY, _run_node
+from ._operators import _clip_bounds
+from ._shape_inference import infer_shapes, _reshape_output_shape, _prod
+from ._rewriter import RewriteRule, PatternRewriter, Op, Constant, Var
 
 
-class NodesFuser(object):
+def _get_output_channels(node):
+    W = node.input_tensors.peek(node.inputs[1])
+    if node.op_type == 'Gemm' and not node.attrs.get('transB', 0):
+        return W.shape[1]
+    return W.shape[0]
+
+
+def _scale_output_channels(graph, node, scale, shift):
     '''
-    An abstract helper for merging nodes
+    Rewrites weights of Conv, Gemm or FC node so it computes
+    output * scale + shift, scale and shift are per output channel. Bias is
+    added if node doesn't have one.
     '''
-    def __init__(self, num_nodes):
-        self.num_nodes = num_nodes
+    W = node.input_tensors[node.inputs[1]]
+    output_channels = _get_output_channels(node)
+    scale = np.broadcast_to(
+        np.asarray(scale, dtype=np.float32).reshape(-1), (output_channels,)
+    )
+    shift = np.broadcast_to(
+        np.asarray(shift, dtype=np.float32).reshape(-1), (output_channels,)
+    )
+    if node.op_type == 'Gemm' and not node.attrs.get('transB', 0):
+        W = W * scale
+    else:
+        W = W * scale.reshape((-1,) + (1,) * (W.ndim - 1))
+    node.input_tensors[node.inputs[1]] = W.astype(np.float32)
 
-    def __call__(self, graph):
-        nodes = graph.nodes
-        merged_nodes = {}
-        for node in nodes:
-            nodes_window = []
-            n = node
-            for _ in range(self.num_nodes - 1):
-                if len(n.parents) != 1:
-                    # We're only fusing nodes with single parents
-                    break
-                p = n.get_only_parent()
-                if len(p.children) != 1:
-                    # We can only fuse a node if its parent's
-                    # value isn't used by any other node.
-                    break
-                nodes_window.insert(0, n)
-                n = p
-            if len(nodes_window) > 0:
-                # add parent of chained nodes
-                first = nodes_window[0]
-                p = first.get_only_parent()
-                if len(p.children) == 1:
-                    nodes_window.insert(0, p)
-            if len(nodes_window) != self.num_nodes:
-                continue
-            if not self.is_eligible(graph, nodes_window):
-                continue
-            merged = self.merge(graph, nodes_window)
-            first, last = nodes_window[0], nodes_window[-1]
-            for parent in first.parents:
-                parent.children.remove(first)
-                if merged[0] not in parent.children:
-                    parent.add_child(merged[0])
-            for child in last.children:
-                child.parents.remove(last)
-                if merged[-1] not in child.parents:
-                    child.add_parent(merged[-1])
-            for n in nodes_window:
-                merged_nodes[n.name] = merged
-
-        transformed_nodes = []
-        added_merged = []
-        for node in nodes:
-            if node.name in merged_nodes:
-                merged = merged_nodes[node.name]
-                if merged[0] not in added_merged:
-                    for n in merged:
-                        transformed_nodes.append(n)
-                    added_merged.append(merged[0])
-            else:
-                transformed_nodes.append(node)
-        return Graph(transformed_nodes, graph.inputs, graph.outputs)
+    if len(node.inputs) > 2:
+        b = node.input_tensors[node.inputs[2]].reshape(-1)
+        if node.op_type == 'Gemm':
+            b = b * node.attrs.get('beta', 1.0)
+    else:
+        bias_input_name = graph.get_unique_edge_name(
+            "{}_bias".format(node.name,)
+        )
+        node.inputs.append(bias_input_name)
+        b = np.zeros((output_channels,), dtype=np.float32)
+    if node.op_type == 'Gemm':
+        node.attrs['beta'] = 1.0
+        node.attrs['broadcast'] = 1
+    b = np.broadcast_to(b, (output_channels,)) * scale + shift
+    node.input_tensors[node.inputs[2]] = b.astype(np.float32)
 
-    def is_eligible(self, graph, nodes):
-        '''Returns true if this subset of nodes is eligible for fusion.'''
-        raise NotImplementedError('Must be implemented by subclass.')
 
-    def merge(self, graph, nodes):
-        '''Merge nodes'''
-        nodes[0].outputs = nodes[-1].outputs
-        return [nodes[0]]
+def _has_constant_weights(node):
+    return len(node.inputs) > 1 and \
+        all(i in node.input_tensors for i in node.inputs[1:])
 
 
-class ConvAddFuser(NodesFuser):
+def _can_scale_output_channels(node, channels):
     '''
-    Fuses Add layer into parent convolution layer.
+    Checks that per channel scale/shift of size channels can be folded
+    into node by _scale_output_channels
     '''
-    def __init__(self):
-        super(ConvAddFuser, self).__init__(2)
-
-    def is_eligible(self, graph, nodes):
-        parent, child = nodes[0], nodes[1]
-        if parent.op_type != 'Conv':
-            return False
-        if child.op_type != 'Add':
-            return False
-        if 'broadcast' not in child.attrs:
-            return False
-        if 'axis' not in child.attrs:
+    output_channels = _get_output_channels(node)
+    if channels not in (1, output_channels):
+        return False
+    if len(node.inputs) > 2:
+        size = node.input_tensors.peek(node.inputs[2]).size
+        if size not in (1, output_channels):
             return False
+    return True
 
-        broadcast = child.attrs['broadcast']
-        if broadcast != 1:
-            return False
 
-        axis = child.attrs['axis']
-        if axis != 1:
-            return False
+def _output_rank(node):
+    return 4 if node.op_type == 'Conv' else 2
 
-        return True
 
-    def merge(self, graph, nodes):
-        parent, child = nodes[0], nodes[1]
-        output_channels = parent.input_tensors[parent.inputs[1]].shape[0]
-        if len(parent.inputs) > 2:
-            bias_input_name = parent.inputs[2]
-            bias = parent.input_tensors[bias_input_name]
-        else:
-            bias_input_name = "{}_bias".format(parent.name,)
-            parent.inputs.append(bias_input_name)
-            bias = np.zeros(
-                (output_channels,), dtype=np.float32
-            )
-            parent.input_tensors[bias_input_name] = bias
-        bias = bias + child.input_tensors[child.inputs[1]]
-        parent.input_tensors[bias_input_name] = bias
-        parent.outputs = child.outputs
-        parent.children.remove(child)
-        child.parents.remove(parent)
-        return [parent]
+def _per_channel_values(value, rank, axis=None):
+    '''
+    Returns value broadcasted against a tensor of given rank as a vector of
+    per channel (axis 1) values, or None if value varies along other axes.
+    axis is the legacy ONNX broadcast axis.
+    '''
+    shape = value.shape
+    if axis is not None:
+        if axis < 0:
+            axis += rank
+        shape = (1,) * axis + shape + (1,) * (rank - axis - len(shape))
+    else:
+        shape = (1,) * (rank - len(shape)) + shape
+    if len(shape) != rank:
+        return None
+    if any(d != 1 for i, d in enumerate(shape) if i != 1):
+        return None
+    return value.reshape(-1)
 
 
-class BNBroadcastedMulFuser(NodesFuser):
+class _ElementwiseFuser(RewriteRule):
     '''
-    Fuses Mul into BatchNorm
+    Base class of fusers folding elementwise operation with a constant into
+    weights and bias of parent Conv, Gemm or FC layer. Subclasses implement
+    get_scale_shift returning per channel (scale, shift) such that
+    node output = parent output * scale + shift, or None.
     '''
+    op_types = ()
+
     def __init__(self):
-        super(BNBroadcastedMulFuser, self).__init__(2)
+        super(_ElementwiseFuser, self).__init__()
+        self.pattern = Op(
+            self.op_types,
+            inputs=[
+                Op(('Conv', 'Gemm', 'FC'), name='parent',
+                   predicate=_has_constant_weights),
+                Constant('c'),
+            ],
+            predicate=lambda node: len(node.inputs) == 2,
+            commutative=True,
+            name='node'
+        )
 
-    def is_eligible(self, graph, nodes):
-        parent, child = nodes[0], nodes[1]
-        if parent.op_type != 'BatchNormalization':
-            return False
-        if child.op_type != 'Mul':
-            return False
-        if "broadcast" not in child.attrs:
-            return False
-        if child.attrs["broadcast"] != 1:
-            return False
-        if "axis" not in child.attrs:
-            return False
-        if child.attrs["axis"] != 1:
-            return False
-        if child.inputs[1] not in child.input_tensors:
+    def _scale_shift(self, match):
+        node, parent = match['node'], match['parent']
+        parent_first = node.inputs[0] == parent.outputs[0]
+        axis = None
+        # legacy broadcasting applies only to the second operand
+        if parent_first and node.attrs.get('broadcast', 0) == 1:
+            axis = node.attrs.get('axis')
+        value = _per_channel_values(
+            node.input_tensors[match['c']], _output_rank(parent), axis
+        )
+        if value is None:
+            return None
+        return self.get_scale_shift(node.op_type, value, parent_first)
+
+    def get_scale_shift(self, op_type, value, parent_first):
+        raise NotImplementedError('Must be implemented by subclass.')
+
+    def is_eligible(self, graph, match):
+        scale_shift = self._scale_shift(match)
+        if scale_shift is None:
             return False
-        return True
+        size = max(np.size(scale_shift[0]), np.size(scale_shift[1]))
+        return _can_scale_output_channels(match['parent'], size)
+
+    def rewrite(self, graph, match):
+        scale, shift = self._scale_shift(match)
+        _scale_output_channels(graph, match['parent'], scale, shift)
+        graph.fuse_nodes(match['parent'], match['node'])
+
+
+class ConvAddFuser(_ElementwiseFuser):
+    '''
+    Fuses Add or Sub of a per channel or scalar constant into parent
+    convolution, Gemm or FC layer bias.
+    '''
+    op_types = ('Add', 'Sub')
+
+    def get_scale_shift(self, op_type, value, parent_first):
+        if op_type == 'Add':
+            return 1.0, value
+        if parent_first:
+            return 1.0, -value
+        return -1.0, value
 
-    def merge(self, graph, nodes):
-        parent, child = nodes[0], nodes[1]
+
+class ConvMulFuser(_ElementwiseFuser):
+    '''
+    Fuses Mul or Div by a per channel or scalar constant into parent
+    convolution, Gemm or FC layer weights and bias.
+    '''
+    op_types = ('Mul', 'Div')
+
+    def get_scale_shift(self, op_type, value, parent_first):
+        if op_type == 'Mul':
+            return value, 0.0
+        if parent_first and np.all(value != 0):
+            return 1.0 / value, 0.0
+        return None
+
+
+class ConvBNFuser(RewriteRule):
+    '''
+    Folds inference mode BatchNormalization into weights and bias of
+    parent Conv, Gemm or FC layer. BatchNormalization stays a separate
+    layer if parent output has other consumers.
+    '''
+    pattern = Op(
+        ('BatchNormalization', 'SpatialBN'),
+        inputs=[
+            Op(('Conv', 'Gemm', 'FC'), name='parent',
+               predicate=_has_constant_weights),
+            Constant('scale'),
+            Constant('bias'),
+            Constant('mean'),
+            Constant('var'),
+        ],
+        attrs={
+            'is_test': lambda is_test: is_test != 0,
+            'spatial': lambda spatial: spatial != 0,
+        },
+        name='bn'
+    )
+
+    def is_eligible(self, graph, match):
+        channels = match['bn'].input_tensors.peek(match['scale']).size
+        return _can_scale_output_channels(match['parent'], channels)
+
+    def rewrite(self, graph, match):
+        parent, bn = match['parent'], match['bn']
+        epsilon = bn.attrs.get('epsilon', 1e-5)
+        scale = bn.input_tensors[match['scale']].astype(np.float32)
+        bias = bn.input_tensors[match['bias']].astype(np.float32)
+        mean = bn.input_tensors[match['mean']].astype(np.float32)
+        var = bn.input_tensors[match['var']].astype(np.float32)
+
+        a = scale / np.sqrt(var + np.float32(epsilon))
+        _scale_output_channels(graph, parent, a, bias - mean * a)
+        graph.fuse_nodes(parent, bn)
+
+
+class BNBroadcastedMulFuser(RewriteRule):
+    '''
+    Fuses Mul into BatchNorm
+    '''
+    pattern = Op(
+        'Mul',
+        inputs=[Op('BatchNormalization', name='bn'), Constant('W')],
+        attrs={'broadcast': 1, 'axis': 1},
+        name='mul'
+    )
+
+    def rewrite(self, graph, match):
+        parent, child = match['bn'], match['mul']
         weight = parent.input_tensors[parent.inputs[1]]
         bias = parent.input_tensors[parent.inputs[2]]
-        W = child.input_tensors[child.inputs[1]]
+        W = child.input_tensors[match['W']]
         parent.input_tensors[parent.inputs[1]] = np.multiply(weight, W)
         parent.input_tensors[parent.inputs[2]] = np.multiply(bias, W)
-        parent.outputs = child.outputs
-        parent.children.remove(child)
-        child.parents.remove(parent)
-        return [parent]
+        graph.fuse_nodes(parent, child)
 
 
-class BNBroadcastedAddFuser(NodesFuser):
+class BNBroadcastedAddFuser(RewriteRule):
     '''
     Fuses Add into BatchNorm
     '''
-    def __init__(self):
-        super(BNBroadcastedAddFuser, self).__init__(2)
+    pattern = Op(
+        'Add',
+        inputs=[Op('BatchNormalization', name='bn'), Constant('b')],
+        attrs={'broadcast': 1, 'axis': 1},
+        predicate=lambda node: len(node.inputs) == 2,
+        name='add'
+    )
 
-    def is_eligible(self, graph, nodes):
-        parent, child = nodes[0], nodes[1]
-        if parent.op_type != 'BatchNormalization':
-            return False
-        if child.op_type != 'Add':
-            return False
-        if "broadcast" not in child.attrs:
-            return False
-        if child.attrs["broadcast"] != 1:
-            return False
-        if "axis" not in child.attrs:
-            return False
-        if child.attrs["axis"] != 1:
-            return False
-        if len(child.inputs) != 2:
-            return False
-        if child.inputs[1] not in child.input_tensors:
-            return False
-        return True
-
-    def merge(self, graph, nodes):
-        parent, child = nodes[0], nodes[1]
+    def rewrite(self, graph, match):
+        parent, child = match['bn'], match['add']
         bias = parent.input_tensors[parent.inputs[2]]
-        b = child.input_tensors[child.inputs[1]]
+        b = child.input_tensors[match['b']]
         parent.input_tensors[parent.inputs[2]] = bias + b
-        parent.outputs = child.outputs
-        parent.children.remove(child)
-        child.parents.remove(parent)
-        return [parent]
+        graph.fuse_nodes(parent, child)
 
 
-class DropoutRemover(NodesFuser):
+class DropoutRemover(RewriteRule):
     '''
     Removes Dropout layer
     '''
-    def __init__(self):
-        super(DropoutRemover, self).__init__(2)
+    pattern = Op('Dropout', inputs=[Op(name='parent')], name='dropout')
 
-    def is_eligible(self, graph, nodes):
-        child = nodes[1]
-        return child.op_type == "Dropout"
+    def rewrite(self, graph, match):
+        graph.fuse_nodes(match['parent'], match['dropout'])
 
-    def merge(self, graph, nodes):
-        parent, child = nodes[0], nodes[1]
-        parent.children.remove(child)
-        child.parents.remove(parent)
-        parent.outputs = child.outputs
-        return [parent]
 
-
-class ReshapeInitTensorFuser(object):
+class ReshapeInitTensorFuser(RewriteRule):
     '''
     Fuses Reshape operator if it is used only to reshape blob in
     graph initializer. We can reshape here instead of runtime.
     '''
+    pattern = Op(
+        'Reshape',
+        inputs=[Constant('tensor')],
+        predicate=lambda node: len(node.input_tensors) == 1,
+        name='reshape'
+    )
+
+    def is_eligible(self, graph, match):
+        # graph outputs have to be produced by some layer
+        return not graph.is_output(match['reshape'].outputs[0])
+
+    def rewrite(self, graph, match):
+        node = match['reshape']
+        output_name = node.outputs[0]
+
+        tensor = node.input_tensors[match['tensor']]
+        shape = tuple(node.attrs["shape"])
+        reshaped_tensor = tensor.reshape(shape)
+
+        for child in node.children:
+            child.input_tensors[output_name] = reshaped_tensor
+        graph.remove_node(node)
+
+
+class ConstantFolder(object):
+    '''
+    Evaluates nodes whose inputs are all graph initializers with NumPy and
+    passes results to their children as initializers, so whole chains of
+    constant computations are removed from the graph.
+    '''
+    def __init__(self):
+        self.num_rewrites = 0
+
+    def _is_constant(self, graph, node):
+        if node.op_type not in _NUMPY_OP_REGISTRY:
+            return False
+        if len(node.parents) > 0:
+            return False
+        if not all(i in node.input_tensors for i in node.inputs):
+            return False
+        # graph outputs have to be produced by some layer
+        return not any(graph.is_output(o) for o in node.outputs)
 
     def __call__(self, graph):
-        nodes = graph.nodes
-        removed = []
-        for node in nodes:
-            if node.op_type != 'Reshape':
+        self.num_rewrites = 0
+        # nodes are in topological order, so folded nodes make their
+        # children constant before the children are visited
+        for node in list(graph.nodes):
+            if not self._is_constant(graph, node):
                 continue
-            if len(node.input_tensors) != 1:
-                continue
-            tensor_name = node.input_tensors.keys()[0]
-            if tensor_name != node.inputs[0]:
-                continue
-            assert len(node.parents) == 0
+            inputs = [node.input_tensors[i] for i in node.inputs]
+            outputs = _run_node(node, inputs)
+            for name, value in zip(node.outputs, outputs):
+                for child in node.get_children(name):
+                    child.input_tensors[name] = value
+            graph.remove_node(node)
+            self.num_rewrites += 1
+        return graph
 
-            removed.append(node)
-            output_name = node.outputs[0]
 
-            tensor = node.input_tensors[tensor_name]
-            shape = tuple(node.attrs["shape"])
-            reshaped_tensor = tensor.reshape(shape)
+def _macs(node, infos):
+    '''
+    Number of multiply-accumulates of Conv, Gemm or FC node for edge infos
+    returned by infer_shapes, 0 for other nodes or if shapes are unknown
+    '''
+    if node.op_type not in ('Conv', 'Gemm', 'FC') or len(node.inputs) < 2:
+        return 0
+    output_shape = infos.get(node.outputs[0], (None, None))[0]
+    weight_shape = infos.get(node.inputs[1], (None, None))[0]
+    if output_shape is None or weight_shape is None:
+        return 0
+    if node.op_type == 'Gemm':
+        k = weight_shape[1] if node.attrs.get('transB', 0) else \
+            weight_shape[0]
+    elif node.op_type == 'FC':
+        k = _prod(weight_shape[node.attrs.get('axis_w', 1):])
+    else:
+        # every output value sums C / group * kH * kW products
+        k = _prod(weight_shape[1:])
+    return _prod(output_shape) * k
+
 
-            for child in node.children:
-                child.parents.remove(node)
-                child.input_tensors[output_name] = reshaped_tensor
+class DeadNodeEliminator(object):
+    '''
+    Removes nodes which don't contribute to any graph output (e.g. auxiliary
+    heads or debug taps left by exporter) together with initializers used
+    only by them. metrics reports number of removed nodes, bytes of
+    removed weights and multiply-accumulates of removed Conv, Gemm and FC
+    nodes (those with known shapes).
+    '''
+    def __init__(self):
+        self.num_rewrites = 0
+        self.metrics = {}
 
-        transformed_nodes = [node for node in nodes if node not in removed]
-        return Graph(transformed_nodes, graph.inputs, graph.outputs)
+    def __call__(self, graph):
+        self.num_rewrites = 0
+        live = set()
+        stack = [node for node in graph.nodes
+                 if any(graph.is_output(o) for o in node.outputs)]
+        while stack:
+            node = stack.pop()
+            if node in live:
+                continue
+            live.add(node)
+            stack.extend(node.parents)
+
+        dead = [node for node in graph.nodes if node not in live]
+        infos = infer_shapes(graph) if dead else {}
+        macs = sum(_macs(node, infos) for node in dead)
+        live_tensors = set()
+        for node in live:
+            live_tensors.update(node.input_tensors.keys())
+        weight_bytes = 0
+        removed_tensors = set()
+        for node in dead:
+            for name in node.input_tensors:
+                if name in live_tensors or name in removed_tensors:
+                    continue
+                removed_tensors.add(name)
+                weight_bytes += node.input_tensors.peek(name).nbytes
+            node.input_tensors.clear()
+            graph.remove_node(node)
+
+        self.num_rewrites = len(dead)
+        self.metrics = {
+            'nodes_removed': len(dead),
+            'weight_bytes_removed': weight_bytes,
+            'macs_removed': macs,
+        }
+        return graph
 
 
 class DanglingOutputsRemover(object):
     '''
     Removes unused outputs
     '''
+    def __init__(self):
+        self.num_rewrites = 0
 
     def __call__(self, graph):
+        self.num_rewrites = 0
         nodes = graph.nodes
         graph_output_names = set([o[0] for o in graph.outputs])
         for node in nodes:
@@ -276,6 +434,9 @@ class DanglingOutputsRemover(object):
                 if output in children_inputs:
                     continue
                 removed_outputs.add(output)
+            if len(removed_outputs) == 0:
+                continue
+            self.num_rewrites += len(removed_outputs)
             node.outputs = [out for out in node.outputs
                             if out not in removed_outputs]
         return graph
@@ -309,58 +470,1227 @@ class OutputRenamer(object):
         return graph
 
 
-class PixelShuffleFuser(NodesFuser):
+def _has_perm(node):
+    return node.attrs.get('perm') is not None
+
+
+def _is_identity_perm(perm):
+    return list(perm) == list(range(len(perm)))
+
+
+class TransposeComposer(RewriteRule):
     '''
-    Fuses 3 operators reshape->transpose->reshape which is equivalent to
-    pytorch's pixel_shuffle layer
+    Composes two consecutive Transposes into one, which is removed if the
+    permutations cancel each other.
     '''
-    def __init__(self):
-        super(PixelShuffleFuser, self).__init__(3)
-        self.num_added = 0
+    pattern = Op(
+        'Transpose',
+        inputs=[Op('Transpose', predicate=_has_perm, name='inner')],
+        predicate=_has_perm,
+        name='outer'
+    )
+
+    def is_eligible(self, graph, match):
+        return len(match['inner'].attrs['perm']) == \
+            len(match['outer'].attrs['perm'])
+
+    def rewrite(self, graph, match):
+        inner, outer = match['inner'], match['outer']
+        perm = inner.attrs['perm']
+        inner.attrs['perm'] = [perm[i] for i in outer.attrs['perm']]
+        graph.fuse_nodes(inner, outer)
+        if _is_identity_perm(inner.attrs['perm']):
+            graph.bypass_node(inner)
+
+
+def _has_shape(node):
+    return node.attrs.get('shape') is not None and len(node.inputs) == 1
+
+
+class ReshapeComposer(RewriteRule):
+    '''
+    Collapses two consecutive Reshapes into one
+    '''
+    pattern = Op(
+        'Reshape',
+        inputs=[Op('Reshape', predicate=_has_shape, name='inner')],
+        predicate=_has_shape,
+        name='outer'
+    )
+
+    def _composed_shape(self, inner_shape, outer_shape):
+        # 0 copies dimension of reshape input, which is known only if the
+        # inner reshape copies or sets it too
+        shape = []
+        for i, d in enumerate(outer_shape):
+            if d == 0:
+                if i >= len(inner_shape) or inner_shape[i] < 0:
+                    return None
+                d = inner_shape[i]
+            shape.append(d)
+        return shape
 
-    def is_eligible(self, graph, nodes):
-        if nodes[0].op_type != 'Reshape':
+    def is_eligible(self, graph, match):
+        return self._composed_shape(
+            match['inner'].attrs['shape'], match['outer'].attrs['shape']
+        ) is not None
+
+    def rewrite(self, graph, match):
+        inner, outer = match['inner'], match['outer']
+        inner.attrs['shape'] = self._composed_shape(
+            inner.attrs['shape'], outer.attrs['shape']
+        )
+        graph.fuse_nodes(inner, outer)
+
+
+class TransposeSinker(RewriteRule):
+    '''
+    Moves Transposes below elementwise operators and Concat, so they can
+    meet other Transposes and be composed or cancelled. Transposes of all
+    inputs of multi-input operators must have the same permutation and are
+    replaced by a single Transpose of the result.
+    '''
+    op_types = ('Relu', 'Sigmoid', 'LeakyRelu', 'Abs', 'Add', 'Sum', 'Mul',
+                'Concat')
+    # any op_type, so that nodes are visited in topological order and
+    # Transposes are moved down as far as possible in one run
+    pattern = Op(
+        predicate=lambda node: node.op_type in TransposeSinker.op_types and
+        node.attrs.get('broadcast', 0) == 0,
+        name='node'
+    )
+
+    def _input_transposes(self, graph, node):
+        transposes = []
+        for input_ in node.inputs:
+            parent = node.get_parent(input_)
+            if parent is None or parent.op_type != 'Transpose' or \
+                    not _has_perm(parent) or parent in transposes:
+                return None
+            if len(parent.children) != 1 or graph.is_output(input_):
+                return None
+            # let TransposeComposer merge it with the parent first
+            grandparent = parent.get_parent(parent.inputs[0])
+            if grandparent is not None and \
+                    grandparent.op_type == 'Transpose':
+                return None
+            transposes.append(parent)
+        return transposes
+
+    def _concat_axis(self, node, perm):
+        axis = node.attrs.get('axis', 1)
+        if axis < 0:
+            axis += len(perm)
+        return perm[axis]
+
+    def is_eligible(self, graph, match):
+        node = match['node']
+        transposes = self._input_transposes(graph, node)
+        if not transposes:
             return False
-        if nodes[1].op_type != 'Transpose':
+        perm = transposes[0].attrs['perm']
+        if any(t.attrs['perm'] != perm for t in transposes):
             return False
-        if nodes[2].op_type != 'Reshape':
+        # CoreML concatenates only along sequence or channel axis
+        if node.op_type == 'Concat' and self._concat_axis(node, perm) > 1:
             return False
+        return True
+
+    def rewrite(self, graph, match):
+        node = match['node']
+        transposes = self._input_transposes(graph, node)
+        perm = list(transposes[0].attrs['perm'])
+        if len(transposes) == 1:
+            # swap operators of the two nodes, edges stay the same
+            transpose = transposes[0]
+            for attr in ('name', 'op_type', 'attrs', 'metadata'):
+                value = getattr(transpose, attr)
+                setattr(transpose, attr, getattr(node, attr))
+                setattr(node, attr, value)
+            graph.reindex_node(transpose)
+            graph.reindex_node(node)
+            return
 
-        shape = nodes[0].attrs['shape']
-        if len(shape) != 6:
+        if node.op_type == 'Concat':
+            node.attrs['axis'] = self._concat_axis(node, perm)
+        for transpose in transposes:
+            graph.bypass_node(transpose)
+        output_name = graph.get_unique_edge_name(
+            "{}_transposed".format(node.name,)
+        )
+        transpose = Node(
+            graph.get_unique_edge_name("{}_transpose".format(node.name,)),
+            'Transpose', {'perm': perm}, [output_name],
+            list(node.outputs)
+        )
+        graph.insert_node_after(node, transpose)
+
+
+class TransposeOptimizer(PatternRewriter):
+    '''
+    Removes redundant Transposes and Reshapes: composes chains of them,
+    cancels inverse permutations and sinks Transposes through elementwise
+    operators and Concat. metrics reports number of removed layers.
+    '''
+    def __init__(self):
+        super(TransposeOptimizer, self).__init__([
+            TransposeSinker(), TransposeComposer(), ReshapeComposer()
+        ])
+        self.metrics = {}
+
+    def __call__(self, graph):
+        num_nodes = graph.num_nodes
+        graph = super(TransposeOptimizer, self).__call__(graph)
+        self.metrics = {'layers_removed': num_nodes - graph.num_nodes}
+        return graph
+
+
+def _spatial_paddings(pad):
+    '''
+    Returns (top, bottom, left, right) paddings of Pad node or None if it
+    pads non-spatial dimensions
+    '''
+    # [x1_begin, x2_begin, ..., x1_end, x2_end, ...] of trailing axes
+    paddings = pad.attrs.get('paddings', [])
+    num_axes = len(paddings) // 2
+    if num_axes < 2 or len(paddings) % 2 != 0:
+        return None
+    begins, ends = paddings[:num_axes], paddings[num_axes:]
+    if any(p != 0 for p in begins[:-2] + ends[:-2]):
+        return None
+    return begins[-2], ends[-2], begins[-1], ends[-1]
+
+
+# Operators producing non-negative outputs, zero padding of their output
+# doesn't change max pooling result
+_NON_NEGATIVE_OP_TYPES = ('Relu', 'Sigmoid', 'Abs')
+
+
+def _is_constant_pad_mode(mode):
+    # string attributes are bytes on python 3
+    if isinstance(mode, bytes):
+        mode = mode.decode('utf-8')
+    return mode in (None, 'constant')
+
+
+class PadFuser(RewriteRule):
+    '''
+    Fuses constant Pad into padding of following Conv or pooling layer.
+    Pad value must be zero for convolution and average pooling (which
+    counts padded zeros then) and -inf, or zero for non-negative inputs, for
+    max pooling.
+    '''
+    pattern = Op(
+        ('Conv', 'MaxPool', 'AveragePool'),
+        inputs=[
+            Op('Pad', attrs={'mode': _is_constant_pad_mode}, name='pad')
+        ],
+        name='node'
+    )
+
+    def _is_zero_max_pool_pad(self, pad):
+        parent = pad.get_parent(pad.inputs[0])
+        return parent is not None and \
+            parent.op_type in _NON_NEGATIVE_OP_TYPES
+
+    def is_eligible(self, graph, match):
+        pad, node = match['pad'], match['node']
+        if len(pad.inputs) != 1 or _spatial_paddings(pad) is None:
             return False
-        if shape[0] != 1 or shape[2] != shape[3]:
+        value = pad.attrs.get('value', 0.0)
+        if node.op_type == 'MaxPool':
+            return value == -np.inf or \
+                (value == 0 and self._is_zero_max_pool_pad(pad))
+        if value != 0:
             return False
+        if node.op_type == 'AveragePool':
+            # padding of the pool itself must be counted the same way
+            return node.attrs.get('count_include_pad', 0) == 1 or \
+                not any(node.attrs.get('pads', [0, 0, 0, 0]))
+        return True
 
-        input_channels = shape[1]
-        scale_factor = shape[2]
-        input_height = shape[4]
-        input_width = shape[5]
+    def rewrite(self, graph, match):
+        pad, node = match['pad'], match['node']
+        pad_t, pad_b, pad_l, pad_r = _spatial_paddings(pad)
+        # ONNX pads are [top, left, bottom, right]
+        pads = node.attrs.get('pads', [0, 0, 0, 0])
+        node.attrs['pads'] = [
+            pads[0] + pad_t, pads[1] + pad_l, pads[2] + pad_b, pads[3] + pad_r
+        ]
+        if node.op_type == 'AveragePool':
+            node.attrs['count_include_pad'] = 1
+        graph.bypass_node(pad)
 
-        if nodes[1].attrs.get('perm', []) != [0, 1, 4, 2, 5, 3]:
-            return False
 
-        shape = nodes[2].attrs['shape']
-        if len(shape) != 4:
-            return False
+# Channel-wise operators whose output channel c depends only on input
+# channel c, constants are propagated through them with numpy kernels
+_CHANNELWISE_OP_TYPES = (
+    'Relu', 'LeakyRelu', 'Sigmoid', 'Abs', 'Clip', 'HardSigmoid'
+)
+
+_POOL_OP_TYPES = (
+    'MaxPool', 'AveragePool', 'GlobalMaxPool', 'GlobalAveragePool'
+)
+
+
+def _conv_bias(node, channels):
+    if len(node.inputs) > 2:
+        return np.broadcast_to(
+            node.input_tensors[node.inputs[2]].reshape(-1), (channels,)
+        )
+    return np.zeros((channels,), dtype=np.float32)
+
 
-        output_channels = shape[1]
-        output_height = shape[2]
-        output_width = shape[3]
-        if input_channels != output_channels:
+def _is_prunable_conv(node):
+    return node.op_type == 'Conv' and len(node.outputs) == 1 and \
+        _has_constant_weights(node) and \
+        len(node.input_tensors.peek(node.inputs[1]).shape) == 4
+
+
+def _is_depthwise(node):
+    W = node.input_tensors.peek(node.inputs[1])
+    return W.shape[1] == 1 and node.attrs.get('group', 1) == W.shape[0]
+
+
+def _absorbs_input_channels(node):
+    # weights of grouped convolutions have only C / group input channels
+    return _is_prunable_conv(node) and node.attrs.get('group', 1) == 1
+
+
+class DeadChannelPruner(object):
+    '''
+    Removes convolution output channels which don't affect graph outputs:
+    channels with all weights zero (e.g. after folding BatchNormalization
+    with zero gamma) or ignored by BatchNormalization with zero gamma.
+    Matching channels are removed from BatchNormalization, channel-wise
+    activations, pooling, elementwise operators and Concat they pass
+    through, down to convolutions where the channels are constant and are
+    folded into bias (if the convolution pads input only zero channels
+    are). Channels reaching graph outputs, grouped convolutions or other
+    operators are kept, so outputs don't change. metrics reports number of
+    removed channels and weight bytes.
+    '''
+    def __init__(self):
+        self.num_rewrites = 0
+        self.metrics = {}
+
+    def _output_values(self, node, values):
+        '''
+        Returns per channel values of node output, NaN for channels which
+        are not constant, or None if node channels can't be pruned
+        '''
+        op_type = node.op_type
+        inputs = [values.get(i) for i in node.inputs]
+        if len(node.outputs) != 1:
+            return None
+        if op_type == 'Conv':
+            if not _is_prunable_conv(node):
+                return None
+            W = node.input_tensors[node.inputs[1]]
+            W = W.reshape(W.shape[0], -1)
+            b = _conv_bias(node, W.shape[0])
+            dead = ~W.any(axis=1)
+            if node.attrs.get('group', 1) == 1:
+                return np.where(dead, b, np.nan)
+            v = inputs[0]
+            if v is None or not _is_depthwise(node) or len(v) != len(W):
+                return None
+            if any(node.attrs.get('pads', [])):
+                v = np.where(v == 0, v, np.nan)
+            return np.where(dead, b, v * W.sum(axis=1) + b)
+        v = inputs[0]
+        if v is None:
+            return None
+        if op_type in ('BatchNormalization', 'SpatialBN'):
+            if len(node.inputs) < 5 or \
+                    any(i not in node.input_tensors for i in node.inputs[1:5]):
+                return None
+            scale, bias, mean, var = [
+                node.input_tensors[i].reshape(-1)
+                for i in node.inputs[1:5]
+            ]
+            if len(scale) != len(v):
+                return None
+            a = scale / np.sqrt(var + node.attrs.get('epsilon', 1e-5))
+            b = bias - mean * a
+            return np.where(a == 0, b, v * a + b)
+        if op_type in _CHANNELWISE_OP_TYPES:
+            if len(node.inputs) != 1:
+                return None
+            return _run_node(node, [v.reshape(1, -1, 1, 1)])[0].reshape(-1)
+        if op_type in _POOL_OP_TYPES:
+            if op_type == 'AveragePool' and \
+                    node.attrs.get('count_include_pad', 0) and \
+                    any(node.attrs.get('pads', [])):
+                return np.where(v == 0, v, np.nan)
+            return v
+        if any(i is None for i in inputs):
+            return None
+        if op_type in ('Add', 'Sum', 'Mul'):
+            if node.attrs.get('broadcast', 0) or \
+                    any(len(i) != len(v) for i in inputs):
+                return None
+            if op_type == 'Mul':
+                product = np.prod(inputs, axis=0)
+                return np.where(np.any(np.equal(inputs, 0), axis=0),
+                                0, product)
+            return np.sum(inputs, axis=0)
+        if op_type == 'Concat' and node.attrs.get('axis', 1) == 1:
+            return np.concatenate(inputs)
+        return None
+
+    def _constraints(self, graph, values):
+        '''
+        Returns (ties, keep): ties are lists of (edge, slice) which must
+        keep the same channels, keep maps edges to masks of channels needed
+        by consumers which can't be pruned. Channels are removed only if
+        they end up in convolutions which absorb them, so removed channels
+        don't have to be constant until they reach them.
+        '''
+        keep = dict(
+            (name, np.zeros(len(v), dtype=bool)) for name, v in values.items()
+        )
+        ties = []
+        whole = slice(None)
+        for node in graph.nodes:
+            output = node.outputs[0] if node.outputs else None
+            tied = []
+            if output in values:
+                if node.op_type == 'Concat':
+                    offset = 0
+                    for input_ in node.inputs:
+                        size = len(values[input_])
+                        ties.append([
+                            (input_, whole),
+                            (output, slice(offset, offset + size))
+                        ])
+                        offset += size
+                    tied = node.inputs
+                elif node.op_type != 'Conv' or _is_depthwise(node):
+                    tied = [i for i in node.inputs if i in values]
+                    ties.append([(i, whole) for i in tied + [output]])
+            if _absorbs_input_channels(node) and node.inputs[0] in values:
+                # constant input channels are folded into bias
+                v = values[node.inputs[0]]
+                absorbable = v == 0
+                if not any(node.attrs.get('pads', [])):
+                    absorbable |= np.isfinite(v)
+                keep[node.inputs[0]] = keep[node.inputs[0]] | ~absorbable
+                tied = [node.inputs[0]]
+            for input_ in node.inputs:
+                if input_ in values and input_ not in tied:
+                    keep[input_] = np.ones_like(keep[input_])
+        for output in graph.outputs:
+            if output[0] in values:
+                keep[output[0]] = np.ones_like(keep[output[0]])
+        return ties, keep
+
+    def _channel_masks(self, graph, values):
+        ties, keep = self._constraints(graph, values)
+        changed = True
+        while changed:
+            changed = False
+            for tie in ties:
+                mask = np.zeros_like(keep[tie[0][0]][tie[0][1]])
+                for name, s in tie:
+                    mask |= keep[name][s]
+                for name, s in tie:
+                    if np.any(keep[name][s] != mask):
+                        keep[name][s] = mask
+                        changed = True
+            for mask in keep.values():
+                if not mask.any():
+                    mask[0] = True
+                    changed = True
+        return keep
+
+    def _slice(self, node, name, mask, axis=0):
+        tensor = node.input_tensors[name]
+        sliced = np.compress(mask, tensor, axis=axis)
+        node.input_tensors[name] = sliced
+        return tensor.nbytes - sliced.nbytes
+
+    def __call__(self, graph):
+        self.num_rewrites = 0
+        values = {}
+        for node in graph.nodes:
+            v = self._output_values(node, values)
+            if v is not None:
+                values[node.outputs[0]] = v
+        keep = self._channel_masks(graph, values)
+
+        channels = 0
+        weight_bytes = 0
+        for node in graph.nodes:
+            input_ = node.inputs[0] if node.inputs else None
+            output = node.outputs[0] if node.outputs else None
+            is_conv = _is_prunable_conv(node)
+            depthwise = is_conv and _is_depthwise(node)
+            pruned = False
+            if _absorbs_input_channels(node) and input_ in keep and \
+                    not keep[input_].all():
+                removed = ~keep[input_]
+                W = node.input_tensors[node.inputs[1]]
+                shift = np.einsum(
+                    'ocij,c->o', W[:, removed], values[input_][removed]
+                )
+                if np.any(shift != 0):
+                    _scale_output_channels(graph, node, 1.0, shift)
+                weight_bytes += self._slice(
+                    node, node.inputs[1], keep[input_], axis=1
+                )
+                pruned = True
+            if output in keep and not keep[output].all():
+                mask = keep[output]
+                if is_conv:
+                    channels += len(mask) - mask.sum()
+                    for name in node.inputs[1:3]:
+                        weight_bytes += self._slice(node, name, mask)
+                    if depthwise:
+                        node.attrs['group'] = int(mask.sum())
+                    pruned = True
+                elif node.op_type in ('BatchNormalization', 'SpatialBN'):
+                    for name in node.inputs[1:5]:
+                        weight_bytes += self._slice(node, name, mask)
+                    pruned = True
+            self.num_rewrites += pruned
+        self.metrics = {
+            'channels_removed': int(channels),
+            'weight_bytes_removed': int(weight_bytes),
+        }
+        return graph
+
+
+class SiblingConvMerger(object):
+    '''
+    Merges convolutions reading the same input with the same kernel,
+    strides, pads and dilations into one convolution with weights stacked
+    along output channels. If results of the convolutions are only
+    concatenated along channels, the merged convolution replaces them in
+    Concat, otherwise a Split restores the original outputs. metrics
+    reports number of removed convolutions.
+    '''
+    def __init__(self):
+        self.num_rewrites = 0
+        self.metrics = {}
+
+    def _group_key(self, node):
+        if len(node.inputs) < 2 or not _has_constant_weights(node):
+            return None
+        if node.attrs.get('group', 1) != 1 or len(node.outputs) != 1:
+            return None
+        W = node.input_tensors.peek(node.inputs[1])
+        attrs = tuple(
+            tuple(node.attrs.get(attr, default)) for attr, default in [
+                ('kernel_shape', W.shape[2:]), ('strides', [1, 1]),
+                ('pads', [0, 0, 0, 0]), ('dilations', [1, 1])
+            ]
+        )
+        return (node.inputs[0], tuple(W.shape[1:])) + attrs
+
+    def _concat_order(self, graph, convs):
+        '''
+        Returns convs in the order of Concat inputs if their outputs are
+        contiguous inputs of the same Concat along channels and are not
+        used elsewhere, otherwise None
+        '''
+        concat = None
+        for conv in convs:
+            output = conv.outputs[0]
+            if len(conv.children) != 1 or graph.is_output(output):
+                return None
+            child = conv.children.first()
+            if child.op_type != 'Concat' or child.attrs.get('axis', 1) != 1:
+                return None
+            if child.inputs.count(output) != 1:
+                return None
+            if concat is not None and child is not concat:
+                return None
+            concat = child
+        positions = sorted(concat.inputs.index(c.outputs[0]) for c in convs)
+        if positions[-1] - positions[0] != len(convs) - 1:
+            return None
+        return [concat.get_parent(concat.inputs[i]) for i in positions]
+
+    def _merge(self, graph, convs, first):
+        concat_convs = self._concat_order(graph, convs)
+        if concat_convs is not None:
+            convs = concat_convs
+        parent = convs[0].get_parent(convs[0].inputs[0])
+        W = np.concatenate(
+            [c.input_tensors[c.inputs[1]] for c in convs], axis=0
+        )
+        name = convs[0].name
+        inputs = [
+            convs[0].inputs[0],
+            graph.get_unique_edge_name("{}_merged_weight".format(name,))
+        ]
+        output = graph.get_unique_edge_name("{}_merged".format(name,))
+        merged = Node(
+            "{}_merged".format(name,), 'Conv', dict(convs[0].attrs),
+            inputs, [output]
+        )
+        merged.input_tensors[inputs[1]] = W
+        if any(len(c.inputs) > 2 for c in convs):
+            inputs.append(
+                graph.get_unique_edge_name("{}_merged_bias".format(name,))
+            )
+            merged.input_tensors[inputs[2]] = np.concatenate([
+                c.input_tensors[c.inputs[2]] if len(c.inputs) > 2 else
+                np.zeros((c.input_tensors.peek(c.inputs[1]).shape[0],),
+                         dtype=np.float32)
+                for c in convs
+            ])
+
+        graph.add_node(merged, before=first)
+        if parent is not None:
+            parent.add_child(merged)
+        children = []
+        for conv in convs:
+            for child in conv.children:
+                if child not in children:
+                    children.append(child)
+            graph.remove_node(conv)
+
+        if concat_convs is not None:
+            concat = children[0]
+            outputs = [c.outputs[0] for c in convs]
+            start = concat.inputs.index(outputs[0])
+            graph.set_inputs(
+                concat,
+                concat.inputs[:start] + [output] +
+                concat.inputs[start + len(convs):]
+            )
+            merged.add_child(concat)
+            return
+
+        split = Node(
+            "{}_split".format(name,), 'Split',
+            {'axis': 1, 'split': [
+                c.input_tensors.peek(c.inputs[1]).shape[0] for c in convs
+            ]},
+            [output], [c.outputs[0] for c in convs]
+        )
+        graph.add_node(split, before=first)
+        merged.add_child(split)
+        for child in children:
+            split.add_child(child)
+
+    def __call__(self, graph):
+        self.num_rewrites = 0
+        num_merged = 0
+        groups = {}
+        for node in graph.get_nodes_by_op_type('Conv'):
+            key = self._group_key(node)
+            if key is not None:
+                groups.setdefault(key, []).append(node)
+        groups = [g for g in groups.values() if len(g) > 1]
+        if groups:
+            positions = {node: i for i, node in enumerate(graph.nodes)}
+            for convs in groups:
+                convs = sorted(convs, key=lambda c: positions[c])
+                self._merge(graph, convs, convs[0])
+                self.num_rewrites += 1
+                num_merged += len(convs) - 1
+        self.metrics = {'convolutions_merged': num_merged}
+        return graph
+
+
+class ElementwiseFlattener(object):
+    '''
+    Collapses trees of Add/Sum and of Mul operators into single multi
+    input operators (Add trees become Sum) when intermediate results have
+    no other consumers. Operators with broadcasting or constant inputs are
+    left alone as CoreML elementwise layers don't support them.
+    '''
+    _FAMILIES = {'Add': 'Sum', 'Sum': 'Sum', 'Mul': 'Mul'}
+
+    def __init__(self):
+        self.num_rewrites = 0
+        self.metrics = {}
+
+    def _is_flattenable(self, node):
+        return node.op_type in self._FAMILIES and \
+            node.attrs.get('broadcast', 0) == 0 and \
+            len(node.outputs) == 1 and \
+            not any(i in node.input_tensors for i in node.inputs)
+
+    def _is_inlineable(self, graph, node, parent):
+        return parent is not None and self._is_flattenable(parent) and \
+            self._FAMILIES[parent.op_type] == \
+            self._FAMILIES[node.op_type] and \
+            len(parent.children) == 1 and \
+            node.inputs.count(parent.outputs[0]) == 1 and \
+            not graph.is_output(parent.outputs[0])
+
+    def __call__(self, graph):
+        self.num_rewrites = 0
+        # parents are flattened before their consumers
+        for node in list(graph.nodes):
+            if node not in graph or not self._is_flattenable(node):
+                continue
+            inputs = []
+            for input_ in node.inputs:
+                parent = node.get_parent(input_)
+                if not self._is_inlineable(graph, node, parent):
+                    inputs.append(input_)
+                    continue
+                inputs.extend(parent.inputs)
+                grandparents = list(parent.parents)
+                graph.remove_node(parent)
+                for grandparent in grandparents:
+                    if node not in grandparent.children:
+                        grandparent.add_child(node)
+                self.num_rewrites += 1
+            if len(inputs) == len(node.inputs):
+                continue
+            graph.set_inputs(node, inputs)
+            if node.op_type != self._FAMILIES[node.op_type]:
+                node.op_type = self._FAMILIES[node.op_type]
+                graph.reindex_node(node)
+        self.metrics = {'layers_removed': self.num_rewrites}
+        return graph
+
+
+def _is_scalar(value):
+    return np.size(value) == 1
+
+
+def _scalar(node, name):
+    return float(np.asarray(node.input_tensors.peek(name)).flat[0])
+
+
+def _has_single_input(node):
+    return len(node.inputs) == 1
+
+
+def _has_two_inputs(node):
+    return len(node.inputs) == 2
+
+
+def _activation_bounds(node):
+    if node.op_type == 'Relu':
+        return 0.0, np.inf
+    return _clip_bounds(node)
+
+
+def _set_clip_bounds(graph, node, low, high):
+    '''
+    Turns node into Relu or Clip computing clip(input, low, high)
+    '''
+    attrs = {}
+    if low == 0 and high == np.inf:
+        op_type = 'Relu'
+    else:
+        op_type = 'Clip'
+        if low != -np.inf:
+            attrs['min'] = float(low)
+        if high != np.inf:
+            attrs['max'] = float(high)
+    node.attrs = attrs
+    if node.op_type != op_type:
+        node.op_type = op_type
+        graph.reindex_node(node)
+
+
+def _drop_constant_input(graph, node, name):
+    '''
+    Leaves node with its only non constant input
+    '''
+    node.input_tensors.pop(name, None)
+    graph.set_inputs(node, [i for i in node.inputs if i != name])
+
+
+class MinMaxToClip(RewriteRule):
+    '''
+    Replaces Min or Max of a tensor and a scalar constant with Clip
+    '''
+    pattern = Op(
+        ('Min', 'Max'),
+        inputs=[Var('x'), Constant('c', predicate=_is_scalar)],
+        predicate=_has_two_inputs,
+        commutative=True,
+        name='node'
+    )
+
+    def is_eligible(self, graph, match):
+        return match['x'] not in match['node'].input_tensors
+
+    def rewrite(self, graph, match):
+        node = match['node']
+        value = _scalar(node, match['c'])
+        _drop_constant_input(graph, node, match['c'])
+        if node.op_type == 'Min':
+            _set_clip_bounds(graph, node, -np.inf, value)
+        else:
+            _set_clip_bounds(graph, node, value, np.inf)
+
+
+class ClipComposer(RewriteRule):
+    '''
+    Composes two consecutive Relu or Clip operators into one, e.g.
+    Min(Relu(x), 6) (Relu6) becomes a single Clip
+    '''
+    pattern = Op(
+        ('Relu', 'Clip'),
+        inputs=[Op(('Relu', 'Clip'), predicate=_has_single_input,
+                   name='inner')],
+        predicate=_has_single_input,
+        name='outer'
+    )
+
+    def rewrite(self, graph, match):
+        inner, outer = match['inner'], match['outer']
+        inner_low, inner_high = _activation_bounds(inner)
+        outer_low, outer_high = _activation_bounds(outer)
+        low = min(max(inner_low, outer_low), outer_high)
+        high = min(max(inner_high, outer_low), outer_high)
+        _set_clip_bounds(graph, inner, low, high)
+        graph.fuse_nodes(inner, outer)
+
+
+class HardSigmoidFuser(RewriteRule):
+    '''
+    Fuses Clip(x, 0, max) multiplied or divided by a scalar constant which
+    maps max to 1 into HardSigmoid, e.g. Relu6(x) / 6
+    '''
+    pattern = Op(
+        ('Mul', 'Div'),
+        inputs=[Op('Clip', predicate=_has_single_input, name='clip'),
+                Constant('k', predicate=_is_scalar)],
+        predicate=_has_two_inputs,
+        commutative=True,
+        name='node'
+    )
+
+    def _alpha(self, match):
+        node, clip = match['node'], match['clip']
+        k = _scalar(node, match['k'])
+        if node.op_type == 'Mul':
+            return k
+        if node.inputs[0] != clip.outputs[0] or k == 0:
+            return None
+        return 1.0 / k
+
+    def is_eligible(self, graph, match):
+        low, high = _clip_bounds(match['clip'])
+        alpha = self._alpha(match)
+        return alpha is not None and low == 0 and 0 < high < np.inf and \
+            np.isclose(alpha * high, 1.0, rtol=1e-6, atol=0)
+
+    def rewrite(self, graph, match):
+        clip = match['clip']
+        clip.op_type = 'HardSigmoid'
+        clip.attrs = {'alpha': self._alpha(match), 'beta': 0.0}
+        graph.reindex_node(clip)
+        graph.fuse_nodes(clip, match['node'])
+
+
+class HardSigmoidInputFuser(RewriteRule):
+    '''
+    Folds Add, Sub, Mul or Div by a scalar constant feeding HardSigmoid
+    into its alpha and beta, e.g. Relu6(x + 3) / 6 becomes a single
+    HardSigmoid
+    '''
+    pattern = Op(
+        'HardSigmoid',
+        inputs=[Op(('Add', 'Sub', 'Mul', 'Div'),
+                   inputs=[Var('x'), Constant('c', predicate=_is_scalar)],
+                   predicate=_has_two_inputs,
+                   commutative=True,
+                   name='affine')],
+        name='node'
+    )
+
+    def _scale_shift(self, match):
+        '''
+        Returns (scale, shift) such that affine output = x * scale + shift
+        '''
+        affine = match['affine']
+        c = _scalar(affine, match['c'])
+        constant_first = affine.inputs[0] == match['c']
+        if affine.op_type == 'Add':
+            return 1.0, c
+        if affine.op_type == 'Sub':
+            return (-1.0, c) if constant_first else (1.0, -c)
+        if affine.op_type == 'Mul':
+            return c, 0.0
+        if constant_first or c == 0:
+            return None
+        return 1.0 / c, 0.0
+
+    def is_eligible(self, graph, match):
+        return match['x'] not in match['affine'].input_tensors and \
+            self._scale_shift(match) is not None
+
+    def rewrite(self, graph, match):
+        node, affine = match['node'], match['affine']
+        scale, shift = self._scale_shift(match)
+        alpha = node.attrs.get('alpha', 0.2)
+        beta = node.attrs.get('beta', 0.5)
+        node.attrs['alpha'] = alpha * scale
+        node.attrs['beta'] = alpha * shift + beta
+        _drop_constant_input(graph, affine, match['c'])
+        graph.bypass_node(affine)
+
+
+def _is_leaky_relu_slope(value):
+    return _is_scalar(value) and float(np.asarray(value).flat[0]) > 0
+
+
+class LeakyReluFuser(RewriteRule):
+    '''
+    Fuses Max(x, alpha * x) with alpha < 1 (or Min with alpha > 1) into
+    LeakyRelu
+    '''
+    pattern = Op(
+        ('Max', 'Min'),
+        inputs=[
+            Var('x'),
+            Op('Mul',
+               inputs=[Var('x'), Constant('alpha', _is_leaky_relu_slope)],
+               predicate=_has_two_inputs, commutative=True, name='mul')
+        ],
+        predicate=_has_two_inputs,
+        commutative=True,
+        name='node'
+    )
+
+    def is_eligible(self, graph, match):
+        if match['x'] in match['mul'].input_tensors:
             return False
-        if (input_height * scale_factor) != output_height:
+        alpha = _scalar(match['mul'], match['alpha'])
+        if match['node'].op_type == 'Max':
+            return alpha <= 1
+        return alpha >= 1
+
+    def rewrite(self, graph, match):
+        mul = match['mul']
+        alpha = _scalar(mul, match['alpha'])
+        _drop_constant_input(graph, mul, match['alpha'])
+        mul.op_type = 'LeakyRelu'
+        mul.attrs = {'alpha': alpha}
+        graph.reindex_node(mul)
+        graph.fuse_nodes(mul, match['node'])
+
+
+class ActivationFuser(PatternRewriter):
+    '''
+    Recognizes activation functions composed of elementwise operators
+    (Relu6 and other clips, HardSigmoid, LeakyRelu) and replaces them with
+    single operators, which are lowered to the shortest sequences of
+    CoreML layers. Swish, x * Sigmoid(x), needs no rewrite: Sigmoid and
+    Mul are already the shortest sequence. metrics reports number of
+    removed layers.
+    '''
+    def __init__(self):
+        super(ActivationFuser, self).__init__([
+            LeakyReluFuser(), MinMaxToClip(), ClipComposer(),
+            HardSigmoidFuser(), HardSigmoidInputFuser()
+        ])
+        self.metrics = {}
+
+    def __call__(self, graph):
+        num_nodes = graph.num_nodes
+        graph = super(ActivationFuser, self).__call__(graph)
+        self.metrics = {'layers_removed': num_nodes - graph.num_nodes}
+        return graph
+
+
+def _add_input_bias(node, bias):
+    '''
+    Returns bias of Conv node computing the same result for input + bias,
+    bias is per input channel. Padding is assumed to be zero.
+    '''
+    W = node.input_tensors[node.inputs[1]]
+    group = node.attrs.get('group', 1)
+    W_ = W.reshape((group, W.shape[0] // group) + W.shape[1:])
+    bias = np.asarray(bias, dtype=np.float32).reshape(group, W.shape[1])
+    return np.einsum('gocij,gc->go', W_, bias).reshape(-1)
+
+
+class PreprocessingFolder(object):
+    '''
+    Folds image preprocessing (scale * input + per channel bias) of graph
+    inputs into convolutions consuming them. preprocessing maps input names
+    to (scale, bias) tuples. Input is folded only if all its consumers are
+    convolutions with constant weights and, if bias is not zero, without
+    padding, so the result is exact. Names of folded inputs are collected
+    in folded and reasons why other inputs were not folded in failures.
+    '''
+    def __init__(self, preprocessing):
+        self.preprocessing = preprocessing
+        self.num_rewrites = 0
+        self.folded = []
+        self.failures = {}
+
+    def _check_consumer(self, name, node, bias):
+        if node.op_type != 'Conv':
+            return "it is used by {} operator {}".format(
+                node.op_type, node.name
+            )
+        if node.inputs.index(name) != 0 or node.inputs.count(name) != 1:
+            return "it is not the only data input of convolution {}".format(
+                node.name,
+            )
+        if not _has_constant_weights(node):
+            return "convolution {} doesn't have constant weights".format(
+                node.name,
+            )
+        W = node.input_tensors.peek(node.inputs[1])
+        channels = W.shape[1] * node.attrs.get('group', 1)
+        if channels != len(bias):
+            return "convolution {} expects {} channels".format(
+                node.name, channels
+            )
+        if np.any(bias != 0) and any(node.attrs.get('pads', [])):
+            return "convolution {} pads input with zeros".format(node.name,)
+        return None
+
+    def _fold(self, graph, node, scale, bias):
+        input_bias = _add_input_bias(node, bias)
+        W = node.input_tensors[node.inputs[1]]
+        node.input_tensors[node.inputs[1]] = \
+            (W * np.float32(scale)).astype(np.float32)
+        if len(node.inputs) > 2:
+            b = node.input_tensors[node.inputs[2]]
+        else:
+            node.inputs.append(graph.get_unique_edge_name(
+                "{}_bias".format(node.name,)
+            ))
+            b = np.zeros((W.shape[0],), dtype=np.float32)
+        node.input_tensors[node.inputs[2]] = (b + input_bias).astype(
+            np.float32
+        )
+
+    def __call__(self, graph):
+        self.num_rewrites = 0
+        self.folded = []
+        self.failures = {}
+        consumers = {}
+        for node in graph.nodes:
+            for input_ in set(node.inputs):
+                if input_ in self.preprocessing:
+                    consumers.setdefault(input_, []).append(node)
+        for name, (scale, bias) in self.preprocessing.items():
+            bias = np.asarray(bias, dtype=np.float32)
+            nodes = consumers.get(name, [])
+            if not nodes:
+                self.failures[name] = "it has no consumers"
+                continue
+            if graph.is_output(name):
+                self.failures[name] = "it is a graph output"
+                continue
+            reasons = [self._check_consumer(name, node, bias)
+                       for node in nodes]
+            reasons = [r for r in reasons if r is not None]
+            if reasons:
+                self.failures[name] = reasons[0]
+                continue
+            for node in nodes:
+                self._fold(graph, node, scale, bias)
+            self.folded.append(name)
+            self.num_rewrites += 1
+        return graph
+
+
+class DeprocessingFolder(object):
+    '''
+    Folds image deprocessing (scale * output + per channel bias) of graph
+    outputs into parameters of layers producing them: Conv, Gemm or FC
+    with constant weights or BatchNormalization. deprocessing maps output
+    names to (scale, bias) tuples. Names of folded outputs are collected in
+    folded and reasons why other outputs were not folded in failures.
+    '''
+    def __init__(self, deprocessing):
+        self.deprocessing = deprocessing
+        self.num_rewrites = 0
+        self.folded = []
+        self.failures = {}
+
+    def _check_producer(self, name, node, channels):
+        if node is None:
+            return "it is not produced by any layer"
+        if len(node.get_children(name)) > 0:
+            return "it is also used by other layers"
+        if node.op_type in ('Conv', 'Gemm', 'FC'):
+            if not _has_constant_weights(node) or \
+                    not _can_scale_output_channels(node, channels):
+                return "{} {} weights can't be scaled".format(
+                    node.op_type, node.name
+                )
+            return None
+        if node.op_type in ('BatchNormalization', 'SpatialBN'):
+            if not all(i in node.input_tensors for i in node.inputs[1:5]):
+                return "{} {} parameters are not constant".format(
+                    node.op_type, node.name
+                )
+            if channels not in (1, node.input_tensors.peek(
+                    node.inputs[1]).size):
+                return "{} {} has a different number of channels".format(
+                    node.op_type, node.name
+                )
+            return None
+        return "it is produced by {} operator {}".format(
+            node.op_type, node.name
+        )
+
+    def _fold_bn(self, node, scale, bias):
+        gamma = node.input_tensors[node.inputs[1]]
+        beta = node.input_tensors[node.inputs[2]]
+        node.input_tensors[node.inputs[1]] = \
+            (gamma * scale).astype(np.float32)
+        node.input_tensors[node.inputs[2]] = \
+            (beta * scale + bias).astype(np.float32)
+
+    def __call__(self, graph):
+        self.num_rewrites = 0
+        self.folded = []
+        self.failures = {}
+        producers = {}
+        for node in graph.nodes:
+            for output in node.outputs:
+                if output in self.deprocessing:
+                    producers[output] = node
+        for name, (scale, bias) in self.deprocessing.items():
+            bias = np.asarray(bias, dtype=np.float32)
+            node = producers.get(name)
+            reason = self._check_producer(name, node, len(bias))
+            if reason is not None:
+                self.failures[name] = reason
+                continue
+            scale = np.full(bias.shape, scale, dtype=np.float32)
+            if node.op_type in ('BatchNormalization', 'SpatialBN'):
+                self._fold_bn(node, scale, bias)
+            else:
+                _scale_output_channels(graph, node, scale, bias)
+            self.folded.append(name)
+            self.num_rewrites += 1
+        return graph
+
+
+class IdentityOpRemover(object):
+    '''
+    Removes operators which don't change their input: Reshape to the same
+    shape, Transpose with identity perm, Pad with zero paddings, Slice of
+    the whole tensor and single input Concat/Sum/Add/Mul. Consumers are
+    connected to the operator input, if operator output is graph output
+    its producer is made to write graph output instead.
+    '''
+    _MAX_INDEX = 2 ** 31 - 1
+
+    def __init__(self):
+        self.num_rewrites = 0
+        self.metrics = {}
+
+    def _is_identity(self, node, shapes):
+        if len(node.outputs) != 1 or len(node.inputs) == 0:
             return False
-        if (input_width * scale_factor) != output_width:
+        op_type = node.op_type
+        input_shape = shapes.get(node.inputs[0])
+        if op_type in ('Concat', 'Sum', 'Add', 'Mul'):
+            return len(node.inputs) == 1
+        if len(node.inputs) != 1:
             return False
+        if op_type == 'Transpose':
+            return _has_perm(node) and _is_identity_perm(node.attrs['perm'])
+        if op_type == 'Pad':
+            return all(p == 0 for p in node.attrs.get('paddings', [1]))
+        if op_type == 'Reshape':
+            shape = node.attrs.get('shape')
+            if shape is None or input_shape is None:
+                return False
+            return _reshape_output_shape(input_shape, shape) == input_shape
+        if op_type == 'Slice':
+            starts = node.attrs.get('starts', [])
+            ends = node.attrs.get('ends', [])
+            axes = node.attrs.get('axes', list(range(len(starts))))
+            for axis, start, end in zip(axes, starts, ends):
+                if start != 0:
+                    return False
+                if end >= self._MAX_INDEX:
+                    continue
+                if input_shape is None or axis >= len(input_shape) or \
+                        end < input_shape[axis]:
+                    return False
+            return True
+        return False
 
-        return True
+    def __call__(self, graph):
+        self.num_rewrites = 0
+        shapes = dict(
+            (name, info[0]) for name, info in infer_shapes(graph).items()
+            if info[0] is not None
+        )
+        for node in list(graph.nodes):
+            if node not in graph or not self._is_identity(node, shapes):
+                continue
+            if graph.bypass_node(node):
+                self.num_rewrites += 1
+        self.metrics = {'layers_removed': self.num_rewrites}
+        return graph
+
+
+def _is_pixel_shuffle(reshape_1, transpose, reshape_2):
+    shape = reshape_1.attrs['shape']
+    if len(shape) != 6:
+        return False
+    if shape[0] != 1 or shape[2] != shape[3]:
+        return False
+
+    input_channels = shape[1]
+    scale_factor = shape[2]
+    input_height = shape[4]
+    input_width = shape[5]
+
+    if transpose.attrs.get('perm', []) != [0, 1, 4, 2, 5, 3]:
+        return False
+
+    shape = reshape_2.attrs['shape']
+    if len(shape) != 4:
+        return False
+
+    output_channels = shape[1]
+    output_height = shape[2]
+    output_width = shape[3]
+    if input_channels != output_channels:
+        return False
+    if (input_height * scale_factor) != output_height:
+        return False
+    if (input_width * scale_factor) != output_width:
+        return False
+
+    return True
+
+
+class PixelShuffleFuser(RewriteRule):
+    '''
+    Fuses 3 operators reshape->transpose->reshape which is equivalent to
+    pytorch's pixel_shuffle layer
+    '''
+    pattern = Op(
+        'Reshape',
+        inputs=[
+            Op('Transpose', inputs=[Op('Reshape', name='reshape')],
+               name='transpose')
+        ],
+        name='final_reshape'
+    )
+
+    def __init__(self):
+        super(PixelShuffleFuser, self).__init__()
+        self.num_added = 0
+
+    def is_eligible(self, graph, match):
+        return _is_pixel_shuffle(
+            match['reshape'], match['transpose'], match['final_reshape']
+        )
 
     def get_unique_edge_name(self, graph, name):
         self.num_added += 1
         return graph.get_unique_edge_name(name + '_' + str(self.num_added))
 
-    def merge(self, graph, nodes):
+    def rewrite(self, graph, match):
         '''
         Pixel shuffle is implemented using 3 operators:
             - Reshape(1, channels, scale, scale, height, width)
@@ -375,9 +1705,11 @@ class PixelShuffleFuser(NodesFuser):
             - Transpose(0, 1, 3, 2)
             - Reshape(1, channels, height * scale, width * scale)
         '''
-        reshape_1 = nodes[0]
-        transpose_1 = nodes[1]
-        transpose_1.children = []
+        reshape_1 = match['reshape']
+        transpose_1 = match['transpose']
+        final_reshape = match['final_reshape']
+        transpose_1.children.remove(final_reshape)
+        final_reshape.parents.remove(transpose_1)
 
         shape = reshape_1.attrs['shape']
 
@@ -396,26 +1728,31 @@ class PixelShuffleFuser(NodesFuser):
             self.get_unique_edge_name(graph, transpose_output_name)
         ]
 
+        reshape_2_output = self.get_unique_edge_name(
+            graph, reshape_output_name
+        )
         reshape_2 = Node(
-            reshape_output_name,
+            reshape_2_output,
             'Reshape',
             {'shape': [channels * height, scale, scale, width]},
-            transpose_1.outputs,
-            [self.get_unique_edge_name(graph, reshape_output_name)]
+            list(transpose_1.outputs),
+            [reshape_2_output]
         )
+        graph.add_node(reshape_2, after=transpose_1)
         transpose_1.add_child(reshape_2)
 
+        transpose_2_output = self.get_unique_edge_name(
+            graph, transpose_output_name
+        )
         transpose_2 = Node(
-            transpose_output_name,
+            transpose_2_output,
             'Transpose',
             {'perm': [0, 1, 3, 2]},
-            reshape_2.outputs,
-            [self.get_unique_edge_name(graph, transpose_output_name)]
+            list(reshape_2.outputs),
+            [transpose_2_output]
         )
+        graph.add_node(transpose_2, after=transpose_1)
         reshape_2.add_child(transpose_2)
 
-        final_reshape = nodes[2]
-        final_reshape.inputs = transpose_2.outputs
-        final_reshape.parents = []
+        final_reshape.inputs = list(transpose_2.outputs)
         transpose_2.add_child(final_reshape)
-        return [reshape_1, transpose_1, reshape_2, transpose_2, final_reshape]
@@ -0,0 +1,322 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import multiprocessing
+
+from collections import OrderedDict
+
+import numpy as np
+import onnx
+
+from ._graph import Graph
+from ._graph_executor import GraphExecutor
+from ._loader import load_model
+from ._spec_executor import SpecExecutor, _feature_shape
+
+try:
+    basestring
+except NameError:  # python 3
+    basestring = str
+
+
+# Edges of error histogram bins: 0, 1e-9, 1e-8, ..., 1, inf
+ERROR_BINS = np.array(
+    [0.0] + [10.0 ** k for k in range(-9, 1)] + [np.inf]
+)
+
+# Relative errors are computed against max(|expected|, _REL_ERROR_FLOOR)
+# so values close to zero don't dominate them
+_REL_ERROR_FLOOR = 1e-6
+
+
+class ErrorStats(object):
+    '''
+    Errors of values computed by CoreML spec compared with values of
+    the ONNX graph: maxima, histograms over ERROR_BINS and number of
+    values outside of atol + rtol * |expected|.
+    '''
+    def __init__(self, rtol, atol):
+        self.rtol = rtol
+        self.atol = atol
+        self.num_values = 0
+        self.num_mismatches = 0
+        self.max_abs_error = 0.0
+        self.max_rel_error = 0.0
+        self.abs_histogram = np.zeros(len(ERROR_BINS) - 1, dtype=np.int64)
+        self.rel_histogram = np.zeros(len(ERROR_BINS) - 1, dtype=np.int64)
+
+    def update(self, expected, actual):
+        expected = np.asarray(expected, dtype=np.float64).ravel()
+        actual = np.asarray(actual, dtype=np.float64).ravel()
+        with np.errstate(invalid='ignore'):
+            abs_error = np.where(
+                expected == actual, 0.0, np.abs(actual - expected)
+            )
+        # NaN in only one of the results
+        abs_error[np.isnan(abs_error)] = np.inf
+        abs_error[np.isnan(expected) & np.isnan(actual)] = 0.0
+        rel_error = abs_error / np.maximum(np.abs(expected),
+                                           _REL_ERROR_FLOOR)
+        rel_error[np.isnan(rel_error)] = np.inf
+
+        self.num_values += abs_error.size
+        self.num_mismatches += int(np.count_nonzero(
+            abs_error > self.atol + self.rtol * np.abs(expected)
+        ))
+        if abs_error.size > 0:
+            self.max_abs_error = max(self.max_abs_error, abs_error.max())
+            self.max_rel_error = max(self.max_rel_error, rel_error.max())
+        self.abs_histogram += np.histogram(abs_error, ERROR_BINS)[0]
+        self.rel_histogram += np.histogram(rel_error, ERROR_BINS)[0]
+
+    def merge(self, other):
+        self.num_values += other.num_values
+        self.num_mismatches += other.num_mismatches
+        self.max_abs_error = max(self.max_abs_error, other.max_abs_error)
+        self.max_rel_error = max(self.max_rel_error, other.max_rel_error)
+        self.abs_histogram += other.abs_histogram
+        self.rel_histogram += other.rel_histogram
+
+    @property
+    def passed(self):
+        return self.num_mismatches == 0
+
+    def __repr__(self):
+        return 'ErrorStats(max_abs_error={:.3g}, max_rel_error={:.3g}, ' \
+            'num_mismatches={}/{})'.format(
+                self.max_abs_error, self.max_rel_error,
+                self.num_mismatches, self.num_values
+            )
+
+
+class ValidationReport(object):
+    '''
+    Result of validate: ErrorStats of every model output in outputs and
+    of every CoreML layer in layers, a list of (layer name, layer type,
+    ErrorStats) in network order. Only layers whose output has the same
+    name and size as an ONNX graph edge are compared, others have no
+    values.
+    '''
+    def __init__(self, outputs, layers, num_samples):
+        self.outputs = outputs
+        self.layers = layers
+        self.num_samples = num_samples
+
+    @property
+    def passed(self):
+        return all(s.passed for s in self.outputs.values())
+
+    @property
+    def first_divergent_layer(self):
+        '''
+        (layer name, layer type, ErrorStats) of the first layer with
+        mismatches or None
+        '''
+        for layer in self.layers:
+            if not layer[2].passed:
+                return layer
+        return None
+
+    def merge(self, other):
+        self.num_samples += other.num_samples
+        for name, stats in other.outputs.items():
+            self.outputs[name].merge(stats)
+        for layer, other_layer in zip(self.layers, other.layers):
+            layer[2].merge(other_layer[2])
+
+
+def format_validation_report(report):
+    '''
+    Returns report (ValidationReport) as text
+    '''
+    lines = ['{} sample(s), {}'.format(
+        report.num_samples, 'passed' if report.passed else 'FAILED'
+    )]
+    lines.append('{:<32} {:>10} {:>10} {:>12}'.format(
+        'output', 'max abs', 'max rel', 'mismatches'
+    ))
+    for name, stats in report.outputs.items():
+        lines.append('{:<32} {:>10.3g} {:>10.3g} {:>12}'.format(
+            name, stats.max_abs_error, stats.max_rel_error,
+            stats.num_mismatches
+        ))
+    bins = ['<1e{}'.format(k) for k in range(-9, 1)] + ['>=1']
+    lines.append('abs error histogram: ' + ' '.join(bins))
+    for name, stats in report.outputs.items():
+        lines.append('{}: {}'.format(
+            name, ' '.join(str(c) for c in stats.abs_histogram)
+        ))
+    layer = report.first_divergent_layer
+    if layer is not None:
+        lines.append('first divergent layer: {} ({}), {}'.format(*layer))
+    return '\n'.join(lines)
+
+
+def _load_onnx(onnx_model):
+    if isinstance(onnx_model, basestring):
+        model, tensor_data = load_model(onnx_model)
+        return Graph.from_onnx(model.graph, tensor_data)
+    return Graph.from_onnx(onnx_model.graph)
+
+
+def _load_spec(coreml_model):
+    if isinstance(coreml_model, basestring):
+        from coremltools.models.utils import load_spec
+        return load_spec(coreml_model)
+    if hasattr(coreml_model, 'get_spec'):
+        return coreml_model.get_spec()
+    return coreml_model
+
+
+class _Validator(object):
+    '''
+    Runs batches with both executors and compares their results
+    '''
+    def __init__(self, onnx_model, spec, rtol, atol, trace_layers,
+                 deprocessing):
+        self.graph = _load_onnx(onnx_model)
+        self.graph_executor = GraphExecutor(self.graph)
+        self.spec_executor = SpecExecutor(spec)
+        self.deprocessing = deprocessing or {}
+        self.rtol = rtol
+        self.atol = atol
+        self.trace_layers = trace_layers
+
+    def random_batch(self, index, batch_size, seed):
+        random_state = np.random.RandomState(seed + index)
+        inputs = {}
+        for name, _, shape in self.graph.inputs:
+            shape = (batch_size * shape[0],) + tuple(shape[1:])
+            value = random_state.random_sample(shape).astype(np.float32)
+            feature = self.spec_executor.inputs[name]
+            if feature.type.WhichOneof('Type') == 'imageType':
+                value = np.floor(value * 256)
+            inputs[name] = value
+        return inputs
+
+    def _report(self):
+        outputs = OrderedDict(
+            (o[0], ErrorStats(self.rtol, self.atol))
+            for o in self.graph.outputs
+        )
+        layers = []
+        if self.trace_layers:
+            layers = [
+                (layer.name, layer.WhichOneof('layer'),
+                 ErrorStats(self.rtol, self.atol))
+                for layer in self.spec_executor.network.layers
+            ]
+        return ValidationReport(outputs, layers, 0)
+
+    def run(self, inputs):
+        report = self._report()
+        graph_inputs = {}
+        spec_inputs = {}
+        batch = None
+        for name, _, shape in self.graph.inputs:
+            value = np.asarray(inputs[name], dtype=np.float32)
+            batch = value.shape[0] // max(shape[0], 1)
+            spec_shape = _feature_shape(self.spec_executor.inputs[name])
+            spec_inputs[name] = value.reshape((batch,) + spec_shape)
+            graph_inputs[name] = self.spec_executor._preprocess(name, value)
+        report.num_samples = batch
+
+        values = self.graph_executor.run_values(graph_inputs)
+        for name, (scale, bias) in self.deprocessing.items():
+            bias = np.asarray(bias, dtype=np.float32).reshape(-1, 1, 1)
+            values[name] = values[name] * np.float32(scale) + bias
+        blobs, _ = self.spec_executor.run_blobs(spec_inputs)
+        for name, stats in report.outputs.items():
+            stats.update(values[name].reshape(batch, -1),
+                         blobs[name].reshape(batch, -1))
+        for layer, (name, _, stats) in zip(
+                self.spec_executor.network.layers, report.layers):
+            output = layer.output[0]
+            if output in values and values[output].size == blobs[output].size:
+                stats.update(values[output], blobs[output])
+        return report
+
+
+# _Validator of the worker process
+_validator = None
+
+
+def _init_worker(onnx_model, spec, rtol, atol, trace_layers, deprocessing):
+    global _validator
+    _validator = _Validator(
+        onnx_model, spec, rtol, atol, trace_layers, deprocessing
+    )
+
+
+def _run_task(task):
+    index, inputs, batch_size, seed = task
+    if inputs is None:
+        inputs = _validator.random_batch(index, batch_size, seed)
+    return _validator.run(inputs)
+
+
+def validate(onnx_model, coreml_model, inputs=None, num_batches=8,
+             batch_size=16, processes=None, seed=0, rtol=1e-3, atol=1e-4,
+             trace_layers=True, deprocessing=None):
+    '''
+    Compares outputs of coreml_model (MLModel, its spec or path to
+    .mlmodel) with outputs of onnx_model (ModelProto or path to .onnx) it
+    was converted from. Both are run with NumPy reference executors, so
+    this works without macOS. The ONNX graph is run with kernels written
+    from the ONNX operator specs, not from the converter, so conversion
+    bugs show up as differences.
+
+    inputs is an iterable of batches: dicts mapping graph inputs to arrays
+    in ONNX layout with samples stacked along axis 0. Without it
+    num_batches random batches of batch_size samples are generated from
+    seed (uniform in [0, 1), pixel values for image inputs). Preprocessing
+    stored in the spec is applied to ONNX inputs as well, preprocessing
+    folded into weights is not.
+
+    Output deprocessing isn't stored in the spec in a recoverable way (it
+    is folded into the last layer by default), so for models converted
+    with deprocessing_args pass deprocessing, a dict mapping image outputs
+    to (scale, per channel bias) in the channel order of the ONNX output,
+    which is applied to ONNX outputs. Without it these outputs differ.
+
+    Batches are run by a pool of processes worker processes (number of
+    CPUs if None, 1 runs them in this process). With trace_layers
+    outputs of CoreML layers are compared with ONNX edges of the same
+    name to find the first divergent layer.
+
+    Returns ValidationReport.
+    '''
+    if not isinstance(onnx_model, (onnx.ModelProto, basestring)):
+        raise TypeError(
+            "Model must be file path to .onnx file or onnx loaded model"
+        )
+    spec = _load_spec(coreml_model)
+    args = (onnx_model, spec, rtol, atol, trace_layers, deprocessing)
+    if inputs is None:
+        tasks = ((i, None, batch_size, seed) for i in range(num_batches))
+    else:
+        tasks = ((i, batch, None, None) for i, batch in enumerate(inputs))
+
+    if processes == 1:
+        _init_worker(*args)
+        reports = map(_run_task, tasks)
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker, args)
+        reports = pool.imap_unordered(_run_task, tasks)
+
+    result = None
+    try:
+        for report in reports:
+            if result is None:
+                result = report
+            else:
+                result.merge(report)
+    finally:
+        if processes != 1:
+            pool.close()
+            pool.join()
+    if result is None:
+        raise ValueError("No batches to validate")
+    return result
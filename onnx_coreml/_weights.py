@@ -0,0 +1,121 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import warnings
+
+import numpy as np
+
+# float16 weights require CoreML 1.2 (iOS 11.2 / macOS 10.13.2)
+_FLOAT16_SPEC_VERSION = 2
+
+_FLOAT16_MAX = float(np.finfo(np.float16).max)
+
+
+class LayerWeightStats(object):
+    '''
+    Size of weights of a layer before and after converting them to float16
+    and max absolute difference between float16 and float32 weights
+    '''
+    def __init__(self, name, layer_type, float32_bytes, float16_bytes,
+                 max_error):
+        self.name = name
+        self.layer_type = layer_type
+        self.float32_bytes = float32_bytes
+        self.float16_bytes = float16_bytes
+        self.max_error = max_error
+
+    @property
+    def bytes_saved(self):
+        return self.float32_bytes - self.float16_bytes
+
+    def __repr__(self):
+        return 'LayerWeightStats({}, {}, bytes_saved={}, ' \
+            'max_error={:.3g})'.format(
+                self.name, self.layer_type, self.bytes_saved,
+                self.max_error
+            )
+
+
+def _weight_params(message):
+    '''
+    Yields all WeightParams set in message and its submessages
+    '''
+    for field, value in message.ListFields():
+        if field.message_type is None:
+            continue
+        # repeated fields are containers of messages
+        values = [value] if hasattr(value, 'ListFields') else value
+        for value_ in values:
+            if field.message_type.name == 'WeightParams':
+                yield value_
+            else:
+                for params in _weight_params(value_):
+                    yield params
+
+
+def _neural_network(spec):
+    return getattr(spec, spec.WhichOneof('Type'))
+
+
+def convert_weights_to_float16(spec):
+    '''
+    Stores float32 weights of all layers of neural network spec as float16
+    in place. Layers with weights out of float16 range keep float32 weights
+    and a warning is issued. Returns list of LayerWeightStats of converted
+    layers.
+    '''
+    stats = []
+    for layer in _neural_network(spec).layers:
+        params = [p for p in _weight_params(layer)
+                  if len(p.floatValue) > 0]
+        if len(params) == 0:
+            continue
+        values = [np.array(p.floatValue, dtype=np.float32) for p in params]
+        if any(np.abs(v).max() > _FLOAT16_MAX for v in values):
+            warnings.warn(
+                "Weights of layer {} are out of float16 range, they are "
+                "kept as float32".format(layer.name,)
+            )
+            continue
+        float32_bytes = 0
+        float16_bytes = 0
+        max_error = 0.0
+        for p, v in zip(params, values):
+            half = v.astype('<f2')
+            max_error = max(
+                max_error, float(np.abs(half.astype(np.float32) - v).max())
+            )
+            del p.floatValue[:]
+            p.float16Value = half.tobytes()
+            float32_bytes += v.nbytes
+            float16_bytes += half.nbytes
+        stats.append(LayerWeightStats(
+            layer.name, layer.WhichOneof('layer'), float32_bytes,
+            float16_bytes, max_error
+        ))
+    if len(stats) > 0:
+        spec.specificationVersion = max(
+            spec.specificationVersion, _FLOAT16_SPEC_VERSION
+        )
+    return stats
+
+
+def format_weight_stats(stats):
+    '''
+    Returns stats (list of LayerWeightStats) as text table
+    '''
+    lines = ['{:<32} {:<14} {:>12} {:>12} {:>10}'.format(
+        'layer', 'type', 'float32', 'float16', 'max error'
+    )]
+    for s in stats:
+        lines.append('{:<32} {:<14} {:>12} {:>12} {:>10.3g}'.format(
+            s.name, s.layer_type, s.float32_bytes, s.float16_bytes,
+            s.max_error
+        ))
+    lines.append('{} bytes saved, max error {:.3g}'.format(
+        sum(s.bytes_saved for s in stats),
+        max([s.max_error for s in stats] + [0.0])
+    ))
+    return '\n'.join(lines)
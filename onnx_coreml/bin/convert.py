@@ -4,8 +4,10 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import click
-from onnx import onnx_pb2
 from onnx_coreml import convert
+from onnx_coreml._pass_manager import format_pass_stats
+from onnx_coreml._validation import validate, format_validation_report
+from onnx_coreml._weights import format_weight_stats
 
 
 @click.command(
@@ -14,12 +16,38 @@ from onnx_coreml import convert
         'help_option_names': ['-h', '--help']
     }
 )
-@click.argument('onnx_model', type=click.File('rb'))
+@click.argument('onnx_model', type=click.Path(exists=True, dir_okay=False))
 @click.option('-o', '--output', required=True,
               type=str,
               help='Output path for the CoreML *.mlmodel file')
-def onnx_to_coreml(onnx_model, output):
-    onnx_model_proto = onnx_pb2.ModelProto()
-    onnx_model_proto.ParseFromString(onnx_model.read())
-    coreml_model = convert(onnx_model_proto)
+@click.option('--stats', is_flag=True,
+              help='Print time and number of rewrites of every graph pass')
+@click.option('--weight-precision', type=click.Choice(['float32', 'float16']),
+              default='float32',
+              help='Precision of weights stored in the CoreML model')
+@click.option('--validate', 'num_batches', type=int, default=0,
+              help='Compare outputs of the converted model with the ONNX '
+                   'model on this many random batches')
+@click.option('--batch-size', type=int, default=16,
+              help='Number of samples in every validation batch')
+@click.option('--processes', type=int, default=None,
+              help='Number of validation processes, all CPUs by default')
+def onnx_to_coreml(onnx_model, output, stats, weight_precision, num_batches,
+                   batch_size, processes):
+    # convert memory maps model weights when it is given a path
+    coreml_model = convert(onnx_model, weight_precision=weight_precision)
+    if stats:
+        click.echo(format_pass_stats(coreml_model.conversion_stats['passes']))
+    if weight_precision == 'float16':
+        click.echo(
+            format_weight_stats(coreml_model.conversion_stats['weights'])
+        )
     coreml_model.save(output)
+    if num_batches > 0:
+        report = validate(onnx_model, coreml_model, num_batches=num_batches,
+                          batch_size=batch_size, processes=processes)
+        click.echo(format_validation_report(report))
+        if not report.passed:
+            raise click.ClickException(
+                "Outputs of the converted model differ"
+            )
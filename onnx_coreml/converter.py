@@ -3,6 +3,8 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import warnings
+
 import onnx
 import numpy as np
 
@@ -14,11 +16,23 @@ from coremltools.proto import FeatureTypes_pb2 as ft
 
 from ._operators import _convert_node
 from ._graph import Graph
-from ._transformers import ConvAddFuser, DropoutRemover, \
-    DanglingOutputsRemover, ReshapeInitTensorFuser, \
+from ._loader import load_model
+from ._pass_manager import PassManager, sum_pass_metrics
+from ._weights import convert_weights_to_float16
+from ._transformers import ConvAddFuser, ConvMulFuser, ConvBNFuser, \
+    DropoutRemover, DanglingOutputsRemover, DeadNodeEliminator, \
+    ConstantFolder, \
     BNBroadcastedMulFuser, BNBroadcastedAddFuser, PixelShuffleFuser, \
+    TransposeOptimizer, IdentityOpRemover, PadFuser, \
+    SiblingConvMerger, ElementwiseFlattener, ActivationFuser, \
+    DeadChannelPruner, PreprocessingFolder, DeprocessingFolder, \
     OutputRenamer
 
+try:
+    basestring
+except NameError:  # python 3
+    basestring = str
+
 
 def _features(inputs, adapt_shape=True):
     features = []
@@ -127,9 +141,50 @@ def _set_deprocessing(is_grayscale,
     )
 
 
-def _prepare_onnx_graph(graph, transformers):
-    graph_ = Graph.from_onnx(graph)
-    return graph_.transformed(transformers)
+def _image_scale_bias(shape, args):
+    '''
+    Returns (scale, per channel bias) from pre/deprocessing args for image
+    of given shape or None if it is not a grayscale or RGB image
+    '''
+    channels = shape[-3] if len(shape) >= 3 else 1
+    scale = args.get('image_scale', 1.0)
+    if channels == 1:
+        return scale, [args.get('gray_bias', 0.0)]
+    if channels != 3:
+        return None
+    red_bias = args.get('red_bias', 0.0)
+    green_bias = args.get('green_bias', 0.0)
+    blue_bias = args.get('blue_bias', 0.0)
+    if args.get('is_bgr', False):
+        return scale, [blue_bias, green_bias, red_bias]
+    return scale, [red_bias, green_bias, blue_bias]
+
+
+def _fold_image_processing(graph, features, image_names, args, folder_class):
+    '''
+    Folds pre/deprocessing of image features (graph inputs or outputs)
+    with folder_class. Returns graph, list of folded features and dict of
+    reasons why other features were not folded.
+    '''
+    scale_bias = {}
+    failures = {}
+    for feature in features:
+        if feature[0] not in image_names:
+            continue
+        value = _image_scale_bias(feature[2], args)
+        if value is None:
+            failures[feature[0]] = "it is not a grayscale or RGB image"
+        else:
+            scale_bias[feature[0]] = value
+    folder = folder_class(scale_bias)
+    graph = folder(graph)
+    failures.update(folder.failures)
+    return graph, folder.folded, failures
+
+
+def _prepare_onnx_graph(graph, transformers, tensor_data=None):
+    graph_ = Graph.from_onnx(graph, tensor_data)
+    return transformers(graph_)
 
 
 def convert(model,
@@ -139,14 +194,19 @@ def convert(model,
             image_output_names=[],
             deprocessing_args={},
             class_labels=None,
-            predicted_feature_name='classLabel'):
+            predicted_feature_name='classLabel',
+            fold_preprocessing=False,
+            fold_deprocessing=True,
+            prune_dead_channels=False,
+            weight_precision='float32'):
     """
     Convert ONNX model to CoreML.
     Parameters
     ----------
     model: ONNX model | str
         An ONNX model with parameters loaded in onnx package or path to file
-        with models.
+        with models. Weights of a model passed by path (including ONNX
+        external data) are memory mapped instead of being read into memory.
     mode: str ('classifier', 'regressor' or None)
         Mode of the converted coreml model:
         'classifier', a NeuralNetworkClassifier spec will be constructed.
@@ -165,12 +225,49 @@ def convert(model,
     predicted_feature_name: str
         Name of the output feature for the class labels exposed in the Core ML
         model (applies to classifiers only). Defaults to 'classLabel'
+    fold_preprocessing: bool
+        Fold image scale and biases from 'preprocessing_args' into weights
+        of convolutions consuming image inputs instead of running them as
+        a separate preprocessing stage. Folding is exact, inputs which
+        can't be folded (e.g. used by other layers or by convolutions with
+        padding when biases are set) keep regular preprocessing and a
+        warning is issued.
+    fold_deprocessing: bool
+        Fold image scale and biases from 'deprocessing_args' into
+        parameters of layers producing image outputs (Conv, Gemm, FC or
+        BatchNormalization) instead of appending a scale layer. Outputs
+        which can't be folded get the scale layer. Enabled by default.
+    prune_dead_channels: bool
+        Remove convolution output channels which don't affect outputs,
+        e.g. channels with all weights zero or followed by
+        BatchNormalization with zero gamma, from convolutions and layers
+        they pass through. Outputs of the model don't change.
+    weight_precision: str ('float32' or 'float16')
+        Precision weights are stored with in the model. 'float16' halves
+        the size of weights, the model then requires CoreML 1.2 (iOS 11.2,
+        macOS 10.13.2). Layers with weights out of float16 range keep
+        float32 weights and a warning is issued.
     Returns
     -------
     model: A coreml model.
+        Its conversion_stats attribute is a dict with statistics of the
+        conversion: 'passes' is a list of PassStats (wall time, node count
+        delta and number of rewrites) of every graph transformation run,
+        'metrics' maps pass names to totals of pass specific counters,
+        e.g. nodes, weight bytes and multiply-accumulates removed by
+        DeadNodeEliminator, 'preprocessing' lists image inputs with folded
+        preprocessing in 'folded' and reasons why other inputs were not
+        folded in 'failures', 'deprocessing' does the same for image outputs,
+        'weights' lists LayerWeightStats (bytes saved and max error) of
+        layers with weights converted to float16.
     """
+    if weight_precision not in ('float32', 'float16'):
+        raise ValueError(
+            "Unsupported weight precision {}".format(weight_precision,)
+        )
+    tensor_data = None
     if isinstance(model, basestring):
-        onnx_model = onnx.load(model)
+        onnx_model, tensor_data = load_model(model)
     elif isinstance(model, onnx.ModelProto):
         onnx_model = model
     else:
@@ -178,17 +275,46 @@ def convert(model,
             "Model must be file path to .onnx file or onnx loaded model"
         )
 
-    transformers = [
-        ReshapeInitTensorFuser(),
+    passes = [
+        DeadNodeEliminator(),
+        ConstantFolder(),
         DropoutRemover(),
         ConvAddFuser(),
+        ConvMulFuser(),
+        ConvBNFuser(),
         BNBroadcastedMulFuser(),
         BNBroadcastedAddFuser(),
+        ActivationFuser(),
         PixelShuffleFuser(),
+        TransposeOptimizer(),
+        IdentityOpRemover(),
+        PadFuser(),
+    ]
+    if prune_dead_channels:
+        passes.append(DeadChannelPruner())
+    passes += [
+        SiblingConvMerger(),
+        ElementwiseFlattener(),
         DanglingOutputsRemover()
     ]
+    pass_manager = PassManager(passes)
 
-    graph = _prepare_onnx_graph(onnx_model.graph, transformers)
+    graph = _prepare_onnx_graph(onnx_model.graph, pass_manager, tensor_data)
+
+    folded_inputs = []
+    preprocessing_failures = {}
+    if fold_preprocessing and len(image_input_names) > 0:
+        graph, folded_inputs, preprocessing_failures = \
+            _fold_image_processing(
+                graph, graph.inputs, image_input_names, preprocessing_args,
+                PreprocessingFolder
+            )
+        for name in sorted(preprocessing_failures):
+            warnings.warn(
+                "Preprocessing of input {} is not folded: {}".format(
+                    name, preprocessing_failures[name]
+                )
+            )
 
     input_features = _features(graph.inputs)
     output_features = _features(graph.outputs, adapt_shape=False)
@@ -199,10 +325,25 @@ def convert(model,
                     (len(deprocessing_args) > 0) and \
                     (not is_deprocess_bgr_only)
 
+    folded_outputs = []
+    deprocessing_failures = {}
+    if add_deprocess and fold_deprocessing:
+        graph, folded_outputs, deprocessing_failures = \
+            _fold_image_processing(
+                graph, graph.outputs, image_output_names, deprocessing_args,
+                DeprocessingFolder
+            )
+
+    # outputs which get deprocessing layer
+    deprocessed_outputs = []
     if add_deprocess:
+        deprocessed_outputs = [
+            f[0] for f in output_features
+            if f[0] in image_output_names and f[0] not in folded_outputs
+        ]
+    if len(deprocessed_outputs) > 0:
         mapping = {}
-        for f in output_features:
-            output_name = f[0]
+        for output_name in deprocessed_outputs:
             mapping[output_name] = graph.get_unique_edge_name(output_name)
         graph = OutputRenamer(mapping)(graph)
 
@@ -218,6 +359,12 @@ def convert(model,
             gray_bias=preprocessing_args.get('gray_bias', 0.0),
             image_scale=preprocessing_args.get('image_scale', 1.0)
         )
+        # folded inputs still have to be images, but without scaler
+        preprocessing = builder.nn_spec.preprocessing
+        kept = [p for p in preprocessing
+                if p.featureName not in folded_inputs]
+        del preprocessing[:]
+        preprocessing.extend(kept)
 
     if len(image_output_names) > 0:
         for f in output_features:
@@ -231,15 +378,17 @@ def convert(model,
     for node in graph.nodes:
         _convert_node(builder, node)
 
-    if add_deprocess:
+    if len(deprocessed_outputs) > 0:
         for f in output_features:
             output_name = f[0]
-            if output_name not in image_output_names:
+            if output_name not in deprocessed_outputs:
                 continue
+            # outputs may keep leading dimensions of size 1, e.g. (1, C, H, W)
             output_shape = f[1].dimensions
-            if len(output_shape) == 2 or output_shape[0] == 1:
+            channels = output_shape[-3] if len(output_shape) >= 3 else 1
+            if channels == 1:
                 is_grayscale = True
-            elif output_shape[0] == 3:
+            elif channels == 3:
                 is_grayscale = False
             else:
                 raise ValueError('Output must be RGB image or Grayscale')
@@ -267,4 +416,22 @@ def convert(model,
             predicted_feature_name=predicted_feature_name
         )
 
-    return MLModel(builder.spec)
+    weight_stats = []
+    if weight_precision == 'float16':
+        weight_stats = convert_weights_to_float16(builder.spec)
+
+    coreml_model = MLModel(builder.spec)
+    coreml_model.conversion_stats = {
+        'passes': pass_manager.stats,
+        'metrics': sum_pass_metrics(pass_manager.stats),
+        'preprocessing': {
+            'folded': folded_inputs,
+            'failures': preprocessing_failures
+        },
+        'deprocessing': {
+            'folded': folded_outputs,
+            'failures': deprocessing_failures
+        },
+        'weights': weight_stats
+    }
+    return coreml_model
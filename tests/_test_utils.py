@@ -3,12 +3,16 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import sys
+
 import numpy as np
 import numpy.testing as npt
 from onnx import helper, TensorProto
-import onnx_caffe2.backend
 
 from onnx_coreml import convert
+from onnx_coreml._graph import Graph
+from onnx_coreml._graph_executor import run_graph
+from onnx_coreml._spec_executor import run_spec
 
 
 def _onnx_create_model(nodes, inputs, outputs, initializer=[]):
@@ -68,8 +72,7 @@ def _shape_from_onnx_value_info(v):
 
 
 def _forward_onnx_model(model, input_dict):
-    prepared_backend = onnx_caffe2.backend.prepare(model)
-    out = prepared_backend.run(input_dict)
+    out = run_graph(Graph.from_onnx(model.graph), input_dict)
     result = [out[v.name] for v in model.graph.output]
     output_shapes = [
         _shape_from_onnx_value_info(o) for o in model.graph.output
@@ -83,7 +86,10 @@ def _coreml_forward_model(model, input_dict, output_names):
     for k, arr in input_dict.items():
         if len(arr.shape) == 4:
             input_dict[k] = arr[0]
-    coreml_out = model.predict(input_dict, useCPUOnly=True)
+    if sys.platform == 'darwin':
+        coreml_out = model.predict(input_dict, useCPUOnly=True)
+    else:
+        coreml_out = run_spec(model.get_spec(), input_dict)
     return np.array([coreml_out[name] for name in output_names])
 
 
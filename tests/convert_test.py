@@ -4,13 +4,17 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import unittest
+import warnings
 import numpy as np
 import numpy.testing as npt
 
 from PIL import Image
+from onnx import helper, numpy_helper
 
 from onnx_coreml import convert
-from tests._test_utils import _onnx_create_single_node_model
+from onnx_coreml._spec_executor import run_spec
+from tests._test_utils import _onnx_create_single_node_model, \
+    _onnx_create_model, _random_array
 
 
 class ConvertTest(unittest.TestCase):
@@ -44,6 +48,39 @@ class ConvertTest(unittest.TestCase):
         for output in spec.description.output:
             self.assertEqual(output.type.WhichOneof('Type'), 'imageType')
 
+    def test_convert_pad(self):
+        for mode in [None, 'constant', 'reflect', 'edge']:
+            kwargs = {'paddings': [1, 1, 1, 1]}
+            if mode is not None:
+                kwargs['mode'] = mode
+            onnx_model = _onnx_create_single_node_model(
+                "Pad", [(3, 5, 5)], [(3, 7, 7)], **kwargs
+            )
+            padding = convert(onnx_model).get_spec().neuralNetwork \
+                .layers[0].padding
+            self.assertEqual(
+                padding.WhichOneof('PaddingType'),
+                {None: 'constant', 'constant': 'constant',
+                 'reflect': 'reflection', 'edge': 'replication'}[mode]
+            )
+
+    def test_convert_image_output_deprocess_layer(self):
+        onnx_model = _onnx_create_single_node_model(
+            "Relu", [(1, 3, 4, 4)], [(1, 3, 4, 4)]
+        )
+        coreml_model = convert(
+            onnx_model,
+            image_output_names=self.output_names,
+            deprocessing_args={
+                'image_scale': 2.0,
+                'red_bias': 1.0, 'green_bias': 2.0, 'blue_bias': 3.0
+            },
+            fold_deprocessing=False
+        )
+        layer = coreml_model.get_spec().neuralNetwork.layers[-1]
+        self.assertEqual(layer.WhichOneof('layer'), 'scale')
+        self.assertEqual(list(layer.scale.bias.floatValue), [1.0, 2.0, 3.0])
+
     def test_convert_image_input_preprocess(self):
         bias = np.array([100, 90, 80])
         coreml_model = convert(
@@ -87,5 +124,186 @@ class ConvertTest(unittest.TestCase):
         npt.assert_equal(output, expected_output)
 
 
+class FoldPreprocessingTest(unittest.TestCase):
+    def _conv_model(self, pads):
+        weight = numpy_helper.from_array(
+            _random_array((4, 3, 3, 3)), name="weight"
+        )
+        conv = helper.make_node(
+            "Conv", inputs=["input0", "weight"], outputs=["output0"],
+            kernel_shape=(3, 3), strides=(1, 1), pads=pads
+        )
+        output_size = 8 - 2 + pads[0] + pads[2]
+        return _onnx_create_model(
+            [conv], [("input0", (1, 3, 8, 8))],
+            [("output0", (1, 4, output_size, output_size))], [weight]
+        )
+
+    def _convert(self, model):
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            coreml_model = convert(
+                model,
+                image_input_names=["input0"],
+                preprocessing_args={
+                    'image_scale': 1.0 / 255, 'red_bias': -0.5
+                },
+                fold_preprocessing=True
+            )
+        return coreml_model, [str(m.message) for m in w]
+
+    def test_fold(self):
+        coreml_model, messages = self._convert(self._conv_model([0] * 4))
+        spec = coreml_model.get_spec()
+        self.assertEqual(len(spec.neuralNetwork.preprocessing), 0)
+        self.assertEqual(
+            spec.description.input[0].type.WhichOneof('Type'), 'imageType'
+        )
+        self.assertEqual(
+            coreml_model.conversion_stats['preprocessing']['folded'],
+            ["input0"]
+        )
+        self.assertEqual(messages, [])
+
+    def test_padded_conv_is_not_folded(self):
+        coreml_model, messages = self._convert(self._conv_model([1] * 4))
+        spec = coreml_model.get_spec()
+        self.assertEqual(len(spec.neuralNetwork.preprocessing), 1)
+        self.assertEqual(
+            coreml_model.conversion_stats['preprocessing']['folded'], []
+        )
+        self.assertEqual(len(messages), 1)
+
+
+class FoldDeprocessingTest(unittest.TestCase):
+    def _model(self, op_types):
+        weight = numpy_helper.from_array(
+            _random_array((3, 3, 1, 1)), name="weight"
+        )
+        nodes = [helper.make_node(
+            "Conv", inputs=["input0", "weight"], outputs=["conv"],
+            kernel_shape=(1, 1), strides=(1, 1)
+        )]
+        for op_type in op_types:
+            nodes.append(helper.make_node(
+                op_type, inputs=[nodes[-1].output[0]], outputs=[op_type]
+            ))
+        nodes[-1].output[0] = "output0"
+        return _onnx_create_model(
+            nodes, [("input0", (3, 8, 8))], [("output0", (3, 8, 8))],
+            [weight]
+        )
+
+    def _convert(self, model, **kwargs):
+        coreml_model = convert(
+            model,
+            image_output_names=["output0"],
+            deprocessing_args={'image_scale': 255.0, 'blue_bias': 10.0},
+            **kwargs
+        )
+        layers = [l.WhichOneof('layer')
+                  for l in coreml_model.get_spec().neuralNetwork.layers]
+        return coreml_model, layers
+
+    def test_fold(self):
+        coreml_model, layers = self._convert(self._model([]))
+        self.assertEqual(layers, ['convolution'])
+        self.assertEqual(
+            coreml_model.conversion_stats['deprocessing']['folded'],
+            ["output0"]
+        )
+        spec = coreml_model.get_spec()
+        self.assertEqual(
+            spec.description.output[0].type.WhichOneof('Type'), 'imageType'
+        )
+
+    def test_fallback(self):
+        coreml_model, layers = self._convert(self._model(["Sigmoid"]))
+        self.assertEqual(layers, ['convolution', 'activation', 'scale'])
+        self.assertEqual(
+            list(coreml_model.conversion_stats['deprocessing']['failures']),
+            ["output0"]
+        )
+
+        _, layers = self._convert(self._model([]), fold_deprocessing=False)
+        self.assertEqual(layers, ['convolution', 'scale'])
+
+
+class WeightPrecisionTest(unittest.TestCase):
+    def _model(self, fc_weight):
+        weights = [
+            numpy_helper.from_array(
+                _random_array((4, 3, 3, 3)) - 0.5, name="W"
+            ),
+            numpy_helper.from_array(_random_array((4,)), name="b"),
+            numpy_helper.from_array(fc_weight, name="fc_W"),
+            numpy_helper.from_array(_random_array((5,)), name="fc_b"),
+        ]
+        nodes = [
+            helper.make_node("Conv", inputs=["input0", "W", "b"],
+                             outputs=["conv"], kernel_shape=(3, 3),
+                             strides=(1, 1)),
+            helper.make_node("Relu", inputs=["conv"], outputs=["relu"]),
+            helper.make_node("Reshape", inputs=["relu"], outputs=["flat"],
+                             shape=[1, -1]),
+            helper.make_node("FC", inputs=["flat", "fc_W", "fc_b"],
+                             outputs=["output0"]),
+        ]
+        return _onnx_create_model(
+            nodes, [("input0", (1, 3, 6, 6))], [("output0", (1, 5))], weights
+        )
+
+    def test_float16(self):
+        model = self._model(_random_array((5, 64)) - 0.5)
+        float32_model = convert(model)
+        float16_model = convert(model, weight_precision='float16')
+
+        stats = float16_model.conversion_stats['weights']
+        self.assertEqual(
+            [(s.name, s.layer_type) for s in stats],
+            [("conv", "convolution"), ("output0", "innerProduct")]
+        )
+        self.assertEqual([s.bytes_saved for s in stats],
+                         [(4 * 27 + 4) * 2, (5 * 64 + 5) * 2])
+        for s in stats:
+            self.assertGreater(s.max_error, 0)
+            self.assertLess(s.max_error, 1e-3)
+        self.assertEqual(float32_model.conversion_stats['weights'], [])
+
+        spec = float16_model.get_spec()
+        self.assertGreaterEqual(spec.specificationVersion, 2)
+        conv = spec.neuralNetwork.layers[0].convolution
+        self.assertEqual(len(conv.weights.floatValue), 0)
+        self.assertEqual(len(conv.weights.float16Value), 4 * 27 * 2)
+
+        x = {"input0": _random_array((3, 6, 6))}
+        npt.assert_allclose(
+            run_spec(spec, x)["output0"],
+            run_spec(float32_model.get_spec(), x)["output0"],
+            rtol=1e-2, atol=1e-2
+        )
+
+    def test_out_of_range(self):
+        fc_weight = _random_array((5, 64))
+        fc_weight[0, 0] = 1e5
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            coreml_model = convert(self._model(fc_weight),
+                                   weight_precision='float16')
+        self.assertEqual(len(w), 1)
+        self.assertEqual(
+            [s.name for s in coreml_model.conversion_stats['weights']],
+            ["conv"]
+        )
+        fc = coreml_model.get_spec().neuralNetwork.layers[-1].innerProduct
+        self.assertEqual(len(fc.weights.floatValue), 5 * 64)
+        self.assertEqual(len(fc.bias.floatValue), 5)
+
+    def test_unsupported_precision(self):
+        with self.assertRaises(ValueError):
+            convert(self._model(_random_array((5, 64))),
+                    weight_precision='int8')
+
+
 if __name__ == '__main__':
     unittest.main()
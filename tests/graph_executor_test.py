@@ -0,0 +1,141 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from onnx import helper, numpy_helper
+
+from onnx_coreml._graph import Graph
+from onnx_coreml._graph_executor import run_graph
+from onnx_coreml._numpy_ops import _NUMPY_OP_REGISTRY
+from onnx_coreml._operators import _ONNX_NODE_REGISTRY
+from onnx_coreml._transformers import PixelShuffleFuser, ConvBNFuser
+from tests._test_utils import _onnx_create_model, _random_array
+
+
+def _weight(name, shape, offset=0.0):
+    return numpy_helper.from_array(_random_array(shape) + offset, name=name)
+
+
+def _run_samples(graph, x):
+    outputs = [run_graph(graph, {"input0": x[i:i + 1]})["output0"]
+               for i in range(x.shape[0])]
+    return np.concatenate(outputs)
+
+
+class GraphExecutorTest(unittest.TestCase):
+    def test_supports_converted_ops(self):
+        self.assertEqual(
+            set(_ONNX_NODE_REGISTRY) - set(_NUMPY_OP_REGISTRY), set()
+        )
+
+    def test_batch(self):
+        weights = [
+            _weight("W", (4, 3, 3, 3)),
+            _weight("scale", (4,), 1.0),
+            _weight("bias", (4,)),
+            _weight("mean", (4,)),
+            _weight("var", (4,), 0.5),
+            _weight("fc_W", (5, 4 * 4 * 4)),
+            _weight("fc_b", (5,)),
+        ]
+        nodes = [
+            helper.make_node("Conv", inputs=["input0", "W"],
+                             outputs=["conv"], kernel_shape=(3, 3),
+                             pads=(1, 1, 1, 1), strides=(2, 2)),
+            helper.make_node("BatchNormalization",
+                             inputs=["conv", "scale", "bias", "mean", "var"],
+                             outputs=["bn"], is_test=1),
+            helper.make_node("Reshape", inputs=["bn"], outputs=["flat"],
+                             shape=[1, -1]),
+            helper.make_node("FC", inputs=["flat", "fc_W", "fc_b"],
+                             outputs=["fc"]),
+            helper.make_node("Softmax", inputs=["fc"], outputs=["output0"]),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 8, 8))], [("output0", (1, 5))], weights
+        )
+        graph = Graph.from_onnx(model.graph)
+        x = _random_array((6, 3, 8, 8))
+        expected = _run_samples(graph, x)
+        self.assertEqual(expected.shape, (6, 5))
+        npt.assert_allclose(run_graph(graph, {"input0": x})["output0"],
+                            expected, rtol=1e-4, atol=1e-6)
+
+        graph_ = graph.transformed([ConvBNFuser()])
+        self.assertEqual([n.op_type for n in graph_.nodes],
+                         ["Conv", "Reshape", "FC", "Softmax"])
+        npt.assert_allclose(run_graph(graph_, {"input0": x})["output0"],
+                            expected, rtol=1e-4, atol=1e-6)
+
+    def test_transformed_reshapes(self):
+        # reshapes of PixelShuffleFuser drop the batch dimension
+        nodes = [
+            helper.make_node("Reshape", inputs=["input0"], outputs=["r"],
+                             shape=[1, 2, 2, 2, 3, 3]),
+            helper.make_node("Transpose", inputs=["r"], outputs=["t"],
+                             perm=[0, 1, 4, 2, 5, 3]),
+            helper.make_node("Reshape", inputs=["t"], outputs=["output0"],
+                             shape=[1, 2, 6, 6]),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 8, 3, 3))], [("output0", (1, 2, 6, 6))]
+        )
+        graph = Graph.from_onnx(model.graph)
+        x = _random_array((4, 8, 3, 3))
+        expected = _run_samples(graph, x)
+        npt.assert_equal(run_graph(graph, {"input0": x})["output0"],
+                         expected)
+
+        graph = graph.transformed([PixelShuffleFuser()])
+        self.assertEqual(len(graph.nodes), 5)
+        npt.assert_equal(run_graph(graph, {"input0": x})["output0"],
+                         expected)
+
+    def test_mixed_samples(self):
+        nodes = [
+            helper.make_node("Transpose", inputs=["input0"], outputs=["t"],
+                             perm=[1, 0, 2, 3]),
+            helper.make_node("Relu", inputs=["t"], outputs=["output0"]),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 2, 2))], [("output0", (3, 1, 2, 2))]
+        )
+        graph = Graph.from_onnx(model.graph)
+        x = _random_array((2, 3, 2, 2)) - 0.5
+        output = run_graph(graph, {"input0": x})["output0"]
+        npt.assert_equal(output, _run_samples(graph, x))
+        self.assertEqual(output.shape, (6, 1, 2, 2))
+
+    def test_pad(self):
+        # paddings are [x1_begin, x2_begin, ..., x1_end, x2_end, ...]
+        model = _onnx_create_model(
+            [helper.make_node("Pad", inputs=["input0"], outputs=["output0"],
+                              paddings=[0, 0, 1, 2, 0, 0, 3, 4],
+                              value=-1.0)],
+            [("input0", (1, 2, 3, 3))], [("output0", (1, 2, 7, 9))]
+        )
+        x = _random_array((2, 2, 3, 3))
+        output = run_graph(Graph.from_onnx(model.graph), {"input0": x})
+        npt.assert_equal(
+            output["output0"],
+            np.pad(x, [(0, 0), (0, 0), (1, 3), (2, 4)], mode='constant',
+                   constant_values=-1.0)
+        )
+
+    def test_missing_input(self):
+        model = _onnx_create_model(
+            [helper.make_node("Relu", inputs=["input0"],
+                              outputs=["output0"])],
+            [("input0", (1, 3))], [("output0", (1, 3))]
+        )
+        with self.assertRaises(ValueError):
+            run_graph(Graph.from_onnx(model.graph), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,13 +4,14 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import unittest
+import numpy as np
 
 from onnx import helper, numpy_helper
 
 from tests._test_utils import _onnx_create_single_node_model, \
     _onnx_create_model, _conv_pool_output_size, _random_array
 
-from onnx_coreml._graph import Node, Graph
+from onnx_coreml._graph import Node, Graph, NodeSet, LazyTensor
 
 
 class NodeTest(unittest.TestCase):
@@ -29,6 +30,53 @@ class NodeTest(unittest.TestCase):
         self.assertTrue(len(node_.attrs) == 1)
         self.assertTrue(node_.attrs["alpha"] == 0.5)
 
+    def test_node_adjacency(self):
+        nodes = [Node('n{}'.format(i), 'Relu', {}, [], []) for i in range(20)]
+        source = nodes[0]
+        for n in nodes[1:]:
+            source.add_child(n)
+            self.assertIn(source, n.parents)
+        self.assertEqual(list(source.children), nodes[1:])
+        self.assertEqual(source.children.first(), nodes[1])
+
+        source.children.remove(nodes[5])
+        self.assertNotIn(nodes[5], source.children)
+        self.assertEqual(len(source.children), 18)
+        with self.assertRaises(ValueError):
+            source.children.remove(nodes[5])
+
+        # adding the same node twice keeps a single entry
+        source.children.append(nodes[1])
+        self.assertEqual(len(source.children), 18)
+
+        source.children.clear()
+        self.assertIsInstance(source.children, NodeSet)
+        self.assertEqual(len(source.children), 0)
+        with self.assertRaises(IndexError):
+            source.children.first()
+        with self.assertRaises(AttributeError):
+            source.unknown_attribute = 1
+
+    def test_node_set(self):
+        nodes = [Node('n{}'.format(i), 'Relu', {}, [], []) for i in range(3)]
+        node_set = NodeSet([nodes[0]])
+        self.assertEqual(list(node_set), nodes[:1])
+        node_set.append(nodes[0])
+        self.assertEqual(len(node_set), 1)
+        node_set.extend(nodes[1:])
+        self.assertEqual(list(node_set), nodes)
+        node_set.remove(nodes[0])
+        node_set.remove(nodes[2])
+        self.assertEqual(list(node_set), nodes[1:2])
+        self.assertNotIn(nodes[0], node_set)
+        self.assertEqual(node_set.first(), nodes[1])
+        node_set.discard(nodes[1])
+        node_set.discard(nodes[1])
+        self.assertEqual(len(node_set), 0)
+        self.assertNotIn(None, node_set)
+        with self.assertRaises(ValueError):
+            node_set.remove(nodes[1])
+
 
 class GraphTest(unittest.TestCase):
     def test_create_graph(self):
@@ -79,6 +127,64 @@ class GraphTest(unittest.TestCase):
         self.assertEqual(len(graph_.nodes[0].children), 1)
         self.assertEqual(len(graph_.nodes[1].children), 0)
 
+        conv_ = graph_.nodes[0]
+        lazy = conv_.input_tensors.peek("weight")
+        self.assertIsInstance(lazy, LazyTensor)
+        self.assertFalse(lazy.is_materialized)
+        self.assertEqual(lazy.shape, (16, 3, 3, 2))
+        self.assertEqual(lazy.dtype, np.float32)
+        np.testing.assert_equal(
+            conv_.input_tensors["weight"], numpy_helper.to_array(weight)
+        )
+        self.assertTrue(lazy.is_materialized)
+        self.assertNotIsInstance(conv_.input_tensors.peek("weight"),
+                                 LazyTensor)
+
+    def test_unique_edge_name(self):
+        relu = Node('relu', 'Relu', {}, ['input0'], ['output0'])
+        graph_ = Graph([relu], [('input0', 1, (1,))], [('output0', 1, (1,))])
+        self.assertTrue(graph_.has_edge_name('input0'))
+        self.assertFalse(graph_.has_edge_name('relu_output'))
+        self.assertEqual(graph_.get_unique_edge_name('relu_output'),
+                         'relu_output')
+        self.assertEqual(graph_.get_unique_edge_name('relu_output'),
+                         'relu_output_0')
+        self.assertEqual(graph_.get_unique_edge_name('output0'), 'output0_0')
+        self.assertEqual(graph_.get_unique_edge_name('output0'), 'output0_1')
+
+    def test_bypass_node(self):
+        relu = Node('relu', 'Relu', {}, ['input0'], ['relu'])
+        dropout = Node('dropout', 'Dropout', {}, ['relu'], ['dropout'])
+        sigmoid = Node('sigmoid', 'Sigmoid', {}, ['dropout'], ['output0'])
+        relu.add_child(dropout)
+        dropout.add_child(sigmoid)
+        graph_ = Graph(
+            [relu, dropout, sigmoid],
+            [('input0', 1, (1,))], [('output0', 1, (1,))]
+        )
+        self.assertTrue(graph_.bypass_node(dropout))
+        self.assertEqual(graph_.nodes, [relu, sigmoid])
+        self.assertEqual(sigmoid.inputs, ['relu'])
+        self.assertEqual(list(relu.children), [sigmoid])
+        self.assertFalse(graph_.has_edge_name('dropout'))
+
+        # graph output is taken over by parent
+        self.assertTrue(graph_.bypass_node(sigmoid))
+        self.assertEqual(graph_.nodes, [relu])
+        self.assertEqual(relu.outputs, ['output0'])
+        # graph input can't be connected to graph output
+        self.assertFalse(graph_.bypass_node(relu))
+
+        graph_.rename_edge('output0', 'renamed')
+        self.assertFalse(graph_.has_edge_name('output0'))
+        self.assertEqual(relu.outputs, ['renamed'])
+        self.assertEqual(graph_.outputs[0][0], 'renamed')
+
+        graph_.remove_node(relu)
+        self.assertEqual(len(graph_.nodes), 0)
+        # still used as graph input
+        self.assertTrue(graph_.has_edge_name('input0'))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,89 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from onnx import helper, numpy_helper, TensorProto
+
+from onnx_coreml._graph import Graph
+from onnx_coreml._loader import load_model
+from tests._test_utils import _onnx_create_model, _random_array
+
+
+class LoadModelTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.weight = _random_array((16, 3, 3, 3))
+        self.bias = _random_array((16,))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _create_model(self, initializer):
+        conv = helper.make_node(
+            "Conv",
+            inputs=["input0", "weight", "bias"],
+            outputs=["output0"],
+            kernel_shape=(3, 3),
+            strides=(1, 1)
+        )
+        return _onnx_create_model(
+            [conv], [("input0", (1, 3, 10, 10))],
+            [("output0", (1, 16, 8, 8))], initializer
+        )
+
+    def _save(self, model):
+        path = os.path.join(self.dir, 'model.onnx')
+        with open(path, 'wb') as f:
+            f.write(model.SerializeToString())
+        return path
+
+    def _assert_weights(self, model, tensor_data):
+        for tensor in model.graph.initializer:
+            self.assertFalse(tensor.HasField('raw_data'))
+        graph = Graph.from_onnx(model.graph, tensor_data)
+        node = graph.nodes[0]
+        np.testing.assert_equal(node.input_tensors["weight"], self.weight)
+        np.testing.assert_equal(node.input_tensors["bias"], self.bias)
+
+    def test_load_raw_data(self):
+        model = self._create_model([
+            numpy_helper.from_array(self.weight, name="weight"),
+            numpy_helper.from_array(self.bias, name="bias")
+        ])
+        loaded, tensor_data = load_model(self._save(model))
+        self.assertEqual(set(tensor_data.keys()), {"weight", "bias"})
+        self.assertEqual(len(loaded.graph.node), 1)
+        self._assert_weights(loaded, tensor_data)
+
+    def test_load_external_data(self):
+        with open(os.path.join(self.dir, 'weights.bin'), 'wb') as f:
+            f.write(b'\0' * 4)
+            f.write(self.weight.tobytes())
+        weight = TensorProto()
+        weight.name = "weight"
+        weight.data_type = TensorProto.FLOAT
+        weight.dims.extend(self.weight.shape)
+        weight.data_location = TensorProto.EXTERNAL
+        for key, value in [('location', 'weights.bin'),
+                           ('offset', '4'),
+                           ('length', str(self.weight.nbytes))]:
+            entry = weight.external_data.add()
+            entry.key = key
+            entry.value = value
+        model = self._create_model([
+            weight, numpy_helper.from_array(self.bias, name="bias")
+        ])
+        loaded, tensor_data = load_model(self._save(model))
+        self._assert_weights(loaded, tensor_data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,21 +8,19 @@ import unittest
 import onnx
 
 import onnx.backend.test
-import onnx_caffe2.backend
 
 from onnx_coreml._backend import CoreMLBackend
+from onnx_coreml._graph import Graph, Node
+from onnx_coreml._shape_inference import infer_shapes
 
 
-# TODO: don't use onnx_caffe2 to infer output shapes
 class CoreMLTestingBackend(CoreMLBackend):
     @classmethod
     def run_node(cls, node, inputs, device='CPU'):
         '''
         CoreML requires full model for prediction, not just single layer.
-        Also input/output shapes are required to build CoreML spec for model.
-        As a temporary decision we use onnx_caffe2 backend for shape inference
-        task to build the appropriate ONNX model and convert it to
-        CoreML model.
+        Also input/output shapes are required to build CoreML spec for model,
+        they are inferred with shape inference of the Graph IR.
         '''
         super(CoreMLTestingBackend, cls).run_node(node, inputs, device)
 
@@ -36,15 +34,21 @@ class CoreMLTestingBackend(CoreMLBackend):
             )
             graph_inputs.append(value_info)
 
-        c2_result = onnx_caffe2.backend.run_node(node, inputs, device)
+        graph = Graph(
+            [Node.from_onnx(node)],
+            [(i.name, i.type.tensor_type.elem_type, input_.shape)
+             for i, input_ in zip(graph_inputs, inputs)],
+            []
+        )
+        infos = infer_shapes(graph, strict=True)
 
         graph_outputs = []
-        for i in range(len(node.output)):
-            c2_output = c2_result[i]
+        for output in node.output:
+            shape, dtype = infos[output]
             value_info = onnx.helper.make_tensor_value_info(
-                name=node.output[i],
-                elem_type=onnx.mapping.NP_TYPE_TO_TENSOR_TYPE[c2_output.dtype],
-                shape=c2_output.shape
+                name=output,
+                elem_type=onnx.mapping.NP_TYPE_TO_TENSOR_TYPE[dtype],
+                shape=shape
             )
             graph_outputs.append(value_info)
 
@@ -4,11 +4,16 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import unittest
+import numpy as np
+import numpy.testing as npt
 
+from onnx import helper
 from onnx.numpy_helper import from_array
 
+from onnx_coreml import convert
 from tests._test_utils import _test_single_node, \
-    _random_array, _conv_pool_output_size
+    _random_array, _conv_pool_output_size, _onnx_create_model, \
+    _forward_onnx_model, _coreml_forward_model, _assert_outputs
 
 
 class SingleOperatorTest(unittest.TestCase):
@@ -207,6 +212,50 @@ class SingleOperatorTest(unittest.TestCase):
                 consumed_inputs=[0, 0, 0, 1, 1]
             )
 
+    def test_bn_scale_layer(self):
+        gamma = _random_array((6,)) * 2 - 1
+        beta = _random_array((6,)) * 2 - 1
+        mean = _random_array((6,)) * 4 - 2
+        var = _random_array((6,)) * 10 + 0.1
+        epsilon = 0.01
+        initializer = [
+            from_array(gamma, name="scale"),
+            from_array(beta, name="bias"),
+            from_array(mean, name="mean"),
+            from_array(var, name="var"),
+        ]
+        nodes = [
+            helper.make_node("Concat", inputs=["input0", "input1"],
+                             outputs=["concat"], axis=1),
+            helper.make_node("BatchNormalization",
+                             inputs=["concat", "scale", "bias", "mean",
+                                     "var"],
+                             outputs=["output0"], is_test=1,
+                             epsilon=epsilon),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 2, 5, 4)), ("input1", (1, 4, 5, 4))],
+            [("output0", (1, 6, 5, 4))], initializer
+        )
+        coreml_model = convert(model)
+        layer = coreml_model.get_spec().neuralNetwork.layers[-1]
+        self.assertEqual(layer.WhichOneof('layer'), 'scale')
+        self.assertTrue(layer.scale.hasBias)
+        W = gamma / np.sqrt(var + epsilon)
+        npt.assert_allclose(layer.scale.scale.floatValue, W, rtol=1e-6)
+        npt.assert_allclose(layer.scale.bias.floatValue, beta - mean * W,
+                            rtol=1e-5, atol=1e-6)
+
+        inputs = {
+            "input0": _random_array((1, 2, 5, 4)) * 4 - 2,
+            "input1": _random_array((1, 4, 5, 4)) * 4 - 2,
+        }
+        onnx_outputs = _forward_onnx_model(model, dict(inputs))
+        coreml_outputs = _coreml_forward_model(
+            coreml_model, inputs, ["output0"]
+        )
+        _assert_outputs(onnx_outputs, coreml_outputs, decimal=5)
+
     def test_add(self):
         _test_single_node(
             "Add",
@@ -272,6 +321,24 @@ class SingleOperatorTest(unittest.TestCase):
             [(1, 3, 224, 224)]
         )
 
+    def test_hard_sigmoid(self):
+        _test_single_node(
+            "HardSigmoid",
+            [(1, 3, 224, 224)],
+            [(1, 3, 224, 224)],
+            alpha=0.25,
+            beta=0.4
+        )
+
+    def test_clip(self):
+        _test_single_node(
+            "Clip",
+            [(1, 3, 224, 224)],
+            [(1, 3, 224, 224)],
+            min=-0.5,
+            max=0.5
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
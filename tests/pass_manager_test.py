@@ -0,0 +1,76 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+from onnx import helper, numpy_helper
+
+from onnx_coreml._graph import Graph
+from onnx_coreml._pass_manager import PassManager
+from onnx_coreml._transformers import ConvAddFuser, DropoutRemover
+from tests._test_utils import _onnx_create_model, _random_array
+
+
+def _conv_dropout_add_graph():
+    weight = numpy_helper.from_array(
+        _random_array((8, 3, 3, 3)), name="weight"
+    )
+    bias = numpy_helper.from_array(_random_array((8,)), name="bias")
+    nodes = [
+        helper.make_node(
+            "Conv", inputs=["input0", "weight"], outputs=["conv"],
+            kernel_shape=(3, 3), strides=(1, 1)
+        ),
+        helper.make_node("Dropout", inputs=["conv"], outputs=["dropout"]),
+        helper.make_node(
+            "Add", inputs=["dropout", "bias"], outputs=["output0"],
+            broadcast=1, axis=1
+        ),
+    ]
+    model = _onnx_create_model(
+        nodes, [("input0", (1, 3, 10, 10))], [("output0", (1, 8, 8, 8))],
+        [weight, bias]
+    )
+    return Graph.from_onnx(model.graph)
+
+
+class _AlwaysRewrites(object):
+    num_rewrites = 1
+
+    def __call__(self, graph):
+        return graph
+
+
+class PassManagerTest(unittest.TestCase):
+    def test_fixed_point(self):
+        # Conv+Add fusion is exposed only after Dropout removal
+        graph = _conv_dropout_add_graph()
+        graph = graph.transformed([ConvAddFuser(), DropoutRemover()])
+        self.assertEqual(len(graph.nodes), 2)
+
+        graph = _conv_dropout_add_graph()
+        pass_manager = PassManager([ConvAddFuser(), DropoutRemover()])
+        graph = pass_manager(graph)
+        self.assertEqual(len(graph.nodes), 1)
+        self.assertEqual(graph.nodes[0].outputs, ["output0"])
+        self.assertEqual(pass_manager.num_iterations, 3)
+
+        stats = pass_manager.stats
+        self.assertEqual(len(stats), 6)
+        self.assertEqual([s.name for s in stats[:2]],
+                         ['ConvAddFuser', 'DropoutRemover'])
+        self.assertEqual([s.num_rewrites for s in stats], [0, 1, 1, 0, 0, 0])
+        self.assertEqual(stats[1].num_nodes_delta, -1)
+        self.assertTrue(all(s.wall_time >= 0 for s in stats))
+
+    def test_max_iterations(self):
+        pass_manager = PassManager([_AlwaysRewrites()], max_iterations=3)
+        pass_manager(_conv_dropout_add_graph())
+        self.assertEqual(pass_manager.num_iterations, 3)
+        self.assertEqual(len(pass_manager.stats), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+from onnx import helper
+
+from onnx_coreml._graph import Graph, Node
+from onnx_coreml._rewriter import Op, Var, Constant, RewriteRule, \
+    PatternRewriter, match_pattern
+from tests._test_utils import _onnx_create_model
+
+
+def _swish_graph(extra_sigmoid_consumer=False):
+    nodes = [
+        helper.make_node("Relu", inputs=["input0"], outputs=["x"]),
+        helper.make_node("Sigmoid", inputs=["x"], outputs=["s"]),
+        helper.make_node("Mul", inputs=["s", "x"], outputs=["output0"]),
+    ]
+    outputs = [("output0", (1, 3, 4, 4))]
+    if extra_sigmoid_consumer:
+        nodes.append(
+            helper.make_node("Relu", inputs=["s"], outputs=["output1"])
+        )
+        outputs.append(("output1", (1, 3, 4, 4)))
+    model = _onnx_create_model(nodes, [("input0", (1, 3, 4, 4))], outputs)
+    return Graph.from_onnx(model.graph)
+
+
+class SwishFuser(RewriteRule):
+    pattern = Op(
+        'Mul',
+        inputs=[Var('x'), Op('Sigmoid', inputs=[Var('x')], name='sigmoid')],
+        commutative=True,
+        name='mul'
+    )
+
+    def rewrite(self, graph, match):
+        mul, sigmoid = match['mul'], match['sigmoid']
+        swish = Node(mul.name, 'Swish', {}, [match['x']], list(mul.outputs))
+        graph.add_node(swish, after=mul)
+        for parent in list(sigmoid.parents):
+            parent.add_child(swish)
+        graph.remove_node(sigmoid)
+        graph.remove_node(mul)
+
+
+class PatternTest(unittest.TestCase):
+    def test_dag_pattern(self):
+        graph = _swish_graph()
+        mul = graph.nodes[2]
+        match = match_pattern(graph, SwishFuser.pattern, mul)
+        self.assertIsNotNone(match)
+        self.assertEqual(match['x'], "x")
+        self.assertEqual([n.op_type for n in match.nodes], ['Sigmoid', 'Mul'])
+
+    def test_single_consumer(self):
+        graph = _swish_graph(extra_sigmoid_consumer=True)
+        mul = graph.nodes[2]
+        self.assertIsNone(match_pattern(graph, SwishFuser.pattern, mul))
+
+    def test_attrs_and_constants(self):
+        pattern = Op('Add', inputs=[Var(), Constant('b')],
+                     attrs={'broadcast': 1, 'axis': lambda a: a in (1, None)})
+        node = Node('add', 'Add', {'broadcast': 1}, ['x', 'b'], ['y'])
+        graph = Graph([node], [], [])
+        self.assertIsNone(match_pattern(graph, pattern, node))
+        node.input_tensors['b'] = 1.0
+        self.assertEqual(match_pattern(graph, pattern, node)['b'], 'b')
+        node.attrs['broadcast'] = 0
+        self.assertIsNone(match_pattern(graph, pattern, node))
+
+
+class PatternRewriterTest(unittest.TestCase):
+    def test_rewrite(self):
+        graph = _swish_graph()
+        rule = SwishFuser()
+        graph = PatternRewriter([rule])(graph)
+        self.assertEqual(rule.num_rewrites, 1)
+        self.assertEqual([n.op_type for n in graph.nodes], ['Relu', 'Swish'])
+        relu, swish = graph.nodes
+        self.assertEqual(list(relu.children), [swish])
+        self.assertEqual(list(swish.parents), [relu])
+        self.assertEqual(swish.outputs, ['output0'])
+        self.assertEqual(graph.get_nodes_by_op_type('Mul'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+import numpy as np
+
+from onnx import helper, numpy_helper
+
+from onnx_coreml._graph import Graph
+from onnx_coreml._numpy_ops import _run_node
+from onnx_coreml._shape_inference import infer_shapes, ShapeInferenceError
+from tests._test_utils import _onnx_create_model, _random_array
+
+
+def _weight(name, shape):
+    return numpy_helper.from_array(_random_array(shape), name=name)
+
+
+class ShapeInferenceTest(unittest.TestCase):
+    def _graph(self):
+        weights = [
+            _weight("W1", (8, 3, 3, 3)),
+            _weight("W2", (4, 8, 1, 1)),
+            _weight("fc_W", (10, 12 * 8 * 8)),
+        ]
+        nodes = [
+            helper.make_node("Conv", inputs=["input0", "W1"],
+                             outputs=["conv1"], kernel_shape=(3, 3),
+                             pads=(1, 1, 1, 1), strides=(2, 2)),
+            helper.make_node("Relu", inputs=["conv1"], outputs=["relu"]),
+            helper.make_node("Conv", inputs=["relu", "W2"],
+                             outputs=["conv2"], kernel_shape=(1, 1)),
+            helper.make_node("Concat", inputs=["relu", "conv2"],
+                             outputs=["concat"], axis=1),
+            helper.make_node("Split", inputs=["concat"],
+                             outputs=["split_1", "split_2"], axis=1,
+                             split=[5, 7]),
+            helper.make_node("Pad", inputs=["split_2"], outputs=["pad"],
+                             paddings=[1, 0, 2, 1], mode="edge"),
+            helper.make_node("MaxPool", inputs=["pad"], outputs=["pool"],
+                             kernel_shape=(2, 2), strides=(1, 2)),
+            helper.make_node("Slice", inputs=["concat"], outputs=["slice"],
+                             starts=[1, -3], ends=[100, -1], axes=[1, 3]),
+            helper.make_node("Transpose", inputs=["slice"],
+                             outputs=["transpose"], perm=[0, 3, 1, 2]),
+            helper.make_node("Reshape", inputs=["concat"],
+                             outputs=["reshape"], shape=[0, -1]),
+            helper.make_node("FC", inputs=["reshape", "fc_W"],
+                             outputs=["fc"]),
+            helper.make_node("Softmax", inputs=["fc"], outputs=["output0"]),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 16, 16))], [("output0", (1, 10))],
+            weights
+        )
+        return Graph.from_onnx(model.graph)
+
+    def test_infer_shapes(self):
+        graph = self._graph()
+        infos = infer_shapes(graph, strict=True)
+
+        values = {"input0": _random_array((1, 3, 16, 16))}
+        for node in graph.nodes:
+            inputs = [values[i] if i in values else node.input_tensors[i]
+                      for i in node.inputs]
+            values.update(zip(node.outputs, _run_node(node, inputs)))
+        for name, value in values.items():
+            self.assertEqual(infos[name], (value.shape, value.dtype), name)
+
+    def test_cached_shapes(self):
+        graph = self._graph()
+        infer_shapes(graph)
+        cached = dict((n.name, n.metadata['shapes']) for n in graph.nodes)
+
+        conv2 = [n for n in graph.nodes if n.name == "conv2"][0]
+        conv2.input_tensors["W2"] = _random_array((6, 8, 1, 1))
+        infos = infer_shapes(graph)
+        self.assertEqual(infos["concat"][0], (1, 14, 8, 8))
+        # split doesn't match the new shape
+        self.assertEqual(infos["split_2"], (None, None))
+        self.assertEqual(infos["pool"], (None, None))
+        for node in graph.nodes:
+            unchanged = node.name in ("conv1", "relu")
+            self.assertEqual(
+                node.metadata['shapes'] is cached[node.name], unchanged,
+                node.name
+            )
+
+    def test_array_attributes(self):
+        value = _random_array((1, 3, 1, 1))
+        nodes = [
+            helper.make_node("Constant", inputs=[], outputs=["constant"],
+                             value=numpy_helper.from_array(value)),
+            helper.make_node("Add", inputs=["input0", "constant"],
+                             outputs=["output0"]),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 4, 4))], [("output0", (1, 3, 4, 4))]
+        )
+        graph = Graph.from_onnx(model.graph)
+        infer_shapes(graph)
+        constant = graph.nodes[0]
+        cached = constant.metadata['shapes']
+
+        constant.attrs['value'] = value.copy()
+        infer_shapes(graph)
+        self.assertIs(constant.metadata['shapes'], cached)
+        # same shape, different contents
+        constant.attrs['value'] = value + 1
+        infer_shapes(graph)
+        self.assertIsNot(constant.metadata['shapes'], cached)
+
+    def test_inconsistent_shapes(self):
+        nodes = [
+            helper.make_node("Conv", inputs=["input0", "W"],
+                             outputs=["output0"], kernel_shape=(3, 3))
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 4, 8, 8))], [("output0", (1, 8, 6, 6))],
+            [_weight("W", (8, 3, 3, 3))]
+        )
+        graph = Graph.from_onnx(model.graph)
+        self.assertEqual(infer_shapes(graph)["output0"], (None, None))
+        with self.assertRaises(ShapeInferenceError):
+            infer_shapes(graph, strict=True)
+
+    def test_unknown_input_shape(self):
+        nodes = [helper.make_node("Relu", inputs=["input0"],
+                                  outputs=["output0"])]
+        model = _onnx_create_model(
+            nodes, [("input0", (0, 3))], [("output0", (0, 3))]
+        )
+        infos = infer_shapes(Graph.from_onnx(model.graph), strict=True)
+        self.assertEqual(infos["output0"], (None, np.dtype('float32')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+import numpy as np
+import numpy.testing as npt
+
+from PIL import Image
+from onnx import helper, numpy_helper
+
+from onnx_coreml import convert
+from onnx_coreml._graph import Graph
+from onnx_coreml._graph_executor import run_graph
+from onnx_coreml._spec_executor import run_spec, SpecExecutor
+from tests._test_utils import _onnx_create_model, _random_array
+
+
+def _weight(name, shape, offset=0.0):
+    return numpy_helper.from_array(_random_array(shape) + offset, name=name)
+
+
+def _run_onnx(model, feeds):
+    outputs = run_graph(Graph.from_onnx(model.graph), feeds)
+    return [outputs[o.name] for o in model.graph.output]
+
+
+class SpecExecutorTest(unittest.TestCase):
+    def _assert_matches(self, model, input_shape, **kwargs):
+        x = _random_array(input_shape) - 0.5
+        expected = _run_onnx(model, {"input0": x})
+        spec = convert(model, **kwargs).get_spec()
+        outputs = run_spec(spec, {"input0": x[0]})
+        for output, value in zip(model.graph.output, expected):
+            npt.assert_allclose(
+                outputs[output.name], value, rtol=1e-4, atol=1e-5
+            )
+
+    def test_conv_net(self):
+        weights = [
+            _weight("W", (8, 3, 3, 3)),
+            _weight("b", (8,)),
+            _weight("scale", (8,), 1.0),
+            _weight("bias", (8,)),
+            _weight("mean", (8,)),
+            _weight("var", (8,), 0.5),
+            _weight("W_dw", (8, 1, 3, 3)),
+            _weight("fc_W", (10, 8 * 4 * 4)),
+            _weight("fc_b", (10,)),
+        ]
+        nodes = [
+            helper.make_node("Conv", inputs=["input0", "W", "b"],
+                             outputs=["conv"], kernel_shape=(3, 3),
+                             pads=(1, 1, 1, 1), strides=(1, 1)),
+            helper.make_node("BatchNormalization",
+                             inputs=["conv", "scale", "bias", "mean", "var"],
+                             outputs=["bn"], is_test=1),
+            helper.make_node("Relu", inputs=["bn"], outputs=["relu"]),
+            helper.make_node("MaxPool", inputs=["relu"], outputs=["pool"],
+                             kernel_shape=(2, 2), strides=(2, 2)),
+            helper.make_node("Conv", inputs=["pool", "W_dw"],
+                             outputs=["dw"], kernel_shape=(3, 3), group=8,
+                             pads=(1, 1, 1, 1), strides=(2, 2)),
+            helper.make_node("AveragePool", inputs=["dw"],
+                             outputs=["avg"], kernel_shape=(3, 3),
+                             pads=(1, 1, 1, 1), strides=(1, 1)),
+            helper.make_node("LRN", inputs=["avg"], outputs=["lrn"],
+                             size=3, alpha=0.0001, beta=0.75, bias=1.0),
+            helper.make_node("Reshape", inputs=["lrn"],
+                             outputs=["flat"], shape=[1, -1]),
+            helper.make_node("FC", inputs=["flat", "fc_W", "fc_b"],
+                             outputs=["fc"]),
+            helper.make_node("Softmax", inputs=["fc"], outputs=["output0"]),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 16, 16))], [("output0", (1, 10))],
+            weights
+        )
+        self._assert_matches(model, (1, 3, 16, 16))
+
+    def test_shape_ops(self):
+        nodes = [
+            helper.make_node("Pad", inputs=["input0"], outputs=["pad"],
+                             paddings=[1, 0, 2, 1], mode="reflect"),
+            helper.make_node("Split", inputs=["pad"],
+                             outputs=["split_1", "split_2"], axis=1,
+                             split=[1, 3]),
+            helper.make_node("Concat", inputs=["split_2", "split_1"],
+                             outputs=["concat"], axis=1),
+            helper.make_node("Transpose", inputs=["concat"],
+                             outputs=["transpose"], perm=[0, 2, 1, 3]),
+            helper.make_node("Reshape", inputs=["transpose"],
+                             outputs=["output0"], shape=[1, 22, 2, 7]),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 4, 8, 6))], [("output0", (1, 22, 2, 7))]
+        )
+        self._assert_matches(model, (1, 4, 8, 6))
+
+    def test_activations(self):
+        nodes = [
+            helper.make_node("Clip", inputs=["input0"], outputs=["clip"],
+                             min=-0.2, max=0.3),
+            helper.make_node("HardSigmoid", inputs=["input0"],
+                             outputs=["hard_sigmoid"], alpha=2.0, beta=0.4),
+            helper.make_node("LeakyRelu", inputs=["input0"],
+                             outputs=["leaky_relu"], alpha=0.1),
+            helper.make_node("Sum", inputs=["clip", "hard_sigmoid"],
+                             outputs=["sum"]),
+            helper.make_node("Mul", inputs=["sum", "leaky_relu"],
+                             outputs=["output0"]),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 4, 4))], [("output0", (1, 3, 4, 4))]
+        )
+        self._assert_matches(model, (1, 3, 4, 4))
+
+    def test_image_preprocessing(self):
+        model = _onnx_create_model(
+            [helper.make_node("Relu", inputs=["input0"],
+                              outputs=["output0"])],
+            [("input0", (1, 3, 5, 4))], [("output0", (1, 3, 5, 4))]
+        )
+        spec = convert(
+            model, image_input_names=["input0"],
+            preprocessing_args={
+                'is_bgr': True, 'image_scale': 0.5,
+                'red_bias': -10, 'green_bias': -20, 'blue_bias': -30
+            }
+        ).get_spec()
+        img_arr = np.uint8(np.random.rand(5, 4, 3) * 255)
+        output = run_spec(spec, {"input0": Image.fromarray(img_arr)})
+
+        expected = np.float32(img_arr)[:, :, ::-1].transpose(2, 0, 1) * 0.5
+        expected += np.array([-30, -20, -10]).reshape(3, 1, 1)
+        npt.assert_allclose(output["output0"],
+                            np.maximum(expected, 0)[np.newaxis])
+
+    def test_batch(self):
+        weight = _weight("W", (4, 3, 3, 3))
+        model = _onnx_create_model(
+            [helper.make_node("Conv", inputs=["input0", "W"],
+                              outputs=["output0"], kernel_shape=(3, 3),
+                              strides=(1, 1))],
+            [("input0", (1, 3, 6, 6))], [("output0", (1, 4, 4, 4))],
+            [weight]
+        )
+        x = _random_array((5, 3, 6, 6))
+        expected = _run_onnx(model, {"input0": x})[0]
+        executor = SpecExecutor(convert(model).get_spec())
+        output = executor.run({"input0": x})["output0"]
+        self.assertEqual(output.shape, (5, 1, 4, 4, 4))
+        npt.assert_allclose(output[:, 0], expected, rtol=1e-4, atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,7 +9,13 @@ import numpy as np
 from onnx import helper, numpy_helper
 
 from onnx_coreml._graph import Graph
-from onnx_coreml._transformers import ConvAddFuser
+from onnx_coreml._graph_executor import run_graph
+from onnx_coreml._pass_manager import PassManager
+from onnx_coreml._transformers import ConvAddFuser, ConstantFolder, \
+    DeadNodeEliminator, ConvBNFuser, ConvMulFuser, TransposeOptimizer, \
+    IdentityOpRemover, PadFuser, SiblingConvMerger, ElementwiseFlattener, \
+    PreprocessingFolder, DeprocessingFolder, ActivationFuser, \
+    DeadChannelPruner
 from tests._test_utils import _onnx_create_model, _test_onnx_model, \
     _conv_pool_output_size, _random_array
 
@@ -170,5 +176,903 @@ class PixelShuffleFuserTest(unittest.TestCase):
         _test_onnx_model(model, decimal=7)
 
 
+class ConstantFolderTest(unittest.TestCase):
+    def test_fold_weight_chain(self):
+        w = _random_array((3, 3, 3, 16))
+        scale = _random_array((16, 1, 1, 1))
+        weight = numpy_helper.from_array(w, name="weight_t")
+        weight_scale = numpy_helper.from_array(scale, name="scale")
+
+        input_shape = (1, 3, 10, 10)
+        output_shape = (1, 16, 8, 8)
+        inputs = [('input0', input_shape)]
+        outputs = [('output0', output_shape)]
+
+        transpose = helper.make_node(
+            "Transpose",
+            inputs=["weight_t"],
+            outputs=["weight_transposed"],
+            perm=[3, 2, 0, 1]
+        )
+        mul = helper.make_node(
+            "Mul",
+            inputs=["weight_transposed", "scale"],
+            outputs=["weight"],
+        )
+        conv = helper.make_node(
+            "Conv",
+            inputs=[inputs[0][0], "weight"],
+            outputs=[outputs[0][0]],
+            kernel_shape=(3, 3),
+            strides=(1, 1)
+        )
+        model = _onnx_create_model(
+            [transpose, mul, conv], inputs, outputs, [weight, weight_scale]
+        )
+        graph_ = Graph.from_onnx(model.graph)
+        folder = ConstantFolder()
+        folded_graph = graph_.transformed([folder])
+
+        self.assertEqual(folder.num_rewrites, 2)
+        self.assertEqual(len(folded_graph.nodes), 1)
+        node = folded_graph.nodes[0]
+        self.assertEqual(node.op_type, "Conv")
+        self.assertEqual(len(node.parents), 0)
+        np.testing.assert_almost_equal(
+            node.input_tensors["weight"], w.transpose((3, 2, 0, 1)) * scale
+        )
+
+
+class DeadNodeEliminatorTest(unittest.TestCase):
+    def test_remove_side_branch(self):
+        conv_weight = _random_array((16, 3, 3, 3))
+        fc_weight = _random_array((10, 16 * 8 * 8))
+        weights = [
+            numpy_helper.from_array(conv_weight, name="conv_weight"),
+            numpy_helper.from_array(fc_weight, name="fc_weight"),
+        ]
+        inputs = [('input0', (1, 3, 10, 10))]
+        outputs = [('output0', (1, 16, 8, 8))]
+        nodes = [
+            helper.make_node(
+                "Conv", inputs=["input0", "conv_weight"], outputs=["conv"],
+                kernel_shape=(3, 3), strides=(1, 1)
+            ),
+            helper.make_node("Relu", inputs=["conv"], outputs=["output0"]),
+            # auxiliary head which doesn't reach graph outputs
+            helper.make_node("Sigmoid", inputs=["conv"], outputs=["aux"]),
+            helper.make_node(
+                "FC", inputs=["aux", "fc_weight"], outputs=["aux_fc"]
+            ),
+            # shares weight with live conv
+            helper.make_node(
+                "Conv", inputs=["input0", "conv_weight"], outputs=["tap"],
+                kernel_shape=(3, 3), strides=(1, 1)
+            ),
+        ]
+        model = _onnx_create_model(nodes, inputs, outputs, weights)
+        graph_ = Graph.from_onnx(model.graph)
+        eliminator = DeadNodeEliminator()
+        graph_ = graph_.transformed([eliminator])
+
+        self.assertEqual([n.op_type for n in graph_.nodes], ["Conv", "Relu"])
+        self.assertEqual(eliminator.num_rewrites, 3)
+        self.assertEqual(eliminator.metrics, {
+            'nodes_removed': 3,
+            'weight_bytes_removed': fc_weight.nbytes,
+            # FC of 1024 inputs and tap Conv with 3 * 3 * 3 kernel
+            'macs_removed': 10 * 1024 + 16 * 8 * 8 * 27,
+        })
+        self.assertEqual(len(graph_.nodes[0].children), 1)
+
+        pass_manager = PassManager([DeadNodeEliminator()])
+        pass_manager(Graph.from_onnx(model.graph))
+        self.assertIn("DeadNodeEliminator: macs_removed = 37888",
+                      pass_manager.summary())
+
+
+def _run_graph(graph, feeds):
+    outputs = run_graph(graph, feeds)
+    return [outputs[o[0]] for o in graph.outputs]
+
+
+class ConvBNFuserTest(unittest.TestCase):
+    def _bn_model(self, parent, parent_weights, channels, output_shape,
+                  extra_nodes=()):
+        bn_weights = [
+            numpy_helper.from_array(
+                _random_array((channels,)) + 1, name="scale"
+            ),
+            numpy_helper.from_array(_random_array((channels,)), name="bias"),
+            numpy_helper.from_array(_random_array((channels,)), name="mean"),
+            numpy_helper.from_array(
+                np.abs(_random_array((channels,))) + 0.5, name="var"
+            ),
+        ]
+        bn = helper.make_node(
+            "BatchNormalization",
+            inputs=["parent", "scale", "bias", "mean", "var"],
+            outputs=["output0"],
+            epsilon=1e-3,
+            is_test=1
+        )
+        outputs = [("output0", output_shape)]
+        outputs.extend((n.output[0], output_shape) for n in extra_nodes)
+        return _onnx_create_model(
+            [parent, bn] + list(extra_nodes), [("input0", (1, 3, 6, 6))],
+            outputs, parent_weights + bn_weights
+        )
+
+    def _assert_fused(self, model, num_nodes):
+        graph = Graph.from_onnx(model.graph)
+        x = _random_array((1, 3, 6, 6))
+        expected = _run_graph(graph, {"input0": x})
+        fuser = ConvBNFuser()
+        graph = graph.transformed([fuser])
+        self.assertEqual(len(graph.nodes), num_nodes)
+        for e, o in zip(expected, _run_graph(graph, {"input0": x})):
+            np.testing.assert_allclose(e, o, rtol=1e-4, atol=1e-5)
+        return graph
+
+    def test_fuse_conv_without_bias(self):
+        conv = helper.make_node(
+            "Conv", inputs=["input0", "weight"], outputs=["parent"],
+            kernel_shape=(3, 3), strides=(1, 1), pads=(1, 1, 1, 1)
+        )
+        weight = numpy_helper.from_array(
+            _random_array((8, 3, 3, 3)), name="weight"
+        )
+        model = self._bn_model(conv, [weight], 8, (1, 8, 6, 6))
+        graph = self._assert_fused(model, 1)
+        node = graph.nodes[0]
+        self.assertEqual(len(node.inputs), 3)
+        self.assertEqual(node.outputs, ["output0"])
+        self.assertEqual(node.input_tensors[node.inputs[2]].dtype, np.float32)
+
+    def test_fuse_gemm(self):
+        gemm = helper.make_node(
+            "Gemm", inputs=["input0", "weight", "gemm_bias"],
+            outputs=["parent"], broadcast=1, beta=0.5
+        )
+        weights = [
+            numpy_helper.from_array(
+                _random_array((3 * 6 * 6, 10)), name="weight"
+            ),
+            numpy_helper.from_array(_random_array((10,)), name="gemm_bias"),
+        ]
+        model = self._bn_model(gemm, weights, 10, (1, 10))
+        self._assert_fused(model, 1)
+
+    def test_parent_with_other_consumers(self):
+        conv = helper.make_node(
+            "Conv", inputs=["input0", "weight"], outputs=["parent"],
+            kernel_shape=(3, 3), strides=(1, 1), pads=(1, 1, 1, 1)
+        )
+        weight = numpy_helper.from_array(
+            _random_array((8, 3, 3, 3)), name="weight"
+        )
+        relu = helper.make_node("Relu", inputs=["parent"], outputs=["relu"])
+        model = self._bn_model(conv, [weight], 8, (1, 8, 6, 6), [relu])
+        self._assert_fused(model, 3)
+
+
+class ElementwiseFuserTest(unittest.TestCase):
+    def _fuse(self, parent, weights, node, constant, fusers):
+        weights = weights + [numpy_helper.from_array(constant, name="c")]
+        model = _onnx_create_model(
+            [parent, node], [("input0", (1, 3, 6, 6))],
+            [("output0", (1, 8, 6, 6))], weights
+        )
+        graph = Graph.from_onnx(model.graph)
+        x = _random_array((1, 3, 6, 6))
+        expected = _run_graph(graph, {"input0": x})[0]
+        graph = graph.transformed(fusers)
+        np.testing.assert_allclose(
+            expected, _run_graph(graph, {"input0": x})[0],
+            rtol=1e-4, atol=1e-5
+        )
+        return graph
+
+    def _conv(self):
+        conv = helper.make_node(
+            "Conv", inputs=["input0", "weight"], outputs=["parent"],
+            kernel_shape=(3, 3), strides=(1, 1), pads=(1, 1, 1, 1)
+        )
+        weight = numpy_helper.from_array(
+            _random_array((8, 3, 3, 3)), name="weight"
+        )
+        return conv, [weight]
+
+    def _fc(self):
+        fc = helper.make_node(
+            "FC", inputs=["input0", "weight", "bias"], outputs=["parent"]
+        )
+        weights = [
+            numpy_helper.from_array(
+                _random_array((8, 3 * 6 * 6)), name="weight"
+            ),
+            numpy_helper.from_array(_random_array((8,)), name="bias"),
+        ]
+        return fc, weights
+
+    def test_fuse_per_channel_mul(self):
+        conv, weights = self._conv()
+        mul = helper.make_node(
+            "Mul", inputs=["parent", "c"], outputs=["output0"],
+            broadcast=1, axis=1
+        )
+        graph = self._fuse(
+            conv, weights, mul, _random_array((8,)), [ConvMulFuser()]
+        )
+        self.assertEqual(len(graph.nodes), 1)
+
+    def test_fuse_constant_first_mul(self):
+        conv, weights = self._conv()
+        mul = helper.make_node(
+            "Mul", inputs=["c", "parent"], outputs=["output0"]
+        )
+        graph = self._fuse(
+            conv, weights, mul, _random_array((8, 1, 1)), [ConvMulFuser()]
+        )
+        self.assertEqual(len(graph.nodes), 1)
+
+    def test_fuse_scalar_div(self):
+        conv, weights = self._conv()
+        div = helper.make_node(
+            "Div", inputs=["parent", "c"], outputs=["output0"]
+        )
+        graph = self._fuse(
+            conv, weights, div, np.array([4.0], dtype=np.float32),
+            [ConvMulFuser()]
+        )
+        self.assertEqual(len(graph.nodes), 1)
+
+    def test_fuse_sub_from_constant(self):
+        fc, weights = self._fc()
+        sub = helper.make_node(
+            "Sub", inputs=["c", "parent"], outputs=["output0"]
+        )
+        graph = self._fuse(
+            fc, weights, sub, _random_array((1, 8)), [ConvAddFuser()]
+        )
+        self.assertEqual(len(graph.nodes), 1)
+
+    def test_keep_non_channel_constant(self):
+        conv, weights = self._conv()
+        add = helper.make_node(
+            "Add", inputs=["parent", "c"], outputs=["output0"]
+        )
+        graph = self._fuse(
+            conv, weights, add, _random_array((8, 6, 6)), [ConvAddFuser()]
+        )
+        self.assertEqual(len(graph.nodes), 2)
+
+
+class TransposeOptimizerTest(unittest.TestCase):
+    def _optimize(self, nodes, input_shapes, output_shape):
+        inputs = [("input{}".format(i), shape)
+                  for i, shape in enumerate(input_shapes)]
+        model = _onnx_create_model(
+            nodes, inputs, [("output0", output_shape)]
+        )
+        graph = Graph.from_onnx(model.graph)
+        feeds = {name: _random_array(shape) for name, shape in inputs}
+        expected = _run_graph(graph, feeds)[0]
+        optimizer = TransposeOptimizer()
+        graph = graph.transformed([optimizer])
+        np.testing.assert_equal(expected, _run_graph(graph, feeds)[0])
+        return graph, optimizer
+
+    def test_cancel_through_elementwise(self):
+        nodes = [
+            helper.make_node("Transpose", inputs=["input0"], outputs=["t0"],
+                             perm=[0, 2, 3, 1]),
+            helper.make_node("Transpose", inputs=["input1"], outputs=["t1"],
+                             perm=[0, 2, 3, 1]),
+            helper.make_node("Add", inputs=["t0", "t1"], outputs=["add"]),
+            helper.make_node("Relu", inputs=["add"], outputs=["relu"]),
+            helper.make_node("Transpose", inputs=["relu"], outputs=["t2"],
+                             perm=[0, 3, 1, 2]),
+            helper.make_node("Sigmoid", inputs=["t2"], outputs=["output0"]),
+        ]
+        graph, optimizer = self._optimize(
+            nodes, [(1, 3, 4, 5), (1, 3, 4, 5)], (1, 3, 4, 5)
+        )
+        self.assertEqual(
+            [n.op_type for n in graph.nodes], ["Add", "Relu", "Sigmoid"]
+        )
+        self.assertEqual(optimizer.metrics, {'layers_removed': 3})
+
+    def test_compose_transposes(self):
+        nodes = [
+            helper.make_node("Transpose", inputs=["input0"], outputs=["t0"],
+                             perm=[0, 2, 3, 1]),
+            helper.make_node("Transpose", inputs=["t0"], outputs=["output0"],
+                             perm=[0, 2, 1, 3]),
+        ]
+        graph, _ = self._optimize(nodes, [(1, 3, 4, 5)], (1, 5, 4, 3))
+        self.assertEqual(len(graph.nodes), 1)
+        self.assertEqual(graph.nodes[0].attrs['perm'], [0, 3, 2, 1])
+
+    def test_concat(self):
+        nodes = [
+            helper.make_node("Transpose", inputs=["input0"], outputs=["t0"],
+                             perm=[0, 2, 1, 3]),
+            helper.make_node("Transpose", inputs=["input1"], outputs=["t1"],
+                             perm=[0, 2, 1, 3]),
+            helper.make_node("Concat", inputs=["t0", "t1"],
+                             outputs=["output0"], axis=2),
+        ]
+        graph, _ = self._optimize(
+            nodes, [(1, 3, 4, 5), (1, 2, 4, 5)], (1, 4, 5, 5)
+        )
+        self.assertEqual(
+            [n.op_type for n in graph.nodes], ["Concat", "Transpose"]
+        )
+        self.assertEqual(graph.nodes[0].attrs['axis'], 1)
+
+    def test_collapse_reshapes(self):
+        nodes = [
+            helper.make_node("Reshape", inputs=["input0"], outputs=["r0"],
+                             shape=[1, 12, 5]),
+            helper.make_node("Reshape", inputs=["r0"], outputs=["output0"],
+                             shape=[0, 0, 5, 1]),
+        ]
+        graph, _ = self._optimize(nodes, [(1, 3, 4, 5)], (1, 12, 5, 1))
+        self.assertEqual(len(graph.nodes), 1)
+        self.assertEqual(graph.nodes[0].attrs['shape'], [1, 12, 5, 1])
+
+
+class IdentityOpRemoverTest(unittest.TestCase):
+    def test_remove_identity_chain(self):
+        nodes = [
+            helper.make_node("Relu", inputs=["input0"], outputs=["relu"]),
+            helper.make_node("Reshape", inputs=["relu"], outputs=["reshape"],
+                             shape=[1, -1, 4, 0]),
+            helper.make_node("Transpose", inputs=["reshape"],
+                             outputs=["transpose"], perm=[0, 1, 2, 3]),
+            helper.make_node("Pad", inputs=["transpose"], outputs=["pad"],
+                             paddings=[0, 0, 0, 0]),
+            helper.make_node("Slice", inputs=["pad"], outputs=["slice"],
+                             axes=[1, 3], starts=[0, 0],
+                             ends=[3, 2 ** 31 - 1]),
+            helper.make_node("Concat", inputs=["slice"], outputs=["output0"],
+                             axis=1),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 4, 5))], [("output0", (1, 3, 4, 5))]
+        )
+        graph = Graph.from_onnx(model.graph)
+        remover = IdentityOpRemover()
+        graph = graph.transformed([remover])
+        self.assertEqual(remover.num_rewrites, 5)
+        self.assertEqual(len(graph.nodes), 1)
+        self.assertEqual(graph.nodes[0].outputs, ["output0"])
+
+    def test_graph_output_with_other_consumers(self):
+        nodes = [
+            helper.make_node("Relu", inputs=["input0"], outputs=["relu"]),
+            helper.make_node("Sigmoid", inputs=["relu"], outputs=["output1"]),
+            helper.make_node("Sum", inputs=["relu"], outputs=["output0"]),
+            # not an identity, input shape is different
+            helper.make_node("Reshape", inputs=["relu"], outputs=["output2"],
+                             shape=[1, 3, 20]),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 4, 5))],
+            [("output0", (1, 3, 4, 5)), ("output1", (1, 3, 4, 5)),
+             ("output2", (1, 3, 20))]
+        )
+        graph = Graph.from_onnx(model.graph)
+        graph = graph.transformed([IdentityOpRemover()])
+        self.assertEqual(
+            [n.op_type for n in graph.nodes], ["Relu", "Sigmoid", "Reshape"]
+        )
+        relu = graph.nodes[0]
+        self.assertEqual(relu.outputs, ["output0"])
+        self.assertEqual(
+            [n.inputs for n in relu.children], [["output0"], ["output0"]]
+        )
+
+
+class PadFuserTest(unittest.TestCase):
+    def _fuse(self, nodes, output_shape, initializer=()):
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 8, 8))], [("output0", output_shape)],
+            list(initializer)
+        )
+        graph = Graph.from_onnx(model.graph)
+        x = _random_array((1, 3, 8, 8))
+        expected = _run_graph(graph, {"input0": x})[0]
+        graph = graph.transformed([PadFuser()])
+        np.testing.assert_allclose(
+            expected, _run_graph(graph, {"input0": x})[0],
+            rtol=1e-5, atol=1e-5
+        )
+        return graph
+
+    def _pad(self, output, value=0.0, **kwargs):
+        return helper.make_node(
+            "Pad", inputs=["input0"], outputs=[output],
+            paddings=[0, 0, 1, 0, 0, 0, 2, 1], value=value, **kwargs
+        )
+
+    def test_fuse_conv(self):
+        weight = numpy_helper.from_array(
+            _random_array((4, 3, 3, 3)), name="weight"
+        )
+        conv = helper.make_node(
+            "Conv", inputs=["pad", "weight"], outputs=["output0"],
+            kernel_shape=(3, 3), strides=(1, 1), pads=(1, 1, 1, 1)
+        )
+        graph = self._fuse([self._pad("pad"), conv], (1, 4, 9, 7), [weight])
+        self.assertEqual(len(graph.nodes), 1)
+        self.assertEqual(graph.nodes[0].inputs[0], "input0")
+        self.assertEqual(graph.nodes[0].attrs['pads'], [2, 1, 3, 2])
+
+    def test_mode(self):
+        pool = helper.make_node(
+            "AveragePool", inputs=["pad"], outputs=["output0"],
+            kernel_shape=(2, 2), strides=(2, 2)
+        )
+        graph = self._fuse(
+            [self._pad("pad", mode="constant"), pool], (1, 3, 5, 4)
+        )
+        self.assertEqual([n.op_type for n in graph.nodes], ["AveragePool"])
+
+        graph = self._fuse(
+            [self._pad("pad", mode="reflect"), pool], (1, 3, 5, 4)
+        )
+        self.assertEqual([n.op_type for n in graph.nodes],
+                         ["Pad", "AveragePool"])
+
+    def test_fuse_average_pool(self):
+        pool = helper.make_node(
+            "AveragePool", inputs=["pad"], outputs=["output0"],
+            kernel_shape=(2, 2), strides=(2, 2)
+        )
+        graph = self._fuse([self._pad("pad"), pool], (1, 3, 5, 4))
+        self.assertEqual(len(graph.nodes), 1)
+        self.assertEqual(graph.nodes[0].attrs['count_include_pad'], 1)
+
+    def test_max_pool(self):
+        pool = helper.make_node(
+            "MaxPool", inputs=["pad"], outputs=["output0"],
+            kernel_shape=(2, 2), strides=(2, 2)
+        )
+        # negative inputs could be replaced by padded zeros
+        graph = self._fuse([self._pad("pad"), pool], (1, 3, 5, 4))
+        self.assertEqual(len(graph.nodes), 2)
+
+        graph = self._fuse(
+            [self._pad("pad", value=-np.inf), pool], (1, 3, 5, 4)
+        )
+        self.assertEqual(len(graph.nodes), 1)
+
+        relu = helper.make_node("Relu", inputs=["input0"], outputs=["relu"])
+        pad = self._pad("pad")
+        pad.input[0] = "relu"
+        graph = self._fuse([relu, pad, pool], (1, 3, 5, 4))
+        self.assertEqual(len(graph.nodes), 2)
+
+
+class SiblingConvMergerTest(unittest.TestCase):
+    def _conv(self, name, output_channels, bias=True, kernel_shape=(3, 3)):
+        inputs = ["relu", name + "_weight"]
+        weights = [numpy_helper.from_array(
+            _random_array((output_channels, 3) + kernel_shape),
+            name=name + "_weight"
+        )]
+        if bias:
+            inputs.append(name + "_bias")
+            weights.append(numpy_helper.from_array(
+                _random_array((output_channels,)), name=name + "_bias"
+            ))
+        conv = helper.make_node(
+            "Conv", inputs=inputs, outputs=[name], kernel_shape=kernel_shape,
+            strides=(1, 1), pads=[k // 2 for k in kernel_shape * 2]
+        )
+        return conv, weights
+
+    def _merge(self, nodes, weights, outputs):
+        relu = helper.make_node("Relu", inputs=["input0"], outputs=["relu"])
+        model = _onnx_create_model(
+            [relu] + nodes, [("input0", (1, 3, 6, 6))], outputs, weights
+        )
+        graph = Graph.from_onnx(model.graph)
+        x = _random_array((1, 3, 6, 6))
+        expected = _run_graph(graph, {"input0": x})
+        merger = SiblingConvMerger()
+        graph = graph.transformed([merger])
+        for e, o in zip(expected, _run_graph(graph, {"input0": x})):
+            np.testing.assert_allclose(e, o, rtol=1e-5, atol=1e-5)
+        return graph, merger
+
+    def test_merge_concatenated(self):
+        conv_1, weights_1 = self._conv("conv_1", 4)
+        conv_2, weights_2 = self._conv("conv_2", 2, bias=False)
+        conv_3, weights_3 = self._conv("conv_3", 5, kernel_shape=(1, 1))
+        concat = helper.make_node(
+            "Concat", inputs=["conv_3", "conv_2", "conv_1"],
+            outputs=["output0"], axis=1
+        )
+        graph, merger = self._merge(
+            [conv_1, conv_2, conv_3, concat],
+            weights_1 + weights_2 + weights_3, [("output0", (1, 11, 6, 6))]
+        )
+        self.assertEqual(merger.metrics, {'convolutions_merged': 1})
+        self.assertEqual(
+            [n.op_type for n in graph.nodes],
+            ["Relu", "Conv", "Conv", "Concat"]
+        )
+
+    def test_merge_with_split(self):
+        conv_1, weights_1 = self._conv("conv_1", 4)
+        conv_2, weights_2 = self._conv("conv_2", 2)
+        sigmoid = helper.make_node(
+            "Sigmoid", inputs=["conv_2"], outputs=["output1"]
+        )
+        conv_1.output[0] = "output0"
+        graph, merger = self._merge(
+            [conv_1, conv_2, sigmoid], weights_1 + weights_2,
+            [("output0", (1, 4, 6, 6)), ("output1", (1, 2, 6, 6))]
+        )
+        self.assertEqual(merger.metrics, {'convolutions_merged': 1})
+        self.assertEqual(
+            [n.op_type for n in graph.nodes],
+            ["Relu", "Conv", "Split", "Sigmoid"]
+        )
+        self.assertEqual(graph.nodes[2].outputs, ["output0", "conv_2"])
+
+
+class ElementwiseFlattenerTest(unittest.TestCase):
+    def test_flatten_chains(self):
+        nodes = [
+            helper.make_node("Relu", inputs=["input0"], outputs=["a"]),
+            helper.make_node("Sigmoid", inputs=["input0"], outputs=["b"]),
+            helper.make_node("Abs", inputs=["input0"], outputs=["c"]),
+            helper.make_node("Add", inputs=["a", "b"], outputs=["ab"]),
+            helper.make_node("Add", inputs=["c", "ab"], outputs=["abc"]),
+            # intermediate result used twice is kept
+            helper.make_node("Mul", inputs=["abc", "a"], outputs=["m0"]),
+            helper.make_node("Mul", inputs=["m0", "b"], outputs=["m1"]),
+            helper.make_node("Sum", inputs=["abc", "m1", "a"],
+                             outputs=["output0"]),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 4, 5))], [("output0", (1, 3, 4, 5))]
+        )
+        graph = Graph.from_onnx(model.graph)
+        x = _random_array((1, 3, 4, 5))
+        expected = _run_graph(graph, {"input0": x})[0]
+        flattener = ElementwiseFlattener()
+        graph = graph.transformed([flattener])
+        np.testing.assert_allclose(
+            expected, _run_graph(graph, {"input0": x})[0], rtol=1e-6
+        )
+        self.assertEqual(flattener.metrics, {'layers_removed': 2})
+        ops = [(n.op_type, n.inputs) for n in graph.nodes[3:]]
+        self.assertEqual(ops, [
+            ("Sum", ["c", "a", "b"]),
+            ("Mul", ["abc", "a", "b"]),
+            ("Sum", ["abc", "m1", "a"]),
+        ])
+
+
+class PreprocessingFolderTest(unittest.TestCase):
+    def test_fold_into_convs(self):
+        weights = [
+            numpy_helper.from_array(
+                _random_array((8, 3, 3, 3)), name="weight_1"
+            ),
+            numpy_helper.from_array(_random_array((8,)), name="bias_1"),
+            numpy_helper.from_array(
+                _random_array((6, 1, 1, 1)), name="weight_2"
+            ),
+        ]
+        nodes = [
+            helper.make_node(
+                "Conv", inputs=["input0", "weight_1", "bias_1"],
+                outputs=["output0"], kernel_shape=(3, 3), strides=(1, 1)
+            ),
+            # depthwise, padding doesn't matter without biases
+            helper.make_node(
+                "Conv", inputs=["input1", "weight_2"],
+                outputs=["output1"], kernel_shape=(1, 1), strides=(1, 1),
+                group=3, pads=(1, 1, 1, 1)
+            ),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 6, 6)), ("input1", (1, 3, 6, 6))],
+            [("output0", (1, 8, 4, 4)), ("output1", (1, 6, 8, 8))], weights
+        )
+        graph = Graph.from_onnx(model.graph)
+        bias = np.array([-0.5, 0.1, 0.2], dtype=np.float32).reshape(3, 1, 1)
+        x = _random_array((1, 3, 6, 6))
+        feeds = {"input0": x * 0.5 + bias, "input1": x * 2.0}
+        expected = _run_graph(graph, feeds)
+
+        folder = PreprocessingFolder({
+            "input0": (0.5, bias.reshape(-1)),
+            "input1": (2.0, [0.0, 0.0, 0.0]),
+        })
+        graph = folder(graph)
+        self.assertEqual(sorted(folder.folded), ["input0", "input1"])
+        outputs = _run_graph(graph, {"input0": x, "input1": x})
+        for e, o in zip(expected, outputs):
+            np.testing.assert_allclose(e, o, rtol=1e-4, atol=1e-5)
+
+    def test_failures(self):
+        nodes = [
+            helper.make_node("Relu", inputs=["input0"], outputs=["output0"]),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 6, 6))], [("output0", (1, 3, 6, 6))]
+        )
+        folder = PreprocessingFolder({"input0": (1.0, [1.0, 1.0, 1.0])})
+        folder(Graph.from_onnx(model.graph))
+        self.assertEqual(folder.folded, [])
+        self.assertEqual(list(folder.failures), ["input0"])
+
+        # input used as convolution weights
+        nodes = [
+            helper.make_node("Conv", inputs=["input0", "input1"],
+                             outputs=["output0"], kernel_shape=(1, 1)),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 6, 6)), ("input1", (3, 3, 1, 1))],
+            [("output0", (1, 3, 6, 6))]
+        )
+        folder = PreprocessingFolder({
+            "input0": (2.0, [0.0, 0.0, 0.0]),
+            "input1": (2.0, [0.0, 0.0, 0.0]),
+        })
+        folder(Graph.from_onnx(model.graph))
+        self.assertEqual(folder.folded, [])
+        self.assertEqual(
+            folder.failures["input1"],
+            "it is not the only data input of convolution output0"
+        )
+        self.assertEqual(
+            folder.failures["input0"],
+            "convolution output0 doesn't have constant weights"
+        )
+
+
+class DeprocessingFolderTest(unittest.TestCase):
+    def test_fold_bn(self):
+        channels = 3
+        weights = [
+            numpy_helper.from_array(
+                _random_array((channels,)) + 1, name="scale"
+            ),
+            numpy_helper.from_array(_random_array((channels,)), name="bias"),
+            numpy_helper.from_array(_random_array((channels,)), name="mean"),
+            numpy_helper.from_array(
+                np.abs(_random_array((channels,))) + 0.5, name="var"
+            ),
+        ]
+        bn = helper.make_node(
+            "BatchNormalization",
+            inputs=["input0", "scale", "bias", "mean", "var"],
+            outputs=["output0"], is_test=1
+        )
+        model = _onnx_create_model(
+            [bn], [("input0", (1, 3, 4, 4))], [("output0", (1, 3, 4, 4))],
+            weights
+        )
+        graph = Graph.from_onnx(model.graph)
+        x = _random_array((1, 3, 4, 4))
+        bias = np.array([1.0, 2.0, 3.0], dtype=np.float32)
+        expected = _run_graph(graph, {"input0": x})[0] * 255.0 + \
+            bias.reshape(3, 1, 1)
+        folder = DeprocessingFolder({"output0": (255.0, bias)})
+        graph = folder(graph)
+        self.assertEqual(folder.folded, ["output0"])
+        # outputs close to zero lose relative precision to cancellation
+        np.testing.assert_allclose(
+            expected, _run_graph(graph, {"input0": x})[0], rtol=1e-4,
+            atol=1e-3
+        )
+
+
+class ActivationFuserTest(unittest.TestCase):
+    def _fuse(self, nodes, constants):
+        weights = [
+            numpy_helper.from_array(np.array([v], dtype=np.float32), name=n)
+            for n, v in sorted(constants.items())
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 4, 5))], [("output0", (1, 3, 4, 5))],
+            weights
+        )
+        graph = Graph.from_onnx(model.graph)
+        x = _random_array((1, 3, 4, 5)) * 10
+        expected = _run_graph(graph, {"input0": x})[0]
+        fuser = ActivationFuser()
+        graph = graph.transformed([fuser])
+        np.testing.assert_allclose(
+            expected, _run_graph(graph, {"input0": x})[0],
+            rtol=1e-5, atol=1e-6
+        )
+        return graph, fuser
+
+    def test_relu6(self):
+        nodes = [
+            helper.make_node("Relu", inputs=["input0"], outputs=["relu"]),
+            helper.make_node("Min", inputs=["relu", "six"],
+                             outputs=["output0"]),
+        ]
+        graph, fuser = self._fuse(nodes, {"six": 6.0})
+        self.assertEqual([n.op_type for n in graph.nodes], ["Clip"])
+        self.assertEqual(graph.nodes[0].attrs, {'min': 0.0, 'max': 6.0})
+        self.assertEqual(graph.nodes[0].inputs, ["input0"])
+        self.assertEqual(fuser.metrics, {'layers_removed': 1})
+
+    def test_hard_swish(self):
+        nodes = [
+            helper.make_node("Add", inputs=["input0", "three"],
+                             outputs=["shifted"]),
+            helper.make_node("Max", inputs=["zero", "shifted"],
+                             outputs=["positive"]),
+            helper.make_node("Min", inputs=["positive", "six"],
+                             outputs=["clipped"]),
+            helper.make_node("Div", inputs=["clipped", "six"],
+                             outputs=["hard_sigmoid"]),
+            helper.make_node("Mul", inputs=["input0", "hard_sigmoid"],
+                             outputs=["output0"]),
+        ]
+        graph, fuser = self._fuse(
+            nodes, {"three": 3.0, "six": 6.0, "zero": 0.0}
+        )
+        self.assertEqual(
+            [n.op_type for n in graph.nodes], ["HardSigmoid", "Mul"]
+        )
+        self.assertEqual(graph.nodes[0].inputs, ["input0"])
+        np.testing.assert_allclose(graph.nodes[0].attrs['alpha'], 1 / 6.0)
+        np.testing.assert_allclose(graph.nodes[0].attrs['beta'], 0.5)
+        self.assertEqual(fuser.metrics, {'layers_removed': 3})
+
+    def test_leaky_relu(self):
+        nodes = [
+            helper.make_node("Mul", inputs=["slope", "input0"],
+                             outputs=["scaled"]),
+            helper.make_node("Max", inputs=["scaled", "input0"],
+                             outputs=["output0"]),
+        ]
+        graph, _ = self._fuse(nodes, {"slope": 0.1})
+        self.assertEqual([n.op_type for n in graph.nodes], ["LeakyRelu"])
+        self.assertEqual(graph.nodes[0].inputs, ["input0"])
+
+    def test_keep_other_scales(self):
+        # Relu6(x) / 3 is not a HardSigmoid, the clip is still composed
+        nodes = [
+            helper.make_node("Relu", inputs=["input0"], outputs=["relu"]),
+            helper.make_node("Min", inputs=["relu", "six"],
+                             outputs=["relu6"]),
+            helper.make_node("Div", inputs=["relu6", "three"],
+                             outputs=["output0"]),
+        ]
+        graph, _ = self._fuse(nodes, {"three": 3.0, "six": 6.0})
+        self.assertEqual([n.op_type for n in graph.nodes], ["Clip", "Div"])
+
+
+class DeadChannelPrunerTest(unittest.TestCase):
+    def _conv(self, name, input_, W, pads=(0, 0, 0, 0), **kwargs):
+        self.weights.append(numpy_helper.from_array(W, name=name + "_W"))
+        self.weights.append(numpy_helper.from_array(
+            _random_array((W.shape[0],)), name=name + "_b"
+        ))
+        return helper.make_node(
+            "Conv", inputs=[input_, name + "_W", name + "_b"],
+            outputs=[name], kernel_shape=W.shape[2:], pads=pads, **kwargs
+        )
+
+    def test_prune(self):
+        self.weights = []
+        W1 = _random_array((8, 3, 3, 3))
+        W1[[2, 5, 6]] = 0
+        W2 = _random_array((4, 3, 1, 1))
+        W2[1] = 0
+        channels = 8
+        gamma = _random_array((channels,)) + 1
+        gamma[3] = 0
+        self.weights += [
+            numpy_helper.from_array(gamma, name="scale"),
+            numpy_helper.from_array(_random_array((channels,)), name="bias"),
+            numpy_helper.from_array(_random_array((channels,)), name="mean"),
+            numpy_helper.from_array(
+                np.abs(_random_array((channels,))) + 0.5, name="var"
+            ),
+        ]
+        nodes = [
+            self._conv("conv1", "input0", W1, pads=(1, 1, 1, 1)),
+            helper.make_node(
+                "BatchNormalization",
+                inputs=["conv1", "scale", "bias", "mean", "var"],
+                outputs=["bn"], is_test=1
+            ),
+            helper.make_node("Relu", inputs=["bn"], outputs=["relu"]),
+            self._conv("depthwise", "relu", _random_array((8, 1, 3, 3)),
+                       group=8),
+            self._conv("conv2", "input0", W2),
+            helper.make_node("MaxPool", inputs=["conv2"], outputs=["pool"],
+                             kernel_shape=(3, 3), strides=(1, 1)),
+            helper.make_node("Concat", inputs=["depthwise", "pool"],
+                             outputs=["concat"], axis=1),
+            self._conv("conv3", "concat", _random_array((5, 12, 1, 1))),
+            helper.make_node("Sigmoid", inputs=["conv3"],
+                             outputs=["output0"]),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 8, 8))], [("output0", (1, 5, 6, 6))],
+            self.weights
+        )
+        graph = Graph.from_onnx(model.graph)
+        x = _random_array((1, 3, 8, 8))
+        expected = _run_graph(graph, {"input0": x})[0]
+        pruner = DeadChannelPruner()
+        graph = graph.transformed([pruner])
+        np.testing.assert_allclose(
+            expected, _run_graph(graph, {"input0": x})[0],
+            rtol=1e-4, atol=1e-5
+        )
+        self.assertEqual(pruner.metrics['channels_removed'], 9)
+        shapes = dict(
+            (n.name, n.input_tensors[n.inputs[1]].shape) for n in graph.nodes
+            if n.op_type in ("Conv", "BatchNormalization")
+        )
+        self.assertEqual(shapes["conv1"], (4, 3, 3, 3))
+        self.assertEqual(shapes["bn"], (4,))
+        self.assertEqual(shapes["depthwise"], (4, 1, 3, 3))
+        self.assertEqual(shapes["conv2"], (3, 3, 1, 1))
+        self.assertEqual(shapes["conv3"], (5, 7, 1, 1))
+
+    def test_grouped_consumer(self):
+        self.weights = []
+        W = _random_array((4, 3, 1, 1))
+        W[1] = 0
+        nodes = [
+            self._conv("conv1", "input0", W),
+            self._conv("grouped", "conv1", _random_array((6, 2, 1, 1)),
+                       group=2),
+            helper.make_node("Relu", inputs=["grouped"],
+                             outputs=["output0"]),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 8, 8))], [("output0", (1, 6, 8, 8))],
+            self.weights
+        )
+        graph = Graph.from_onnx(model.graph)
+        x = _random_array((1, 3, 8, 8))
+        expected = _run_graph(graph, {"input0": x})[0]
+        pruner = DeadChannelPruner()
+        graph = graph.transformed([pruner])
+        np.testing.assert_allclose(
+            expected, _run_graph(graph, {"input0": x})[0],
+            rtol=1e-4, atol=1e-5
+        )
+        # input channels of grouped convolution can't be removed
+        self.assertEqual(pruner.metrics['channels_removed'], 0)
+        self.assertEqual(graph.nodes[1].input_tensors["grouped_W"].shape,
+                         (6, 2, 1, 1))
+
+    def test_keep_output_channels(self):
+        self.weights = []
+        W = _random_array((4, 3, 1, 1))
+        W[0] = 0
+        nodes = [self._conv("output0", "input0", W)]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 8, 8))], [("output0", (1, 4, 8, 8))],
+            self.weights
+        )
+        pruner = DeadChannelPruner()
+        graph = Graph.from_onnx(model.graph).transformed([pruner])
+        self.assertEqual(pruner.metrics['channels_removed'], 0)
+        self.assertEqual(
+            graph.nodes[0].input_tensors["output0_W"].shape, (4, 3, 1, 1)
+        )
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,125 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+import numpy as np
+
+from onnx import helper, numpy_helper
+
+from onnx_coreml import convert
+from onnx_coreml._validation import validate, format_validation_report
+from tests._test_utils import _onnx_create_model, _random_array
+
+
+def _model():
+    weights = [
+        numpy_helper.from_array(_random_array((4, 3, 3, 3)), name="W1"),
+        numpy_helper.from_array(_random_array((4, 4, 3, 3)), name="W2"),
+        numpy_helper.from_array(_random_array((4,)), name="b2"),
+    ]
+    nodes = [
+        helper.make_node("Conv", inputs=["input0", "W1"], outputs=["conv1"],
+                         kernel_shape=(3, 3), pads=(1, 1, 1, 1),
+                         strides=(1, 1)),
+        helper.make_node("Relu", inputs=["conv1"], outputs=["relu"]),
+        helper.make_node("Conv", inputs=["relu", "W2", "b2"],
+                         outputs=["conv2"], kernel_shape=(3, 3),
+                         strides=(1, 1)),
+        helper.make_node("MaxPool", inputs=["conv2"], outputs=["output0"],
+                         kernel_shape=(2, 2), strides=(2, 2)),
+    ]
+    return _onnx_create_model(
+        nodes, [("input0", (1, 3, 8, 8))], [("output0", (1, 4, 3, 3))],
+        weights
+    )
+
+
+class ValidationTest(unittest.TestCase):
+    def test_validate(self):
+        model = _model()
+        report = validate(model, convert(model), num_batches=3,
+                          batch_size=2, processes=1)
+        self.assertTrue(report.passed)
+        self.assertEqual(report.num_samples, 6)
+        self.assertIsNone(report.first_divergent_layer)
+        stats = report.outputs["output0"]
+        self.assertEqual(stats.num_values, 6 * 4 * 3 * 3)
+        self.assertEqual(stats.abs_histogram.sum(), stats.num_values)
+        self.assertEqual(
+            [(name, type_) for name, type_, _ in report.layers],
+            [("conv1", "convolution"), ("relu", "activation"),
+             ("conv2", "convolution"), ("output0", "pooling")]
+        )
+        self.assertIn("passed", format_validation_report(report))
+
+    def test_first_divergent_layer(self):
+        model = _model()
+        spec = convert(model).get_spec()
+        bias = spec.neuralNetwork.layers[2].convolution.bias
+        bias.floatValue[1] += 1.0
+        report = validate(model, spec, num_batches=2, batch_size=2,
+                          processes=1)
+        self.assertFalse(report.passed)
+        name, type_, stats = report.first_divergent_layer
+        self.assertEqual(name, "conv2")
+        self.assertAlmostEqual(stats.max_abs_error, 1.0, places=4)
+        self.assertIn("first divergent layer: conv2",
+                      format_validation_report(report))
+
+    def test_process_pool(self):
+        model = _model()
+        spec = convert(model).get_spec()
+        batches = [{"input0": _random_array((3, 3, 8, 8))}
+                   for _ in range(4)]
+        expected = validate(model, spec, batches, processes=1)
+        report = validate(model, spec, batches, processes=2)
+        self.assertEqual(report.num_samples, 12)
+        for name, stats in expected.outputs.items():
+            np.testing.assert_equal(report.outputs[name].abs_histogram,
+                                    stats.abs_histogram)
+            self.assertEqual(report.outputs[name].max_abs_error,
+                             stats.max_abs_error)
+
+    def test_deprocessing(self):
+        weights = [
+            numpy_helper.from_array(_random_array((3, 3, 3, 3)), name="W"),
+            numpy_helper.from_array(_random_array((3,)), name="b"),
+        ]
+        nodes = [
+            helper.make_node("Conv", inputs=["input0", "W", "b"],
+                             outputs=["output0"], kernel_shape=(3, 3),
+                             pads=(1, 1, 1, 1), strides=(1, 1)),
+        ]
+        model = _onnx_create_model(
+            nodes, [("input0", (1, 3, 8, 8))], [("output0", (1, 3, 8, 8))],
+            weights
+        )
+        deprocessing_args = {
+            'image_scale': 2.0,
+            'red_bias': 1.0, 'green_bias': 2.0, 'blue_bias': 3.0,
+        }
+        deprocessing = {"output0": (2.0, [1.0, 2.0, 3.0])}
+        for fold in [True, False]:
+            coreml_model = convert(
+                model, image_output_names=["output0"],
+                deprocessing_args=deprocessing_args,
+                fold_deprocessing=fold
+            )
+            self.assertEqual(
+                coreml_model.conversion_stats['deprocessing']['folded'],
+                ["output0"] if fold else []
+            )
+            report = validate(model, coreml_model, num_batches=2,
+                              batch_size=2, processes=1)
+            self.assertFalse(report.passed)
+            report = validate(model, coreml_model, num_batches=2,
+                              batch_size=2, processes=1,
+                              deprocessing=deprocessing)
+            self.assertTrue(report.passed)
+            self.assertIsNone(report.first_divergent_layer)
+
+
+if __name__ == '__main__':
+    unittest.main()